@@ -0,0 +1,141 @@
+"""Compare speculative decoding drafts (see common/speculative.py) on a set of prompts.
+
+For every draft it loads the main model with that draft attached and
+measures, per prompt:
+
+- wall-clock latency (median of ``--repeat`` runs) and generated tokens per
+  second;
+- the draft's acceptance rate and the tokens each evaluation of the main model
+  yields;
+- whether the answer is the one generated without a draft. With
+  ``--temperature 0`` it must be identical: every position is sampled from the
+  main model, whatever the draft proposed.
+
+Usage (from src/):
+    python bench/llm_speculative_bench.py [--drafts off,prompt-lookup,model]
+        [--draft-tokens 8] [--max-tokens 256] [--temperature 0] [--repeat 3]
+        [--json results.json] prompt [prompt ...]
+
+The prompts are required. ``@file`` reads arguments from a file, one per
+line, e.g. the transcripts of the k6 scenario audio.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(SRC, "common"))
+
+from llama_cpp import Llama  # noqa: E402
+from llama_cpp.llama_speculative import LlamaPromptLookupDecoding  # noqa: E402
+from speculative import DRAFT_MODEL, DraftStats, MeasuredDraft, SmallModelDraft  # noqa: E402
+
+# The services' system prompt, so the answers have their usual length
+SYSTEM_PROMPT = """
+            Você é um assistente financeiro.
+            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado.
+            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
+            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
+
+            """.strip()
+
+
+def _draft(name: str, args, stats: DraftStats):
+    if name == "off":
+        return None
+    if name == "prompt-lookup":
+        return MeasuredDraft(LlamaPromptLookupDecoding(max_ngram_size=args.ngram, num_pred_tokens=args.draft_tokens), stats)
+    if name == "model":
+        return MeasuredDraft(SmallModelDraft(args.draft_model, args.ctx, args.draft_tokens), stats)
+    raise ValueError(f"Unknown draft {name!r}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, fromfile_prefix_chars="@"
+    )
+    parser.add_argument("prompts", nargs="+", help="user prompts (@file: one per line)")
+    parser.add_argument("--model", default="./models/Meta-Llama-3-8B-Instruct.Q5_K_S.gguf")
+    parser.add_argument("--ctx", type=int, default=512)
+    parser.add_argument("--drafts", default="off,prompt-lookup,model")
+    parser.add_argument("--draft-model", default=DRAFT_MODEL)
+    parser.add_argument("--draft-tokens", type=int, default=8)
+    parser.add_argument("--ngram", type=int, default=2)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    prompts = [(f"prompt{i + 1}", p) for i, p in enumerate(args.prompts)]
+
+    results = []
+    baseline = {}
+    for name in args.drafts.split(","):
+        stats = DraftStats()
+        try:
+            draft = _draft(name, args, stats)
+            llm = Llama(model_path=args.model, n_ctx=args.ctx, n_gpu_layers=-1, draft_model=draft, verbose=False)
+        except Exception as e:
+            print(f"[SKIP] {name}: {e}")
+            continue
+        messages = lambda prompt: [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+        # Warm-up: the first call pays for the system prompt and allocator growth
+        llm.create_chat_completion(messages=messages(prompts[0][1]), max_tokens=8, temperature=0.0)
+        for label, prompt in prompts:
+            before = stats.stats()
+            latencies = []
+            text, tokens = "", 0
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                out = llm.create_chat_completion(
+                    messages=messages(prompt),
+                    max_tokens=args.max_tokens,
+                    temperature=args.temperature,
+                    top_p=0.9,
+                    top_k=40,
+                    repeat_penalty=1.1,
+                )
+                latencies.append(time.perf_counter() - started)
+                text = out["choices"][0]["message"]["content"].strip()
+                tokens = out["usage"]["completion_tokens"]
+            after = stats.stats()
+            proposed = after["proposed"] - before["proposed"]
+            accepted = after["accepted"] - before["accepted"]
+            steps = after["steps"] - before["steps"]
+            baseline.setdefault(label, text)
+            latency = statistics.median(latencies)
+            results.append({
+                "draft": name,
+                "prompt": label,
+                "latency_seconds": round(latency, 3),
+                "completion_tokens": tokens,
+                "tokens_per_second": round(tokens / latency, 2) if latency else 0.0,
+                "acceptance_rate": round(accepted / proposed, 3) if proposed else 0.0,
+                "tokens_per_step": round(1 + accepted / steps, 2) if steps else 1.0,
+                "same_as_baseline": text == baseline[label],
+                "text": text,
+            })
+        del llm
+
+    header = f"{'draft':<15}{'prompt':<18}{'latency s':>11}{'tokens':>8}{'tok/s':>8}{'accept':>8}{'tok/step':>10}{'same':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['draft']:<15}{r['prompt'][:17]:<18}{r['latency_seconds']:>11.3f}{r['completion_tokens']:>8}"
+            f"{r['tokens_per_second']:>8.1f}{r['acceptance_rate']:>8.3f}{r['tokens_per_step']:>10.2f}{'yes' if r['same_as_baseline'] else 'no':>6}"
+        )
+    print(f"\n'same' compares with the first draft's answer; at temperature {args.temperature:g} "
+          + ("it must always be yes." if args.temperature == 0 else "sampling makes answers differ run to run."))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
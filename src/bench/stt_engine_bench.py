@@ -0,0 +1,133 @@
+"""Compare STT engines (see common/stt_engine.py) on a set of audio files.
+
+For every engine it measures, per audio file:
+
+- load time and resident memory after loading;
+- wall-clock latency (median of ``--repeat`` runs) and real-time factor
+  (latency / audio duration);
+- CPU time per run (all threads of this process);
+- word error rate against ``<audio>.txt`` next to the file, when there is
+  one. Otherwise the first engine's transcript serves as the reference, so
+  the column becomes the disagreement with the default backend.
+
+Usage (from src/):
+    python bench/stt_engine_bench.py [--engines whisper,whisper-int8,ctranslate2]
+        [--model-size small] [--repeat 3] [--json results.json] audio [audio ...]
+
+The audio files are required: the repository ships none. The k6 scripts
+expect theirs in */k6/input/ (e.g. thrift/k6/input/cenario1.mp3).
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(SRC, "common"))
+
+from audio import SAMPLE_RATE, decode_audio  # noqa: E402
+from stt_engine import ENGINES, load_engine  # noqa: E402
+
+
+def _words(text: str) -> list:
+    return re.sub(r"[^\w\s]", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    # Levenshtein distance over words, one row at a time
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("audio", nargs="+", help="audio files, with an optional <audio>.txt reference transcript")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--model-size", default=os.getenv("WHISPER_MODEL_SIZE", "small"))
+    parser.add_argument("--language", default="pt")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    inputs = []
+    for path in args.audio:
+        with open(path, "rb") as f:
+            samples = decode_audio(f.read())
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        reference = open(reference_path, encoding="utf-8").read() if os.path.exists(reference_path) else None
+        inputs.append((os.path.basename(path), samples, reference))
+
+    results = []
+    baseline = {}
+    baseline_engine = None
+    for name in args.engines.split(","):
+        started = time.perf_counter()
+        try:
+            engine = load_engine(args.model_size, language=args.language, engine=name)
+        except Exception as e:
+            print(f"[SKIP] {name}: {e}")
+            continue
+        load_seconds = time.perf_counter() - started
+        rss = _rss_mb()
+        # Warm-up: first call pays for lazy initialization and allocator growth
+        engine.transcribe(inputs[0][1][: SAMPLE_RATE * 5])
+        for filename, samples, reference in inputs:
+            latencies, cpu = [], []
+            text = ""
+            for _ in range(args.repeat):
+                wall, proc = time.perf_counter(), time.process_time()
+                text = engine.transcribe(samples)
+                latencies.append(time.perf_counter() - wall)
+                cpu.append(time.process_time() - proc)
+            baseline.setdefault(filename, text)
+            baseline_engine = baseline_engine or name
+            duration = len(samples) / SAMPLE_RATE
+            latency = statistics.median(latencies)
+            results.append({
+                "engine": name,
+                "model_size": args.model_size,
+                "file": filename,
+                "audio_seconds": round(duration, 2),
+                "load_seconds": round(load_seconds, 2),
+                "max_rss_mb": round(rss, 1),
+                "latency_seconds": round(latency, 3),
+                "rtf": round(latency / duration, 3) if duration else 0.0,
+                "cpu_seconds": round(statistics.median(cpu), 3),
+                "wer": round(word_error_rate(reference or baseline[filename], text), 4),
+                "wer_reference": "transcript" if reference else f"{baseline_engine} output",
+                "text": text.strip(),
+            })
+        del engine
+
+    header = f"{'engine':<14}{'file':<18}{'audio s':>8}{'load s':>8}{'RSS MB':>8}{'latency s':>11}{'RTF':>7}{'CPU s':>8}{'WER':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['engine']:<14}{r['file'][:17]:<18}{r['audio_seconds']:>8.1f}{r['load_seconds']:>8.1f}{r['max_rss_mb']:>8.0f}"
+            f"{r['latency_seconds']:>11.3f}{r['rtf']:>7.3f}{r['cpu_seconds']:>8.2f}{r['wer']:>7.3f}"
+        )
+    print("\nRSS is the peak of this process, so it only grows from one engine to the next.")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
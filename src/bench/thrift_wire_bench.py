@@ -0,0 +1,211 @@
+"""Compare Thrift wire formats on the audio-heavy messages.
+
+For every protocol x transport combination (see common/thrift_wire.py) it
+measures, on the real payloads:
+
+- bytes on the wire of ``STTService.Transcribe`` (request with the audio)
+  and of ``TTSService.Synthesize`` (reply with ``SynthReply.audio``);
+- CPU time to encode and decode each message;
+- latency and CPU per call of a loopback RPC (client + server in this process).
+
+Usage (from src/):
+    python bench/thrift_wire_bench.py [--stt-audio thrift/k6/input/cenario1.mp3]
+        [--tts-audio reply.wav] [--repeat 50] [--calls 50] [--json results.json]
+
+Without audio files it uses synthetic payloads of the same shape
+(incompressible bytes for the mp3 upload, a 16-bit PCM WAV for the TTS reply).
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+import wave
+
+import thriftpy2
+from thriftpy2.rpc import make_client, make_server
+from thriftpy2.thrift import TMessageType
+from thriftpy2.transport import TMemoryBuffer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(SRC, "common"))
+
+import thrift_wire  # noqa: E402
+
+IDL_DIR = os.path.join(SRC, "thrift", "thrift")
+STT_THRIFT = thriftpy2.load(os.path.join(IDL_DIR, "stt.thrift"), module_name="stt_thrift")
+TTS_THRIFT = thriftpy2.load(os.path.join(IDL_DIR, "tts.thrift"), module_name="tts_thrift")
+
+
+def synthetic_wav(seconds: float = 10.0, rate: int = 22050) -> bytes:
+    rng = random.Random(0)
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        sample = 0.3 * math.sin(2 * math.pi * 220 * i / rate) + 0.05 * rng.uniform(-1, 1)
+        frames += int(sample * 32767).to_bytes(2, "little", signed=True)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def load_payloads(stt_audio: str, tts_audio: str):
+    if stt_audio:
+        with open(stt_audio, "rb") as f:
+            upload = f.read()
+    else:
+        # ~60 s of 128 kbps mp3; compressed audio is effectively random bytes
+        upload = random.Random(1).randbytes(960_000)
+    if tts_audio:
+        with open(tts_audio, "rb") as f:
+            reply = f.read()
+    else:
+        reply = synthetic_wav()
+    return upload, reply
+
+
+def _encode(factories, name: str, obj, mtype: int) -> bytes:
+    buf = TMemoryBuffer()
+    trans = factories["trans_factory"].get_transport(buf)
+    proto = factories["proto_factory"].get_protocol(trans)
+    proto.write_message_begin(name, mtype, 1)
+    proto.write_struct(obj)
+    proto.write_message_end()
+    trans.flush()
+    return buf.getvalue()
+
+
+def _decode(factories, data: bytes, cls) -> None:
+    trans = factories["trans_factory"].get_transport(TMemoryBuffer(data))
+    proto = factories["proto_factory"].get_protocol(trans)
+    proto.read_message_begin()
+    proto.read_struct(cls())
+    proto.read_message_end()
+
+
+def _cpu_us(fn, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) * 1e6 / repeat
+
+
+def bench_codec(factories, upload: bytes, reply: bytes, repeat: int) -> dict:
+    results = {}
+    messages = {
+        "stt_request": (
+            "Transcribe",
+            STT_THRIFT.STTService.Transcribe_args(audio=upload, filename="cenario1.mp3", content_type="audio/mpeg"),
+            TMessageType.CALL,
+        ),
+        "tts_reply": (
+            "Synthesize",
+            TTS_THRIFT.TTSService.Synthesize_result(success=TTS_THRIFT.SynthReply(audio=reply, error="")),
+            TMessageType.REPLY,
+        ),
+    }
+    for key, (name, obj, mtype) in messages.items():
+        data = _encode(factories, name, obj, mtype)
+        results[key] = {
+            "wire_bytes": len(data),
+            "encode_us": round(_cpu_us(lambda: _encode(factories, name, obj, mtype), repeat), 1),
+            "decode_us": round(_cpu_us(lambda: _decode(factories, data, type(obj)), repeat), 1),
+        }
+    return results
+
+
+class _Handler:
+    def __init__(self, reply: bytes):
+        self.reply = reply
+
+    def Synthesize(self, text):
+        return TTS_THRIFT.SynthReply(audio=self.reply, error="")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_rpc(protocol: str, transport: str, reply: bytes, calls: int) -> dict:
+    port = _free_port()
+    server = make_server(
+        TTS_THRIFT.TTSService, _Handler(reply), "127.0.0.1", port, client_timeout=0,
+        **thrift_wire.factories(protocol, transport),
+    )
+    threading.Thread(target=server.serve, daemon=True).start()
+    time.sleep(0.2)
+    client = make_client(
+        TTS_THRIFT.TTSService, "127.0.0.1", port, timeout=30000,
+        **thrift_wire.factories(protocol, transport),
+    )
+    try:
+        client.Synthesize("aquecimento")
+        latencies = []
+        cpu_start = time.process_time()
+        for _ in range(calls):
+            start = time.perf_counter()
+            client.Synthesize("Qual é o saldo da minha conta?")
+            latencies.append((time.perf_counter() - start) * 1000)
+        cpu = (time.process_time() - cpu_start) * 1000 / calls
+    finally:
+        client.close()
+        server.close()
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "cpu_ms_per_call": round(cpu, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stt-audio", help="STT upload (default: synthetic mp3-sized bytes)")
+    parser.add_argument("--tts-audio", help="TTS reply WAV (default: synthetic 10 s PCM WAV)")
+    parser.add_argument("--repeat", type=int, default=50, help="encode/decode iterations per message")
+    parser.add_argument("--calls", type=int, default=50, help="loopback RPCs per combination")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    for path in (args.stt_audio, args.tts_audio):
+        if path and not os.path.exists(path):
+            parser.error(f"no such file: {path}")
+
+    upload, reply = load_payloads(args.stt_audio, args.tts_audio)
+    print(f"STT upload: {len(upload)} bytes, TTS reply: {len(reply)} bytes")
+    header = (
+        f"{'wire':<17}{'stt bytes':>11}{'enc us':>9}{'dec us':>9}"
+        f"{'tts bytes':>11}{'enc us':>9}{'dec us':>9}{'rpc p50 ms':>12}{'rpc cpu ms':>12}"
+    )
+    print(header)
+    print("-" * len(header))
+    results = {}
+    for protocol in thrift_wire.PROTOCOLS:
+        for transport in thrift_wire.TRANSPORTS:
+            codec = bench_codec(thrift_wire.factories(protocol, transport), upload, reply, args.repeat)
+            rpc = bench_rpc(protocol, transport, reply, args.calls)
+            name = f"{protocol}/{transport}"
+            results[name] = {**codec, "rpc": rpc}
+            stt, tts = codec["stt_request"], codec["tts_reply"]
+            print(
+                f"{name:<17}{stt['wire_bytes']:>11}{stt['encode_us']:>9}{stt['decode_us']:>9}"
+                f"{tts['wire_bytes']:>11}{tts['encode_us']:>9}{tts['decode_us']:>9}"
+                f"{rpc['p50_ms']:>12}{rpc['cpu_ms_per_call']:>12}"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
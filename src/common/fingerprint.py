@@ -0,0 +1,225 @@
+"""Acoustic fingerprints to spot near-duplicate uploads in the STT services.
+
+The exact transcript key (``stt_engine.transcript_key``) changes whenever the
+decoded samples change by one bit. A re-encoded upload, a different encoder,
+or a few extra milliseconds of silence all miss it. ``FingerprintIndex`` maps
+a fingerprint of what the audio sounds like to the exact key of an earlier
+transcript, and the services fall back to it after an exact miss.
+
+Fingerprint (after Haitsma & Kalker): leading and trailing silence is trimmed
+relative to the loudest frame, so gain does not matter. The audio is cut into
+128 ms frames every 8 ms, with the energy of ``BANDS`` log-spaced bands
+between 300 and 3400 Hz. The frames overlap heavily, so an offset of a few
+milliseconds barely changes them. Each frame gives ``BANDS - 1`` bits: the
+sign of the energy difference between neighbouring bands, minus the same
+difference in the previous frame. Only signs of log-energy differences are kept, so codec noise
+and level changes flip few bits. Bits that involve a band more than
+``QUIET_DB`` below the loudest band of the whole clip (pauses, or bands the
+voice does not reach, where noise decides the sign) are left out.
+
+Candidates are found as in the paper: each frame's bits form a 16-bit word,
+and an inverted index maps every word of the frames with speech to the fingerprints
+that contain it. A near duplicate shares many exact words with the original,
+so only the ``CANDIDATES`` fingerprints sharing the most words are compared
+in full. Two fingerprints match when their durations are within
+``MAX_LENGTH_RATIO`` and, at the best alignment within ``max_shift`` frames,
+the fraction of differing bits is at most ``threshold``. Audio longer than ``max_seconds`` is
+not fingerprinted: duplicates are short voice commands, and comparing long
+fingerprints costs more than it saves.
+
+Settings: ``STT_FINGERPRINT`` (default 0), ``STT_FINGERPRINT_THRESHOLD`` (bit
+error rate, default 0.2), ``STT_FINGERPRINT_MAX_ENTRIES`` (default 2000) and
+``STT_FINGERPRINT_MAX_SECONDS`` (default 15).
+"""
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from vad import ABSOLUTE_FLOOR_DB, SAMPLE_RATE, frame_levels
+
+FRAME = 2048
+HOP = 128
+BANDS = 17
+LOW_HZ, HIGH_HZ = 300.0, 3400.0
+# Frames quieter than the loudest one by more than this are trimmed at both ends
+TRIM_DB = 35.0
+# Bands this far below the loudest one carry noise, not speech, and their bits are not compared
+QUIET_DB = 30.0
+MAX_LENGTH_RATIO = 1.2
+# Fingerprints compared bit by bit per lookup, and the words they must share to qualify
+CANDIDATES = 8
+MIN_SHARED_WORDS = 2
+# Below this the bit pattern is too short to tell utterances apart
+MIN_FRAMES = 16
+
+_EDGES = np.geomspace(LOW_HZ, HIGH_HZ, BANDS + 1)
+_BINS = np.fft.rfftfreq(FRAME, 1.0 / SAMPLE_RATE)
+# (bins, BANDS) 0/1 matrix: power spectrum @ _BANDS = band energies
+_BANDS = np.stack([(_BINS >= lo) & (_BINS < hi) for lo, hi in zip(_EDGES[:-1], _EDGES[1:])], axis=1).astype(np.float32)
+_WINDOW = np.hanning(FRAME).astype(np.float32)
+_WORD_WEIGHTS = (1 << np.arange(BANDS - 1)).astype(np.int64)
+
+
+def trim(audio: np.ndarray) -> np.ndarray:
+    """``audio`` without its leading and trailing silence."""
+    frame = int(SAMPLE_RATE * 0.01)
+    levels = frame_levels(audio, frame)
+    if len(levels) == 0:
+        return audio[:0]
+    loud = np.flatnonzero(levels > max(float(levels.max()) - TRIM_DB, ABSOLUTE_FLOOR_DB))
+    if len(loud) == 0:
+        return audio[:0]
+    return audio[loud[0] * frame : (loud[-1] + 1) * frame]
+
+
+# (bits, reliable): (frames, BANDS - 1) bool bits and the mask of the bits worth comparing
+Fingerprint = Tuple[np.ndarray, np.ndarray]
+
+
+def fingerprint(audio: np.ndarray) -> Optional[Fingerprint]:
+    """Fingerprint of ``audio``, or None for silence and very short audio."""
+    audio = trim(np.asarray(audio, dtype=np.float32))
+    n = 1 + (len(audio) - FRAME) // HOP if len(audio) >= FRAME else 0
+    if n < MIN_FRAMES + 1:
+        return None
+    frames = np.lib.stride_tricks.as_strided(
+        audio, shape=(n, FRAME), strides=(audio.strides[0] * HOP, audio.strides[0])
+    )
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+    log_energy = np.log(power @ _BANDS + 1e-10)
+    band_diff = log_energy[:, :-1] - log_energy[:, 1:]
+    # A bit is as reliable as the weakest of the four band energies it compares
+    loud = log_energy > log_energy.max() - QUIET_DB * np.log(10.0) / 10.0
+    pairs = loud[:, :-1] & loud[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    reliable = pairs[1:] & pairs[:-1]
+    return bits & reliable, reliable
+
+
+def words(fp: Fingerprint) -> Set[int]:
+    """The distinct frame words (bits as integers, unreliable bits as 0) of frames with speech."""
+    bits, reliable = fp
+    frames = reliable.sum(axis=1) >= (BANDS - 1) // 2
+    return set((bits[frames] @ _WORD_WEIGHTS).tolist())
+
+
+def bit_error_rate(a: Fingerprint, b: Fingerprint, max_shift: int) -> float:
+    """Lowest fraction of differing bits over alignments of up to ``max_shift`` frames."""
+    (bits_a, reliable_a), (bits_b, reliable_b) = a, b
+    best = 1.0
+    shortest = min(len(bits_a), len(bits_b))
+    for shift in range(-max_shift, max_shift + 1):
+        lo_a, lo_b = max(0, shift), max(0, -shift)
+        overlap = min(len(bits_a) - lo_a, len(bits_b) - lo_b)
+        # Alignments that leave most of the audio out prove nothing
+        if overlap < shortest * 0.8:
+            continue
+        both = reliable_a[lo_a : lo_a + overlap] & reliable_b[lo_b : lo_b + overlap]
+        if both.sum() < MIN_FRAMES * (BANDS - 1) // 2:
+            continue
+        differ = bits_a[lo_a : lo_a + overlap][both] != bits_b[lo_b : lo_b + overlap][both]
+        best = min(best, float(differ.mean()))
+    return best
+
+
+class FingerprintIndex:
+    def __init__(
+        self,
+        enabled: bool = False,
+        threshold: float = 0.2,
+        maxsize: int = 2000,
+        max_seconds: float = 15.0,
+        max_shift: int = 12,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.max_seconds = max_seconds
+        self.max_shift = max_shift
+        # transcript key -> (fingerprint, its words); insertion order is recency order
+        self._entries: "OrderedDict[str, Tuple[Fingerprint, Set[int]]]" = OrderedDict()
+        # frame word -> keys of the fingerprints that contain it
+        self._index: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+
+    def fingerprint(self, audio: np.ndarray) -> Optional[Fingerprint]:
+        """Fingerprint of ``audio``, or None when disabled or the audio does not qualify."""
+        if not self.enabled or len(audio) > self.max_seconds * SAMPLE_RATE:
+            return None
+        return fingerprint(audio)
+
+    def lookup(self, audio: np.ndarray) -> Tuple[Optional[Fingerprint], Optional[str]]:
+        """(fingerprint of ``audio``, transcript key of a near duplicate); both None when disabled."""
+        fp = self.fingerprint(audio)
+        return fp, self.match(fp) if fp is not None else None
+
+    def match(self, fp: Fingerprint) -> Optional[str]:
+        """Transcript key of the closest indexed fingerprint within the threshold."""
+        shared: Counter = Counter()
+        with self._lock:
+            self.lookups += 1
+            for word in words(fp):
+                shared.update(self._index.get(word, ()))
+            candidates = [
+                (key, self._entries[key][0]) for key, count in shared.most_common(CANDIDATES)
+                if count >= MIN_SHARED_WORDS
+            ]
+        candidates = [
+            (key, other) for key, other in candidates
+            if max(len(fp[0]), len(other[0])) <= MAX_LENGTH_RATIO * min(len(fp[0]), len(other[0]))
+        ]
+        best_key, best = None, self.threshold
+        for key, other in candidates:
+            distance = bit_error_rate(fp, other, self.max_shift)
+            if distance <= best:
+                best_key, best = key, distance
+        if best_key is not None:
+            with self._lock:
+                self.matches += 1
+                if best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+        return best_key
+
+    def add(self, fp: Fingerprint, key: str) -> None:
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = (fp, words(fp))
+            for word in self._entries[key][1]:
+                self._index.setdefault(word, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove_locked(next(iter(self._entries)))
+
+    def _remove_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for word in entry[1]:
+            keys = self._index[word]
+            keys.discard(key)
+            if not keys:
+                del self._index[word]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "matches": self.matches,
+                "match_rate": round(self.matches / self.lookups, 3) if self.lookups else 0.0,
+            }
+
+
+def fingerprints_from_env(prefix: str) -> FingerprintIndex:
+    return FingerprintIndex(
+        enabled=os.getenv(prefix, "0").lower() in ("1", "true", "yes"),
+        threshold=float(os.getenv(f"{prefix}_THRESHOLD", "0.2")),
+        maxsize=int(os.getenv(f"{prefix}_MAX_ENTRIES", "2000")),
+        max_seconds=float(os.getenv(f"{prefix}_MAX_SECONDS", "15")),
+    )
@@ -0,0 +1,150 @@
+"""Budgets that end an LLM answer as soon as it is long enough to be spoken.
+
+The system prompt asks for a single paragraph of at most 50 words, but only
+``max_tokens`` bounds the decoding. Whatever the model writes past that is
+decoded, cached and discarded, or worse, spoken. A ``GenerationController``
+reads the streamed deltas and decides when to stop:
+
+- ``words``: the answer has ``max_words`` words in complete sentences. It
+  stops at the first sentence boundary after the budget, so the answer never
+  ends mid-sentence. Without any boundary, it stops at ``HARD_LIMIT`` times
+  the budget.
+- ``sentences`` / ``paragraphs``: that many complete sentences or paragraphs.
+- ``deadline``: ``deadline`` seconds of decoding have passed. It stops at
+  once.
+- ``empty``: ``empty_tokens`` deltas arrived without a letter or digit. Such
+  an answer would be thrown away and retried anyway, so the retry starts
+  after a few tokens, not after a full generation.
+
+Stopping means closing the chunk stream, which stops llama.cpp (or frees the
+``llm_batch`` slot) right away. The stop reason takes the place of the
+model's ``finish_reason``. Text after the cut (the start of the next sentence,
+which comes in the same delta as the space that completes a boundary) is
+never passed on.
+
+Settings: ``LLM_MAX_WORDS``, ``LLM_MAX_SENTENCES``, ``LLM_MAX_PARAGRAPHS``,
+``LLM_DEADLINE`` (seconds) and ``LLM_EMPTY_TOKENS``. They default to 0, which
+disables each one, so answers only change where a budget is set, e.g.
+``LLM_MAX_WORDS=50`` and ``LLM_MAX_PARAGRAPHS=1`` to match the system prompt.
+A cut answer is cached like any other: the caches key on ``budget_settings()``.
+"""
+import os
+import re
+import sys
+import time
+from typing import Iterator, Optional, Tuple
+
+from textseg import SentenceSplitter
+
+MAX_WORDS = int(os.getenv("LLM_MAX_WORDS", "0"))
+MAX_SENTENCES = int(os.getenv("LLM_MAX_SENTENCES", "0"))
+MAX_PARAGRAPHS = int(os.getenv("LLM_MAX_PARAGRAPHS", "0"))
+DEADLINE = float(os.getenv("LLM_DEADLINE", "0"))
+EMPTY_TOKENS = int(os.getenv("LLM_EMPTY_TOKENS", "0"))
+# Without a sentence boundary, the word budget is enforced at this multiple of it
+HARD_LIMIT = 1.5
+
+_CONTENT = re.compile(r"\w")
+_PARAGRAPH = re.compile(r"\S[ \t]*(\r?\n[ \t]*){2,}")
+
+
+def budget_settings() -> dict:
+    """The budgets a default ``GenerationController`` enforces, for cache keys."""
+    return {
+        "max_words": MAX_WORDS,
+        "max_sentences": MAX_SENTENCES,
+        "max_paragraphs": MAX_PARAGRAPHS,
+        "deadline": DEADLINE,
+        "empty_tokens": EMPTY_TOKENS,
+    }
+
+
+class GenerationController:
+    def __init__(
+        self,
+        max_words: int = MAX_WORDS,
+        max_sentences: int = MAX_SENTENCES,
+        max_paragraphs: int = MAX_PARAGRAPHS,
+        deadline: float = DEADLINE,
+        empty_tokens: int = EMPTY_TOKENS,
+    ):
+        self.max_words = max_words
+        self.max_sentences = max_sentences
+        self.max_paragraphs = max_paragraphs
+        self.deadline = deadline
+        self.empty_tokens = empty_tokens
+        self.started = time.monotonic()
+        self._splitter = SentenceSplitter(min_chars=1, max_chars=sys.maxsize)
+        self._text = ""
+        self._emitted = 0
+        self.tokens = 0
+        self.sentences = 0
+        self.words = 0
+        self.reason: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        """The answer as passed on so far."""
+        return self._text[: self._emitted].strip()
+
+    def feed(self, delta: str) -> Tuple[str, bool]:
+        """Take one decoded delta; returns (text to pass on, whether to stop decoding)."""
+        self.tokens += 1
+        self._text += delta
+        for sentence in self._splitter.feed(delta):
+            self.sentences += 1
+            self.words += len(sentence.split())
+            boundary = len(self._text) - len(self._splitter.pending)
+            if self.max_sentences and self.sentences >= self.max_sentences:
+                return self._stop("sentences", boundary)
+            if self.max_words and self.words >= self.max_words:
+                return self._stop("words", boundary)
+        if self.max_paragraphs:
+            breaks = list(_PARAGRAPH.finditer(self._text))
+            if len(breaks) >= self.max_paragraphs:
+                return self._stop("paragraphs", breaks[self.max_paragraphs - 1].start() + 1)
+        if self.empty_tokens and self.tokens >= self.empty_tokens and not _CONTENT.search(self._text):
+            return self._stop("empty", 0)
+        if self.max_words and self.words + len(self._splitter.pending.split()) >= self.max_words * HARD_LIMIT:
+            return self._stop("words", len(self._text))
+        if self.deadline and time.monotonic() - self.started >= self.deadline:
+            return self._stop("deadline", len(self._text))
+        return self._pass(len(self._text)), False
+
+    def _pass(self, end: int) -> str:
+        end = max(end, self._emitted)
+        out, self._emitted = self._text[self._emitted : end], end
+        return out
+
+    def _stop(self, reason: str, cut: int) -> Tuple[str, bool]:
+        self.reason = reason
+        return self._pass(cut), True
+
+
+def controlled(chunks, controller: GenerationController) -> Iterator[dict]:
+    """Chat completion chunks cut where ``controller`` stops; the source stream is closed there."""
+    try:
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            delta = choice["delta"].get("content")
+            if not delta:
+                yield chunk
+                continue
+            text, stop = controller.feed(delta)
+            if text:
+                yield {"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+            if stop:
+                yield {"choices": [{"index": 0, "delta": {}, "finish_reason": controller.reason}]}
+                return
+            if choice.get("finish_reason"):
+                yield {"choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]}
+    finally:
+        getattr(chunks, "close", lambda: None)()
+
+
+def collect(chunks, controller: GenerationController) -> Tuple[str, Optional[str]]:
+    """(answer, finish reason) of a chunk stream run through ``controller``."""
+    finish_reason = None
+    for chunk in controlled(chunks, controller):
+        finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason
+    return controller.text, finish_reason
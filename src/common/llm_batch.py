@@ -0,0 +1,473 @@
+"""Continuous batching for the llama.cpp LLM services.
+
+A ``Llama`` keeps a single sequence in its context, so a replica decodes one
+request at a time and concurrent requests wait for whole generations.
+``BatchEngine`` wraps a loaded ``Llama`` and decodes up to ``slots``
+sequences together in a context of its own (``n_seq_max = slots + 1``). Each
+decode step evaluates one token for every sequence that is generating and, in
+the room left in the batch, up to ``prefill_chunk`` prompt tokens of the
+sequences that were just admitted. New requests therefore join between two
+steps, and finished ones leave at once, freeing their slot and their KV cells.
+
+Admission is first come, first served: a request waits in a FIFO queue until a
+slot is free. A long prompt is evaluated in chunks alongside the running
+sequences, so it does not stall their tokens.
+
+Sampling runs per sequence with the request's own parameters (temperature,
+top-k, top-p, min-p, repeat/presence/frequency penalties, seed), in
+llama.cpp's order. The prompt is rendered with the GGUF's chat template, the
+same one ``Llama.create_chat_completion`` uses.
+
+The extra sequence holds the system prompt (see ``kv_prefix``): it is
+evaluated once and copied into each new slot, whose cells then share it, so
+only the user turn is evaluated per request.
+
+``create_chat_completion`` has the same shape as ``Llama``'s for the
+parameters the services pass. It may be called from many threads at once, so
+a ``ModelPool`` should run ``slots`` jobs per replica (``concurrency``).
+
+Settings: ``LLM_SLOTS`` (sequences decoded together, default 1: no batching,
+a plain ``Llama`` per replica) and ``LLM_PREFILL_CHUNK`` (prompt tokens per
+step, default 128). Each slot gets the ``n_ctx`` of the wrapped model.
+"""
+import codecs
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import llama_cpp
+from llama_cpp import llama_chat_format
+
+from kv_prefix import ENABLED as PREFIX_ENABLED
+
+logger = logging.getLogger("llm-batch")
+
+SLOTS = int(os.getenv("LLM_SLOTS", "1"))
+PREFILL_CHUNK = int(os.getenv("LLM_PREFILL_CHUNK", "128"))
+# Tokens the repeat/presence/frequency penalties look back on (Llama's last_n_tokens_size)
+PENALTY_LAST_N = 64
+
+
+class _Sequence:
+    def __init__(self, tokens: List[int], prefix: List[int], max_tokens: int, sampling: dict, logits_processor, stopping_criteria, seed):
+        self.tokens = tokens
+        self.n_prompt = len(tokens)
+        self.prefix = prefix
+        self.max_tokens = max_tokens
+        self.sampling = sampling
+        self.logits_processor = logits_processor
+        self.stopping_criteria = stopping_criteria
+        self.rng = np.random.default_rng(seed)
+        # Tokens of self.tokens already in the slot's KV cache
+        self.n_past = 0
+        self.slot = -1
+        self.out: "queue.Queue[tuple]" = queue.Queue()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.submitted = time.monotonic()
+        self.cancelled = False
+
+    @property
+    def n_generated(self) -> int:
+        return len(self.tokens) - self.n_prompt
+
+
+def _token_text(llm, token: int) -> str:
+    return llama_cpp.llama_token_get_text(llm.model, token).decode("utf-8", errors="ignore") if token != -1 else ""
+
+
+def _release(ctx, batch) -> None:
+    llama_cpp.llama_batch_free(batch)
+    llama_cpp.llama_free(ctx)
+
+
+def _penalize(logits: np.ndarray, recent: List[int], repeat: float, presence: float, frequency: float) -> None:
+    if not recent or (repeat == 1.0 and presence == 0.0 and frequency == 0.0):
+        return
+    ids, counts = np.unique(np.asarray(recent), return_counts=True)
+    values = logits[ids]
+    values = np.where(values > 0, values / repeat, values * repeat)
+    logits[ids] = values - counts * frequency - presence
+
+
+def sample(logits: np.ndarray, recent: List[int], rng: np.random.Generator, temperature: float = 0.2, top_k: int = 40,
+           top_p: float = 0.95, min_p: float = 0.05, repeat_penalty: float = 1.0, presence_penalty: float = 0.0,
+           frequency_penalty: float = 0.0) -> int:
+    """Next token from ``logits`` (modified in place), like llama.cpp's sampler chain."""
+    _penalize(logits, recent[-PENALTY_LAST_N:], repeat_penalty, presence_penalty, frequency_penalty)
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    k = top_k if 0 < top_k < len(logits) else len(logits)
+    candidates = np.argpartition(-logits, k - 1)[:k] if k < len(logits) else np.arange(len(logits))
+    candidates = candidates[np.argsort(-logits[candidates], kind="stable")]
+    values = logits[candidates].astype(np.float64)
+    probs = np.exp(values - values[0])
+    probs /= probs.sum()
+    if top_p < 1.0:
+        # Smallest head whose probability reaches top_p
+        keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+        candidates, values, probs = candidates[:keep], values[:keep], probs[:keep]
+    if min_p > 0.0:
+        keep = max(1, int(np.count_nonzero(probs >= min_p * probs[0])))
+        candidates, values = candidates[:keep], values[:keep]
+    probs = np.exp((values - values[0]) / temperature)
+    return int(candidates[rng.choice(len(candidates), p=probs / probs.sum())])
+
+
+class BatchEngine:
+    def __init__(self, llm, slots: int = SLOTS, prefill_chunk: int = PREFILL_CHUNK, n_ctx: Optional[int] = None):
+        template = llm.metadata.get("tokenizer.chat_template")
+        if not template:
+            raise ValueError("Continuous batching needs a GGUF with a chat template (tokenizer.chat_template)")
+        self.llm = llm
+        self.slots = max(1, slots)
+        self.prefill_chunk = max(1, prefill_chunk)
+        self.n_ctx = n_ctx or llm.n_ctx()
+        eos = llm.token_eos()
+        self._formatter = llama_chat_format.Jinja2ChatFormatter(
+            template=template,
+            eos_token=_token_text(llm, eos),
+            bos_token=_token_text(llm, llm.token_bos()),
+            stop_token_ids=[eos],
+        )
+        self._n_vocab = llm.n_vocab()
+        # The wrapped model's settings (threads, offloading, rope), sized for every slot
+        params = llama_cpp.llama_context_params.from_buffer_copy(llm.context_params)
+        params.n_seq_max = self.slots + 1
+        params.n_ctx = (self.slots + 1) * self.n_ctx
+        params.n_batch = self.slots + self.prefill_chunk
+        # One ubatch per decode, so a batch that does not fit leaves the KV cache untouched
+        params.n_ubatch = params.n_batch
+        params.logits_all = False
+        self._n_batch = params.n_batch
+        self._ctx = llama_cpp.llama_new_context_with_model(llm.model, params)
+        if not self._ctx:
+            raise RuntimeError("Failed to create the batched llama.cpp context")
+        self._batch = llama_cpp.llama_batch_init(self._n_batch, 0, 1)
+        weakref.finalize(self, _release, self._ctx, self._batch)
+        # Sequence id of the system prompt's cells, after the slots' ids
+        self._prefix_seq = self.slots
+        self._prefixes: Dict[str, List[int]] = {}
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def create_chat_completion(
+        self,
+        messages: List[dict],
+        stream: bool = False,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.2,
+        top_p: float = 0.95,
+        top_k: int = 40,
+        min_p: float = 0.05,
+        repeat_penalty: float = 1.0,
+        presence_penalty: float = 0.0,
+        frequency_penalty: float = 0.0,
+        seed: Optional[int] = None,
+        logits_processor: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+        stopping_criteria: Optional[Callable[[np.ndarray, np.ndarray], bool]] = None,
+    ):
+        """Queue a generation; returns the completion, or an iterator of chunks with ``stream``."""
+        tokens = self._render(messages)
+        if len(tokens) >= self.n_ctx:
+            raise ValueError(f"Requested tokens ({len(tokens)}) exceed context window of {self.n_ctx}")
+        room = self.n_ctx - len(tokens)
+        seq = _Sequence(
+            tokens,
+            self._prefix(messages) if PREFIX_ENABLED else [],
+            min(max_tokens, room) if max_tokens and max_tokens > 0 else room,
+            dict(
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                min_p=min_p,
+                repeat_penalty=repeat_penalty,
+                presence_penalty=presence_penalty,
+                frequency_penalty=frequency_penalty,
+            ),
+            logits_processor,
+            stopping_criteria,
+            seed,
+        )
+        self._submit(seq)
+        chunks = self._chunks(seq)
+        if stream:
+            return chunks
+        parts, finish_reason = [], None
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            parts.append(choice["delta"].get("content") or "")
+            finish_reason = choice["finish_reason"] or finish_reason
+        return {
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(parts)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": seq.n_prompt,
+                "completion_tokens": seq.n_generated,
+                "total_tokens": len(seq.tokens),
+            },
+        }
+
+    def stats(self) -> dict:
+        with self._cond:
+            steps = self._steps
+            admitted = self._admitted
+            return {
+                "slots": self.slots,
+                "active": len(self._running),
+                "waiting": len(self._waiting),
+                "admitted": admitted,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "steps": steps,
+                "tokens_per_step": round(self._step_tokens / steps, 2) if steps else 0.0,
+                "sequences_per_step": round(self._step_sequences / steps, 2) if steps else 0.0,
+                "generated_tokens": self._generated,
+                "prompt_tokens": self._prompt_tokens,
+                "prefix_tokens_reused": self._prefix_reused,
+                "admission_wait_avg_ms": round(self._wait_seconds / admitted * 1000, 1) if admitted else 0.0,
+                "admission_wait_max_ms": round(self._wait_max * 1000, 1),
+            }
+
+    # Request side (any thread)
+
+    def _render(self, messages: List[dict]) -> List[int]:
+        prompt = self._formatter(messages=messages).prompt
+        # The template writes the BOS token itself
+        return list(self.llm.tokenize(prompt.encode("utf-8"), add_bos=False, special=True))
+
+    def _prefix(self, messages: List[dict]) -> List[int]:
+        """Tokens every prompt with this system message starts with (kv_prefix's two renderings)."""
+        if not messages or messages[0].get("role") != "system":
+            return []
+        system = messages[0]["content"]
+        with self._cond:
+            prefix = self._prefixes.get(system)
+        if prefix is not None:
+            return prefix
+        first, second = (
+            self._render([messages[0], {"role": "user", "content": user}]) for user in ("a", "b")
+        )
+        shared = 0
+        while shared < min(len(first), len(second)) and first[shared] == second[shared]:
+            shared += 1
+        prefix = list(first[:shared])
+        with self._cond:
+            # Few distinct system prompts are expected; keep the latest ones only
+            if len(self._prefixes) >= 8:
+                self._prefixes.pop(next(iter(self._prefixes)))
+            self._prefixes[system] = prefix
+        return prefix
+
+    def _submit(self, seq: _Sequence) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="llm-batch", daemon=True)
+                self._thread.start()
+            self._waiting.append(seq)
+            self._cond.notify()
+
+    def _chunks(self, seq: _Sequence) -> Iterator[dict]:
+        try:
+            yield {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+            while True:
+                kind, value = seq.out.get()
+                if kind == "text":
+                    yield {"choices": [{"index": 0, "delta": {"content": value}, "finish_reason": None}]}
+                elif kind == "error":
+                    raise value
+                else:
+                    yield {"choices": [{"index": 0, "delta": {}, "finish_reason": value}]}
+                    return
+        finally:
+            # A consumer that stops early frees the slot at the next step
+            seq.cancelled = True
+            with self._cond:
+                self._cond.notify()
+
+    # Scheduler side (the engine's thread)
+
+    def _reset(self) -> None:
+        # Fresh per-process state: the scheduler thread does not survive fork, nor do its callers
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._waiting: "collections.deque[_Sequence]" = collections.deque()
+        self._running: List[_Sequence] = []
+        self._free = list(range(self.slots))
+        self._resident: List[int] = []
+        llama_cpp.llama_kv_cache_clear(self._ctx)
+        self._steps = 0
+        self._step_tokens = 0
+        self._step_sequences = 0
+        self._admitted = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._generated = 0
+        self._prompt_tokens = 0
+        self._prefix_reused = 0
+        self._wait_seconds = 0.0
+        self._wait_max = 0.0
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._waiting and not self._running:
+                    self._cond.wait()
+                admitted = self._admit_locked()
+            try:
+                for seq in admitted:
+                    self._attach_prefix(seq)
+                self._step()
+            except Exception as e:
+                logger.exception("Batched decode failed")
+                for seq in list(self._running):
+                    seq.out.put(("error", e))
+                    self._leave(seq)
+
+    def _admit_locked(self) -> List[_Sequence]:
+        admitted = []
+        now = time.monotonic()
+        while self._free and self._waiting:
+            seq = self._waiting.popleft()
+            if seq.cancelled:
+                self._cancelled += 1
+                continue
+            seq.slot = self._free.pop(0)
+            self._running.append(seq)
+            admitted.append(seq)
+            wait = now - seq.submitted
+            self._admitted += 1
+            self._prompt_tokens += seq.n_prompt
+            self._wait_seconds += wait
+            self._wait_max = max(self._wait_max, wait)
+        return admitted
+
+    def _attach_prefix(self, seq: _Sequence) -> None:
+        """Share the system prompt's cells with ``seq``'s slot, evaluating them first if needed."""
+        n = len(seq.prefix)
+        # The prompt's last token is always evaluated: its logits give the first token
+        if n == 0 or n >= seq.n_prompt or seq.tokens[:n] != seq.prefix:
+            return
+        if self._resident != seq.prefix:
+            llama_cpp.llama_kv_cache_seq_rm(self._ctx, self._prefix_seq, -1, -1)
+            self._resident = []
+            entries = [(token, pos, self._prefix_seq, False, None) for pos, token in enumerate(seq.prefix)]
+            for start in range(0, n, self._n_batch):
+                self._decode(entries[start : start + self._n_batch], {}, set())
+            self._resident = list(seq.prefix)
+        llama_cpp.llama_kv_cache_seq_cp(self._ctx, self._prefix_seq, seq.slot, 0, n)
+        seq.n_past = n
+        with self._cond:
+            self._prefix_reused += n
+
+    def _step(self) -> None:
+        for seq in [s for s in self._running if s.cancelled]:
+            with self._cond:
+                self._cancelled += 1
+            self._leave(seq)
+        if not self._running:
+            return
+        # (token, position, sequence id, wants logits, sequence)
+        entries = []
+        for seq in self._running:
+            if seq.n_past == len(seq.tokens) - 1 and seq.n_generated:
+                entries.append((seq.tokens[-1], seq.n_past, seq.slot, True, seq))
+        for seq in self._running:
+            room = self._n_batch - len(entries)
+            if room <= 0:
+                break
+            pending = len(seq.tokens) - seq.n_past
+            if seq.n_generated or pending <= 0:
+                continue
+            take = min(pending, room, self.prefill_chunk)
+            for i in range(seq.n_past, seq.n_past + take):
+                entries.append((seq.tokens[i], i, seq.slot, i == len(seq.tokens) - 1, seq))
+        logits: Dict[_Sequence, np.ndarray] = {}
+        full = set()
+        self._decode(entries, logits, full)
+        for seq in full:
+            self._finish(seq, "length")
+        with self._cond:
+            self._steps += 1
+            self._step_tokens += len(entries)
+            self._step_sequences += len({id(e[4]) for e in entries})
+        for seq, row in logits.items():
+            self._advance(seq, row)
+
+    def _decode(self, entries: list, logits: Dict[_Sequence, np.ndarray], full: set) -> None:
+        """Evaluate ``entries``, halving a batch whose cells do not fit in the KV cache."""
+        entries = [e for e in entries if e[4] is None or e[4] not in full]
+        if not entries:
+            return
+        batch = self._batch
+        batch.n_tokens = len(entries)
+        for j, (token, pos, seq_id, wants, _) in enumerate(entries):
+            batch.token[j] = token
+            batch.pos[j] = pos
+            batch.n_seq_id[j] = 1
+            batch.seq_id[j][0] = seq_id
+            batch.logits[j] = wants
+        rc = llama_cpp.llama_decode(self._ctx, batch)
+        if rc == 1 and len(entries) > 1:
+            half = len(entries) // 2
+            self._decode(entries[:half], logits, full)
+            self._decode(entries[half:], logits, full)
+            return
+        if rc == 1 and entries[0][4] is not None:
+            full.add(entries[0][4])
+            return
+        if rc != 0:
+            raise RuntimeError(f"llama_decode returned {rc}")
+        for j, (_, _, _, wants, seq) in enumerate(entries):
+            if seq is not None:
+                seq.n_past += 1
+            if wants:
+                row = llama_cpp.llama_get_logits_ith(self._ctx, j)
+                logits[seq] = np.ctypeslib.as_array(row, shape=(self._n_vocab,)).copy()
+
+    def _advance(self, seq: _Sequence, logits: np.ndarray) -> None:
+        if seq.cancelled:
+            return
+        if seq.logits_processor is not None:
+            logits = seq.logits_processor(np.array(seq.tokens, dtype=np.intc), logits.copy())
+        token = sample(logits.copy(), seq.tokens, seq.rng, **seq.sampling)
+        if seq.stopping_criteria is not None and seq.stopping_criteria(np.array(seq.tokens, dtype=np.intc), logits):
+            self._finish(seq, "stop")
+            return
+        if llama_cpp.llama_token_is_eog(self.llm.model, token):
+            self._finish(seq, "stop")
+            return
+        seq.tokens.append(token)
+        with self._cond:
+            self._generated += 1
+        text = seq.decoder.decode(self.llm.detokenize([token]))
+        if text:
+            seq.out.put(("text", text))
+        if seq.n_generated >= seq.max_tokens:
+            self._finish(seq, "length")
+
+    def _finish(self, seq: _Sequence, reason: str) -> None:
+        tail = seq.decoder.decode(b"", final=True)
+        if tail:
+            seq.out.put(("text", tail))
+        seq.out.put(("done", reason))
+        with self._cond:
+            self._completed += 1
+        self._leave(seq)
+
+    def _leave(self, seq: _Sequence) -> None:
+        if seq not in self._running:
+            return
+        llama_cpp.llama_kv_cache_seq_rm(self._ctx, seq.slot, -1, -1)
+        with self._cond:
+            self._running.remove(seq)
+            self._free.append(seq.slot)
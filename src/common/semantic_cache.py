@@ -0,0 +1,227 @@
+"""Semantic cache of LLM answers, for prompts that paraphrase an earlier one.
+
+The exact cache is keyed by the prompt text, so "quanto rende a poupança?" and
+"Quanto rende a poupança" are two entries and two generations.
+``SemanticCache`` sits behind it. A prompt is normalized (case, accents,
+punctuation and spacing are dropped) and embedded with a small embedding model
+on the CPU. The answer of the most similar earlier prompt is reused when the
+cosine similarity reaches ``threshold``.
+
+Two prompts only match when they agree on everything the answer depends on
+besides the wording: the ``scope`` given by the caller (the sampling
+parameters), and the numbers in the prompt. "quanto rende 100 reais" and
+"quanto rende 1000 reais" embed almost identically, but must not share an
+answer.
+
+The index is a matrix of unit vectors in memory. A lookup is one
+matrix-vector product, which is plenty for a few thousand FAQ-like entries.
+Each entry keeps its provenance: the prompt and exact cache key it was
+generated for, when, and how often it was reused. A hit returns that
+provenance along with the similarity. The least recently used entries are
+dropped past ``maxsize``.
+
+The embedding model is a GGUF loaded with llama.cpp (e.g. multilingual-e5-small),
+with ``embedding=True`` and no GPU layers, on first use. If it cannot be
+loaded, the layer disables itself and every lookup misses.
+
+Settings: ``LLM_SEMANTIC_CACHE`` (default 0), ``LLM_SEMANTIC_CACHE_MODEL``
+(path to the GGUF), ``LLM_SEMANTIC_CACHE_QUERY_PREFIX`` (text put before each
+prompt, default "query: " as e5 models expect), ``LLM_SEMANTIC_CACHE_THRESHOLD``
+(cosine similarity, default 0.92) and ``LLM_SEMANTIC_CACHE_MAX_ENTRIES``
+(default 2000). Requests can skip the layer with their bypass flag.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("semantic-cache")
+
+_NOT_WORD = re.compile(r"[^\w]+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize(text: str) -> str:
+    """``text`` in lower case, without accents, punctuation or repeated spaces."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NOT_WORD.sub(" ", text.casefold()).strip()
+
+
+def numbers(text: str) -> Tuple[str, ...]:
+    """The numbers in ``text``, in order (a match must quote the same ones).
+
+    Taken from the prompt before normalization, which drops the separators:
+    "1.500" and "1,500" are different amounts.
+    """
+    return tuple(_NUMBER.findall(text))
+
+
+class LlamaEmbedder:
+    """Sentence embeddings from a GGUF embedding model, on the CPU."""
+
+    def __init__(self, model_path: str, query_prefix: str = ""):
+        self.model_path = model_path
+        self.query_prefix = query_prefix
+        self._model = None
+        # A llama.cpp context is not thread-safe
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> np.ndarray:
+        with self._lock:
+            if self._model is None:
+                from llama_cpp import Llama
+
+                logger.info(f"Loading embedding model from {self.model_path}")
+                self._model = Llama(model_path=self.model_path, embedding=True, n_gpu_layers=0, verbose=False)
+            vector = np.asarray(self._model.embed(self.query_prefix + text), dtype=np.float32)
+        # Token-level output (a model without pooling): mean-pool it
+        return vector.mean(axis=0) if vector.ndim == 2 else vector
+
+
+class _Entry:
+    __slots__ = ("row", "answer", "provenance")
+
+    def __init__(self, row: int, answer: str, provenance: dict):
+        self.row = row
+        self.answer = answer
+        self.provenance = provenance
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+        enabled: bool = False,
+        threshold: float = 0.92,
+        maxsize: int = 2000,
+    ):
+        self.embed = embed
+        self.enabled = enabled and embed is not None
+        self.threshold = threshold
+        self.maxsize = max(1, maxsize)
+        # (scope, numbers, normalized prompt) -> entry; insertion order is recency order
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        # Row i of _vectors belongs to an entry of group _groups[i], the hash of its
+        # (scope, numbers); free rows are in no group
+        self._vectors: Optional[np.ndarray] = None
+        self._groups = np.zeros(self.maxsize, dtype=np.int64)
+        self._used = np.zeros(self.maxsize, dtype=bool)
+        self._free: List[int] = list(range(self.maxsize - 1, -1, -1))
+        self._row_keys: List[Optional[tuple]] = [None] * self.maxsize
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.embed_seconds = 0.0
+        self.embeds = 0
+
+    def lookup(self, prompt: str, scope: str = "") -> Optional[Tuple[str, dict]]:
+        """(answer, provenance) of the closest earlier prompt, or None below the threshold."""
+        if not self.enabled:
+            return None
+        text = normalize(prompt)
+        if not text:
+            return None
+        key = (scope, numbers(prompt), text)
+        group = hash(key[:2])
+        with self._lock:
+            self.lookups += 1
+            # No earlier prompt with this scope and these numbers: skip the embedding
+            if not (self._used & (self._groups == group)).any():
+                return None
+        vector = self._embed(text)
+        if vector is None:
+            return None
+        with self._lock:
+            if self._vectors is None:
+                return None
+            similarity = self._vectors @ vector
+            similarity[~self._used | (self._groups != group)] = -np.inf
+            row = int(np.argmax(similarity))
+            if similarity[row] < self.threshold:
+                return None
+            entry_key = self._row_keys[row]
+            entry = self._entries[entry_key]
+            self._entries.move_to_end(entry_key)
+            entry.provenance["hits"] += 1
+            self.hits += 1
+            return entry.answer, dict(entry.provenance, similarity=round(float(similarity[row]), 4))
+
+    def add(self, prompt: str, answer: str, scope: str = "", source_key: str = "") -> None:
+        """Index ``answer`` under ``prompt``'s embedding; a prompt normalized the same is replaced."""
+        if not self.enabled or not answer:
+            return
+        text = normalize(prompt)
+        if not text:
+            return
+        vector = self._embed(text)
+        if vector is None:
+            return
+        key = (scope, numbers(prompt), text)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+            self._remove_locked(key)
+            if not self._free:
+                self._remove_locked(next(iter(self._entries)))
+            row = self._free.pop()
+            self._vectors[row] = vector
+            self._row_keys[row] = key
+            self._groups[row] = hash(key[:2])
+            self._used[row] = True
+            self._entries[key] = _Entry(row, answer, {
+                "source_prompt": prompt,
+                "source_key": source_key,
+                "created_at": time.time(),
+                "hits": 0,
+            })
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "embed_avg_ms": round(self.embed_seconds / self.embeds * 1000, 1) if self.embeds else 0.0,
+            }
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        started = time.perf_counter()
+        try:
+            vector = np.asarray(self.embed(text), dtype=np.float32).ravel()
+        except Exception:
+            logger.exception("Embedding failed, semantic cache disabled")
+            self.enabled = False
+            return None
+        norm = float(np.linalg.norm(vector))
+        with self._lock:
+            self.embeds += 1
+            self.embed_seconds += time.perf_counter() - started
+        return vector / norm if norm else None
+
+    def _remove_locked(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._used[entry.row] = False
+        self._row_keys[entry.row] = None
+        self._free.append(entry.row)
+
+
+def semantic_cache_from_env(prefix: str, model_path: str = "") -> SemanticCache:
+    path = os.getenv(f"{prefix}_MODEL", model_path)
+    return SemanticCache(
+        LlamaEmbedder(path, os.getenv(f"{prefix}_QUERY_PREFIX", "query: ")) if path else None,
+        enabled=os.getenv(prefix, "0").lower() in ("1", "true", "yes"),
+        threshold=float(os.getenv(f"{prefix}_THRESHOLD", "0.92")),
+        maxsize=int(os.getenv(f"{prefix}_MAX_ENTRIES", "2000")),
+    )
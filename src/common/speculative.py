@@ -0,0 +1,142 @@
+"""Speculative decoding for the llama.cpp LLM services.
+
+llama-cpp-python verifies drafts itself when a ``Llama`` is given a
+``draft_model``. After each sampled token it asks the draft for the next few
+tokens, evaluates all of them in one batch, and then samples every position
+from the main model's own logits, with the request's sampling parameters. A
+drafted token is kept only while the sample equals it, so the output follows
+the normal sampling distribution exactly. A good draft only changes how many
+tokens one evaluation of the 8B model yields.
+
+Drafts (``LLM_DRAFT``):
+
+- ``prompt-lookup``: copies what followed the last n-gram where it appears
+  earlier in the context (``LlamaPromptLookupDecoding``). It costs nothing
+  and pays off when the answer repeats the question: values, names, terms.
+- ``model``: a small GGUF with the same vocabulary (for Llama 3, e.g.
+  Llama-3.2-1B-Instruct) proposes its greedy continuation. It keeps its own
+  KV cache, so it only evaluates the tokens that are new since its last call.
+
+A ``MeasuredDraft`` wraps either one and counts proposed and accepted tokens
+in ``DRAFT_STATS``. A proposal is verified by the next draft call of the same
+generation, which starts with the accepted tokens. The last proposal of each
+generation is never verified and is not counted.
+
+The main context keeps logits for every position (``logits_all``), an
+``n_ctx x n_vocab`` float buffer. Drafting only applies to plain ``Llama``
+replicas: with ``LLM_SLOTS`` > 1, ``llm_batch`` decodes instead.
+
+Settings: ``LLM_DRAFT`` (empty: off), ``LLM_DRAFT_TOKENS`` (tokens per draft,
+default 8), ``LLM_DRAFT_MODEL`` (the small GGUF) and ``LLM_DRAFT_NGRAM``
+(longest n-gram prompt-lookup matches, default 2).
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+import llama_cpp
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+logger = logging.getLogger("speculative")
+
+DRAFTS = ("prompt-lookup", "model")
+DRAFT = os.getenv("LLM_DRAFT", "").lower()
+DRAFT_TOKENS = int(os.getenv("LLM_DRAFT_TOKENS", "8"))
+DRAFT_MODEL = os.getenv("LLM_DRAFT_MODEL", "./models/Llama-3.2-1B-Instruct-Q8_0.gguf")
+DRAFT_NGRAM = int(os.getenv("LLM_DRAFT_NGRAM", "2"))
+
+
+class DraftStats:
+    """Acceptance counters of every draft in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.draft_seconds = 0.0
+
+    def record(self, proposed: int, accepted: int) -> None:
+        with self._lock:
+            self.steps += 1
+            self.proposed += proposed
+            self.accepted += accepted
+
+    def timed(self, seconds: float) -> None:
+        with self._lock:
+            self.draft_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = self.steps
+            return {
+                "draft": DRAFT or "off",
+                "draft_tokens": DRAFT_TOKENS,
+                "steps": steps,
+                "proposed": self.proposed,
+                "accepted": self.accepted,
+                "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+                # Tokens each evaluation of the main model yields: the accepted ones plus its own sample
+                "tokens_per_step": round(1 + self.accepted / steps, 2) if steps else 0.0,
+                "draft_avg_ms": round(self.draft_seconds / steps * 1000, 2) if steps else 0.0,
+            }
+
+
+DRAFT_STATS = DraftStats()
+
+
+class SmallModelDraft(LlamaDraftModel):
+    """Greedy continuation of a small model sharing the main model's vocabulary."""
+
+    def __init__(self, model_path: str, n_ctx: int, num_pred_tokens: int = DRAFT_TOKENS):
+        logger.info(f"Loading draft model from {model_path}")
+        self.model = llama_cpp.Llama(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=-1, verbose=False)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        n = min(self.num_pred_tokens, self.model.n_ctx() - len(input_ids) - 1)
+        draft = []
+        if n <= 0:
+            return np.array(draft, dtype=np.intc)
+        # generate() reuses the longest prefix already in the draft's KV cache
+        for token in self.model.generate(input_ids.tolist(), temp=0.0):
+            draft.append(token)
+            if len(draft) >= n or llama_cpp.llama_token_is_eog(self.model.model, token):
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+class MeasuredDraft(LlamaDraftModel):
+    def __init__(self, draft: LlamaDraftModel, stats: DraftStats = DRAFT_STATS):
+        self.draft = draft
+        self.stats = stats
+        # (context of the previous call, tokens it proposed), verified by the next call
+        self._pending: Optional[tuple] = None
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        if self._pending is not None:
+            context, proposed = self._pending
+            n = len(context)
+            if len(input_ids) > n and np.array_equal(input_ids[:n], context):
+                follow = input_ids[n : n + len(proposed)]
+                differ = np.flatnonzero(follow != proposed[: len(follow)])
+                self.stats.record(len(proposed), int(differ[0]) if len(differ) else len(follow))
+        started = time.perf_counter()
+        proposed = np.asarray(self.draft(input_ids, **kwargs), dtype=np.intc)
+        self.stats.timed(time.perf_counter() - started)
+        self._pending = (np.array(input_ids, copy=True), proposed) if len(proposed) else None
+        return proposed
+
+
+def draft_from_env(n_ctx: int) -> Optional[LlamaDraftModel]:
+    """The ``LLM_DRAFT`` draft for a main model with ``n_ctx`` tokens of context, or None."""
+    if not DRAFT:
+        return None
+    if DRAFT not in DRAFTS:
+        raise ValueError(f"Unknown LLM_DRAFT {DRAFT!r}, expected one of {DRAFTS}")
+    if DRAFT == "model":
+        return MeasuredDraft(SmallModelDraft(DRAFT_MODEL, n_ctx, DRAFT_TOKENS))
+    return MeasuredDraft(LlamaPromptLookupDecoding(max_ngram_size=DRAFT_NGRAM, num_pred_tokens=DRAFT_TOKENS))
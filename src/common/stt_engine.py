@@ -0,0 +1,185 @@
+"""Pluggable Whisper backends for the STT services.
+
+``STT_ENGINE`` picks how the ``WHISPER_MODEL_SIZE`` checkpoint is run:
+
+- ``whisper`` (default): openai-whisper on PyTorch, fp16 on GPU, fp32 on CPU.
+- ``whisper-int8``: the same model with its Linear layers (almost all of
+  the compute) dynamically quantized to int8. CPU only, no extra dependency.
+- ``ctranslate2``: faster-whisper (CTranslate2) with ``STT_COMPUTE_TYPE``
+  weights (default ``int8``). faster-whisper is in the STT services'
+  requirements; the converted checkpoint is downloaded into ``./models/``
+  on first use.
+
+Every engine turns 16 kHz mono float32 audio into text through
+``transcribe(audio)`` (whole upload, model-driven seeking) and
+``decode_windows(windows)`` (one text per window of at most 30 s, batched
+when the backend can; see whisper_batch.py).
+
+``transcript_key`` names a transcript by what determines it: the decoded
+PCM and the settings that change the output. Uploads of the same audio in
+another container or bitrate, or through another protocol, share the key.
+Getting there takes a full decode (an ffmpeg process for MP3, OGG, ...), so
+the services remember which transcript key each ``upload_key`` (the bytes as
+received) decoded to. A repeated upload then costs a hash of its bytes.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger("stt-engine")
+
+ENGINE = os.getenv("STT_ENGINE", "whisper").lower()
+COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8")
+ENGINES = ("whisper", "whisper-int8", "ctranslate2")
+
+# Same fallback schedule and thresholds as whisper.transcribe
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# Bump when the cached result changes shape or meaning, to orphan old entries
+TRANSCRIPT_FORMAT = 1
+
+
+class WhisperEngine:
+    """openai-whisper (optionally int8-quantized); windows are decoded as one batch."""
+
+    batched = True
+
+    def __init__(self, model_size: str, language: Optional[str] = None, quantize: bool = False, download_root: str = "./models/"):
+        import torch
+        import whisper
+
+        self.torch = torch
+        self.whisper = whisper
+        self.language = language
+        device = "cpu" if quantize or not torch.cuda.is_available() else "cuda"
+        model = whisper.load_model(model_size, device=device, download_root=download_root)
+        if quantize:
+            model = _quantize_int8(model)
+        self.model = model
+        # fp16 only where it is native; on CPU it would just be emulated (and warned about)
+        self.fp16 = device == "cuda"
+        self.name = f"whisper{'-int8' if quantize else ''}:{model_size}:{device}"
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        with self.torch.no_grad():
+            return self.model.transcribe(audio, language=self.language, fp16=self.fp16).get("text", "")
+
+    def decode_windows(self, windows: Sequence[np.ndarray]) -> List[str]:
+        torch, whisper = self.torch, self.whisper
+        with torch.no_grad():
+            n_mels = self.model.dims.n_mels
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(np.asarray(w, dtype=np.float32))), n_mels)
+                for w in windows
+            ]).to(self.model.device)
+            texts = [""] * len(windows)
+            pending = list(range(len(windows)))
+            for temperature in TEMPERATURES:
+                options = whisper.DecodingOptions(
+                    language=self.language,
+                    temperature=temperature,
+                    without_timestamps=True,
+                    fp16=self.fp16,
+                )
+                results = whisper.decode(self.model, mel[pending], options)
+                retry = []
+                for index, result in zip(pending, results):
+                    silent = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+                    poor = (
+                        result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                        or result.avg_logprob < LOGPROB_THRESHOLD
+                    )
+                    if silent:
+                        texts[index] = ""
+                    else:
+                        # As in transcribe, the last attempt stands if every temperature fails
+                        texts[index] = " " + result.text.strip() if result.text.strip() else ""
+                        if poor:
+                            retry.append(index)
+                if not retry:
+                    break
+                pending = retry
+            return texts
+
+
+def _quantize_int8(model):
+    import torch
+    from whisper.model import Linear as WhisperLinear
+
+    # whisper's Linear only casts the weights to the input dtype (a no-op in fp32 on CPU);
+    # turn it back into nn.Linear so quantize_dynamic recognizes and swaps it
+    for module in model.modules():
+        if type(module) is WhisperLinear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class CTranslate2Engine:
+    """faster-whisper; windows are decoded one by one (CTranslate2 threads each one)."""
+
+    batched = False
+
+    def __init__(self, model_size: str, language: Optional[str] = None, compute_type: str = COMPUTE_TYPE, download_root: str = "./models/"):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError(
+                "STT_ENGINE=ctranslate2 needs the faster-whisper package (pip install faster-whisper, "
+                "listed in the STT requirements.txt): rebuild the image or pick another STT_ENGINE"
+            ) from e
+        import torch
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, download_root=download_root)
+        self.language = language
+        self.name = f"ctranslate2:{model_size}:{device}:{compute_type}"
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        segments, _ = self.model.transcribe(np.asarray(audio, dtype=np.float32), language=self.language)
+        return "".join(segment.text for segment in segments)
+
+    def decode_windows(self, windows: Sequence[np.ndarray]) -> List[str]:
+        texts = []
+        for window in windows:
+            segments, _ = self.model.transcribe(
+                np.asarray(window, dtype=np.float32),
+                language=self.language,
+                without_timestamps=True,
+                condition_on_previous_text=False,
+            )
+            text = "".join(segment.text for segment in segments).strip()
+            texts.append(" " + text if text else "")
+        return texts
+
+
+def transcript_key(audio: np.ndarray, model_size: str, language: Optional[str], vad: bool, engine: str = ENGINE) -> str:
+    """Content-addressed cache key of a transcript: sha256 of the PCM and the settings."""
+    digest = hashlib.sha256(np.ascontiguousarray(audio, dtype=np.float32).data)
+    settings = [TRANSCRIPT_FORMAT, engine, COMPUTE_TYPE if engine == "ctranslate2" else "", model_size, language, bool(vad)]
+    digest.update(json.dumps(settings).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def upload_key(data: bytes, content_type: str = "") -> str:
+    """Key of an upload as received: sha256 of its bytes and declared type (raw L16 needs it)."""
+    digest = hashlib.sha256(data)
+    digest.update(b"\0" + content_type.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_engine(model_size: str, language: Optional[str] = None, engine: str = ENGINE, download_root: str = "./models/"):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown STT_ENGINE {engine!r}, expected one of {ENGINES}")
+    if engine == "ctranslate2":
+        loaded = CTranslate2Engine(model_size, language, download_root=download_root)
+    else:
+        loaded = WhisperEngine(model_size, language, quantize=engine == "whisper-int8", download_root=download_root)
+    logger.info(f"STT engine: {loaded.name}")
+    return loaded
@@ -0,0 +1,210 @@
+"""Pooled, persistent asyncio Thrift clients."""
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+
+from thriftpy2.rpc import make_aio_client
+from thriftpy2.transport import TTransportException
+
+logger = logging.getLogger("thrift-pool")
+
+# Errors after which a connection cannot be trusted anymore
+CONNECTION_ERRORS = (TTransportException, ConnectionError, asyncio.IncompleteReadError, OSError)
+
+
+class AsyncThriftPool:
+    """Connection pool for one downstream Thrift service.
+
+    Connections are opened lazily up to ``max_size``; callers wait when all
+    are busy. On checkout a connection is dropped if the peer closed it or if
+    it sat idle longer than ``max_idle`` seconds; a background task also
+    evicts idle connections down to ``min_size``. A call that fails on a
+    reused connection with a transport error is retried once on a fresh one,
+    since the server may have closed the socket while it was idle.
+    """
+
+    def __init__(
+        self,
+        service,
+        host: str,
+        port: int,
+        min_size: int = 1,
+        max_size: int = 10,
+        max_idle: float = 60.0,
+        timeout: int = 300000,
+        **client_kwargs: Any,
+    ):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.client_kwargs = client_kwargs
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._size = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.evicted = 0
+        self.broken = 0
+
+    async def start(self) -> None:
+        """Open ``min_size`` connections and start the idle reaper (call from the running loop)."""
+        self._cond = asyncio.Condition()
+        for _ in range(self.min_size):
+            try:
+                client = await self._connect()
+            except CONNECTION_ERRORS as e:
+                # The service may still be loading its model; connect lazily later
+                logger.warning(f"Pool {self.host}:{self.port} warm-up failed: {e}")
+                break
+            self._size += 1
+            self._idle.append((client, time.monotonic()))
+        self._reaper = asyncio.ensure_future(self._reap())
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        while self._idle:
+            client, _ = self._idle.pop()
+            self._close_client(client)
+        self._size = 0
+
+    async def call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """Invoke ``method`` on a pooled connection."""
+        client, reused = await self._acquire()
+        try:
+            result = await getattr(client, method)(*args, **kwargs)
+        except CONNECTION_ERRORS as e:
+            await self._release(client, broken=True)
+            if not reused:
+                raise
+            logger.info(f"Stale connection to {self.host}:{self.port} ({e}), retrying on a new one")
+            client, _ = await self._acquire(fresh=True)
+            try:
+                result = await getattr(client, method)(*args, **kwargs)
+            except BaseException:
+                await self._release(client, broken=True)
+                raise
+        except BaseException:
+            # Cancellation or a protocol error mid-call leaves the stream in an unknown state
+            await self._release(client, broken=True)
+            raise
+        await self._release(client)
+        return result
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """Hold one pooled connection for several calls that must share it (e.g. a polled stream).
+
+        Unlike :meth:`call` nothing is retried: a broken connection is dropped
+        and the error propagates to the caller.
+        """
+        client, _ = await self._acquire()
+        try:
+            yield client
+        except BaseException:
+            await self._release(client, broken=True)
+            raise
+        await self._release(client)
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._size - len(self._idle),
+            "created": self.created,
+            "evicted": self.evicted,
+            "broken": self.broken,
+        }
+
+    async def _connect(self):
+        client = await make_aio_client(
+            self.service, self.host, self.port, timeout=self.timeout, **self.client_kwargs
+        )
+        self.created += 1
+        return client
+
+    async def _acquire(self, fresh: bool = False) -> Tuple[Any, bool]:
+        async with self._cond:
+            while True:
+                while self._idle and not fresh:
+                    # LIFO keeps the most recently used (warmest) connections busy
+                    client, last_used = self._idle.pop()
+                    if time.monotonic() - last_used > self.max_idle or not self._healthy(client):
+                        self._discard(client)
+                        continue
+                    return client, True
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if fresh and self._idle:
+                    # Make room for a fresh connection by dropping an idle one
+                    client, _ = self._idle.popleft()
+                    self._close_client(client)
+                    break
+                await self._cond.wait()
+        try:
+            return await self._connect(), False
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    async def _release(self, client, broken: bool = False) -> None:
+        async with self._cond:
+            if broken:
+                self.broken += 1
+                self._close_client(client)
+                self._size -= 1
+            else:
+                self._idle.append((client, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, client) -> None:
+        self.evicted += 1
+        self._close_client(client)
+        self._size -= 1
+
+    async def _reap(self) -> None:
+        interval = max(self.max_idle / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            async with self._cond:
+                now = time.monotonic()
+                keep: Deque[Tuple[Any, float]] = deque()
+                # Oldest first; keep at least min_size connections open
+                while self._idle:
+                    client, last_used = self._idle.popleft()
+                    expired = now - last_used > self.max_idle and self._size > self.min_size
+                    if expired or not self._healthy(client):
+                        self._discard(client)
+                    else:
+                        keep.append((client, last_used))
+                self._idle = keep
+                self._cond.notify_all()
+
+    @staticmethod
+    def _healthy(client) -> bool:
+        # TAsyncClient -> protocol -> transport (framed wraps buffered) -> TAsyncSocket
+        sock = client._iprot.trans
+        while hasattr(sock, "_trans"):
+            sock = sock._trans
+        reader = getattr(sock, "reader", None)
+        writer = getattr(sock, "writer", None)
+        if reader is None or writer is None:
+            return False
+        return not reader.at_eof() and not writer.is_closing()
+
+    @staticmethod
+    def _close_client(client) -> None:
+        try:
+            client.close()
+        except Exception:
+            pass
@@ -0,0 +1,320 @@
+"""Thrift server modes for the model services.
+
+THRIFT_SERVER_MODE selects how requests are scheduled:
+
+- ``threaded`` (default): thriftpy2 make_server, one thread per connection.
+- ``pool``: a selector thread watches every connection and hands each
+  incoming request to a fixed pool of THRIFT_WORKERS threads, so idle
+  pooled connections do not pin a thread and excess requests queue.
+- ``prefork``: THRIFT_PROCESSES forked processes share the listening socket,
+  each running the ``pool`` server. The model is loaded before forking and
+  shared copy-on-write.
+- ``async``: thriftpy2 asyncio server; I/O runs on the event loop and
+  handler calls run on THRIFT_WORKERS threads.
+
+Worker modes log queue depth and utilization every THRIFT_STATS_INTERVAL s.
+The wire format (protocol/transport) comes from thrift_wire.py.
+"""
+import asyncio
+import logging
+import os
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from thriftpy2.rpc import make_aio_server, make_server
+from thriftpy2.server import TServer
+from thriftpy2.thrift import TProcessor
+from thriftpy2.transport import TServerSocket, TTransportException
+
+import thrift_wire
+
+logger = logging.getLogger("thrift-server")
+
+MODE = os.getenv("THRIFT_SERVER_MODE", "threaded")
+WORKERS = int(os.getenv("THRIFT_WORKERS", "4"))
+PROCESSES = int(os.getenv("THRIFT_PROCESSES", "2"))
+STATS_INTERVAL = float(os.getenv("THRIFT_STATS_INTERVAL", "30"))
+
+_loop_local = threading.local()
+
+
+def run_coroutine(coro):
+    """Run ``coro`` on this thread's persistent event loop.
+
+    Replaces ``asyncio.run`` in sync handlers, which builds and tears down a
+    new event loop on every call.
+    """
+    loop = getattr(_loop_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _loop_local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+
+class WorkerStats:
+    """Queue depth and busy time of a fixed set of workers."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.busy = 0
+        self.completed = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self._window = (time.monotonic(), 0.0, 0.0, 0)
+
+    def job_queued(self) -> float:
+        with self._lock:
+            self.queued += 1
+        return time.monotonic()
+
+    def job_started(self, queued_at: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+            self.wait_time += now - queued_at
+        return now
+
+    def job_finished(self, started_at: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.busy -= 1
+            self.completed += 1
+            self.busy_time += now - started_at
+
+    def snapshot(self) -> dict:
+        """Current values plus utilization and mean queue wait since the previous snapshot."""
+        now = time.monotonic()
+        with self._lock:
+            since, busy_time, wait_time, completed = self._window
+            elapsed = max(now - since, 1e-9)
+            done = self.completed - completed
+            stats = {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queue_depth": self.queued,
+                "completed": self.completed,
+                "utilization": round((self.busy_time - busy_time) / (elapsed * self.workers), 3),
+                "avg_queue_wait_ms": round((self.wait_time - wait_time) * 1000 / done, 1) if done else 0.0,
+            }
+            self._window = (now, self.busy_time, self.wait_time, self.completed)
+        return stats
+
+
+def _report_stats(name: str, stats: WorkerStats) -> None:
+    def loop():
+        while True:
+            time.sleep(STATS_INTERVAL)
+            logger.info(f"{name} pid={os.getpid()} stats: {stats.snapshot()}")
+
+    threading.Thread(target=loop, name=f"{name}-stats", daemon=True).start()
+
+
+class _Connection:
+    def __init__(self, server: TServer, client):
+        self.client = client
+        self.itrans = server.itrans_factory.get_transport(client)
+        self.otrans = server.otrans_factory.get_transport(client)
+        self.iprot = server.iprot_factory.get_protocol(self.itrans)
+        self.oprot = server.oprot_factory.get_protocol(self.otrans)
+
+    def fileno(self) -> int:
+        return self.client.sock.fileno()
+
+    def close(self) -> None:
+        self.itrans.close()
+        self.otrans.close()
+
+
+class TWorkerPoolServer(TServer):
+    """Half-sync/half-async server: one selector thread, a fixed pool of workers.
+
+    A connection is handed to a worker only when it has a request to read; the
+    worker processes that single request and gives the connection back to the
+    selector. Clients must not pipeline requests on one connection (the
+    maestro pools never do).
+    """
+
+    def __init__(self, *args, workers: int = 4, listening: bool = False, **kwargs):
+        TServer.__init__(self, *args, **kwargs)
+        self.workers = workers
+        self.listening = listening
+        self.stats = WorkerStats(workers)
+        self.closed = False
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._returned: "queue.Queue" = queue.Queue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+
+    def serve(self) -> None:
+        if not self.listening:
+            self.trans.listen()
+        # Pre-forked processes all wake up for one connection and only one gets it: the others
+        # must come back to their selector, not block in accept() until the next client
+        self.trans.sock.setblocking(False)
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"thrift-worker-{i}", daemon=True).start()
+        selector = selectors.DefaultSelector()
+        selector.register(self.trans.sock, selectors.EVENT_READ, "accept")
+        selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+        while not self.closed:
+            for key, _ in selector.select(timeout=1.0):
+                if key.data == "accept":
+                    conn = self._accept()
+                    if conn is not None:
+                        selector.register(conn, selectors.EVENT_READ, conn)
+                elif key.data == "wake":
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    while not self._returned.empty():
+                        conn = self._returned.get_nowait()
+                        selector.register(conn, selectors.EVENT_READ, conn)
+                else:
+                    conn = key.data
+                    selector.unregister(conn)
+                    self._jobs.put((conn, self.stats.job_queued()))
+
+    def _accept(self):
+        """The next pending connection, or None if another process took it."""
+        try:
+            client = self.trans.accept()
+        except BlockingIOError:
+            return None
+        except Exception as x:
+            logger.warning(f"accept failed: {x}")
+            return None
+        # Served by blocking workers, whatever the listening socket's mode
+        if not self.trans.client_timeout:
+            client.sock.setblocking(True)
+        return _Connection(self, client)
+
+    def _work(self) -> None:
+        while True:
+            conn, queued_at = self._jobs.get()
+            started_at = self.stats.job_started(queued_at)
+            keep = True
+            try:
+                self.processor.process(conn.iprot, conn.oprot)
+            except TTransportException:
+                keep = False
+            except Exception as x:
+                logger.exception(x)
+                keep = False
+            finally:
+                self.stats.job_finished(started_at)
+            if keep:
+                self._returned.put(conn)
+                self._wake_w.send(b"\0")
+            else:
+                conn.close()
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class _AsyncHandler:
+    """Expose a sync handler to the asyncio server, running calls on a thread pool."""
+
+    def __init__(self, handler, workers: int):
+        self._handler = handler
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thrift-worker")
+        self.stats = WorkerStats(workers)
+
+    def __getattr__(self, api: str):
+        fn = getattr(self._handler, api)
+
+        def timed(queued_at, *args):
+            started_at = self.stats.job_started(queued_at)
+            try:
+                return fn(*args)
+            finally:
+                self.stats.job_finished(started_at)
+
+        async def call(*args):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, timed, self.stats.job_queued(), *args)
+
+        return call
+
+
+def _pool_server(service, handler, host: str, port: int, client_timeout, listen_sock=None) -> TWorkerPoolServer:
+    server_socket = TServerSocket(host=host, port=port, client_timeout=client_timeout)
+    if listen_sock is not None:
+        server_socket.sock = listen_sock
+    wire = thrift_wire.factories()
+    return TWorkerPoolServer(
+        TProcessor(service, handler),
+        server_socket,
+        itrans_factory=wire["trans_factory"],
+        iprot_factory=wire["proto_factory"],
+        workers=WORKERS,
+        listening=listen_sock is not None,
+    )
+
+
+def _serve_prefork(service, handler, host: str, port: int, client_timeout) -> None:
+    server_socket = TServerSocket(host=host, port=port, client_timeout=client_timeout)
+    server_socket.listen()
+    children = {}
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            server = _pool_server(service, handler, host, port, client_timeout, listen_sock=server_socket.sock)
+            _report_stats(f"{service.__name__}[{index}]", server.stats)
+            server.serve()
+            os._exit(0)
+        children[pid] = index
+
+    for index in range(PROCESSES):
+        spawn(index)
+
+    def shutdown(signum, frame):
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while True:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is not None:
+            logger.warning(f"Worker process {pid} exited ({status}), respawning")
+            spawn(index)
+
+
+def serve(service, handler, host: str, port: int, client_timeout=0) -> None:
+    """Serve ``handler`` in the mode selected by THRIFT_SERVER_MODE."""
+    name = service.__name__
+    logger.info(
+        f"{name} server mode={MODE} wire={thrift_wire.describe()} "
+        f"workers={WORKERS} processes={PROCESSES if MODE == 'prefork' else 1}"
+    )
+    if MODE == "threaded":
+        make_server(service, handler, host, port, client_timeout=client_timeout, **thrift_wire.factories()).serve()
+    elif MODE == "pool":
+        server = _pool_server(service, handler, host, port, client_timeout)
+        _report_stats(name, server.stats)
+        server.serve()
+    elif MODE == "prefork":
+        _serve_prefork(service, handler, host, port, client_timeout)
+    elif MODE == "async":
+        async_handler = _AsyncHandler(handler, WORKERS)
+        _report_stats(name, async_handler.stats)
+        # thriftpy2's asyncio server has no fixed idle timeout semantics; None waits forever
+        server = make_aio_server(
+            service, async_handler, host, port, client_timeout=client_timeout or None, **thrift_wire.aio_factories()
+        )
+        server.serve()
+    else:
+        raise ValueError(f"Unknown THRIFT_SERVER_MODE: {MODE}")
@@ -0,0 +1,58 @@
+"""Thrift wire format (protocol + transport) shared by the maestro and the model services.
+
+Both ends read the same two variables, which docker-compose loads from
+src/thrift/thrift.env, so clients and servers always agree:
+
+- THRIFT_PROTOCOL: ``binary`` (default) or ``compact``
+- THRIFT_TRANSPORT: ``buffered`` (default) or ``framed``
+
+A mismatch does not fail cleanly (the server just reads garbage), hence the
+single config source.
+"""
+import os
+from typing import Dict
+
+from thriftpy2.contrib.aio.protocol import TAsyncBinaryProtocolFactory, TAsyncCompactProtocolFactory
+from thriftpy2.contrib.aio.transport import TAsyncBufferedTransportFactory, TAsyncFramedTransportFactory
+from thriftpy2.protocol import TCompactProtocolFactory, TCyBinaryProtocolFactory
+from thriftpy2.transport import TCyBufferedTransportFactory, TCyFramedTransportFactory
+
+PROTOCOLS = ("binary", "compact")
+TRANSPORTS = ("buffered", "framed")
+
+PROTOCOL = os.getenv("THRIFT_PROTOCOL", "binary")
+TRANSPORT = os.getenv("THRIFT_TRANSPORT", "buffered")
+
+_SYNC_PROTOCOLS = {"binary": TCyBinaryProtocolFactory, "compact": TCompactProtocolFactory}
+_SYNC_TRANSPORTS = {"buffered": TCyBufferedTransportFactory, "framed": TCyFramedTransportFactory}
+_ASYNC_PROTOCOLS = {"binary": TAsyncBinaryProtocolFactory, "compact": TAsyncCompactProtocolFactory}
+_ASYNC_TRANSPORTS = {"buffered": TAsyncBufferedTransportFactory, "framed": TAsyncFramedTransportFactory}
+
+
+def _check(protocol: str, transport: str) -> None:
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"Unknown THRIFT_PROTOCOL: {protocol} (expected one of {PROTOCOLS})")
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown THRIFT_TRANSPORT: {transport} (expected one of {TRANSPORTS})")
+
+
+def factories(protocol: str = PROTOCOL, transport: str = TRANSPORT) -> Dict[str, object]:
+    """``proto_factory``/``trans_factory`` kwargs for make_server/make_client."""
+    _check(protocol, transport)
+    return {
+        "proto_factory": _SYNC_PROTOCOLS[protocol](),
+        "trans_factory": _SYNC_TRANSPORTS[transport](),
+    }
+
+
+def aio_factories(protocol: str = PROTOCOL, transport: str = TRANSPORT) -> Dict[str, object]:
+    """``proto_factory``/``trans_factory`` kwargs for make_aio_server/make_aio_client."""
+    _check(protocol, transport)
+    return {
+        "proto_factory": _ASYNC_PROTOCOLS[protocol](),
+        "trans_factory": _ASYNC_TRANSPORTS[transport](),
+    }
+
+
+def describe() -> str:
+    return f"{PROTOCOL}/{TRANSPORT}"
@@ -0,0 +1,205 @@
+"""Dynamic micro-batching in front of the STT engine replicas of a ModelPool.
+
+Concurrent requests are queued. A collector thread waits until a replica is
+free, then takes the first queued request plus whatever arrives within
+``max_wait`` seconds, up to ``max_batch`` requests, and sends the batch to
+that replica. Every request is cut into 30-second windows. The log-Mel
+windows of the whole batch go through the encoder and the decoder together,
+in one ``whisper.decode`` call over a stacked tensor (engines that cannot
+batch take them one by one, see stt_engine.py), and the window texts are
+then joined back per caller. While every replica is busy, requests keep
+queueing, so batches grow with the load.
+
+    POOL = pool_from_env("stt", "STT", lambda: load_engine(MODEL_SIZE, language="pt"))
+    BATCHER = WhisperBatcher(POOL)
+    text = await BATCHER.transcribe_async(decode_audio(audio))   # asyncio
+    text = BATCHER.transcribe(decode_audio(audio))               # threads
+
+Windows are fixed 30-second cuts rather than ``transcribe``'s timestamp
+driven seeking, so a word on a window boundary may be split. Windows that
+fail the usual quality checks are decoded again at higher temperatures, and
+windows judged silent are dropped, as ``model.transcribe`` does. A request
+collected alone, and every request with ``max_batch=1``, goes through the
+engine's ``transcribe`` unchanged: the windowing only applies while requests
+are actually batched together.
+
+With ``STT_VAD=1``, ``transcribe_speech`` first runs voice activity detection
+(see vad.py). Silent stretches are dropped, and each speech segment is
+queued as a request of its own. The segments of a long upload are therefore
+batched together and spread over every free replica. Their texts come back
+in order, with start and end times.
+
+Settings: ``STT_MAX_BATCH`` (default 8), ``STT_BATCH_WAIT_MS`` (default 10)
+and ``STT_VAD`` (default 0).
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vad import SAMPLE_RATE, speech_segments
+from workers import ModelPool, PoolBusy
+
+logger = logging.getLogger("whisper-batch")
+
+MAX_BATCH = int(os.getenv("STT_MAX_BATCH", "8"))
+MAX_WAIT = float(os.getenv("STT_BATCH_WAIT_MS", "10")) / 1000.0
+VAD = os.getenv("STT_VAD", "0").lower() in ("1", "true", "yes")
+
+# Whisper's fixed input window: 30 s
+WINDOW = 30 * SAMPLE_RATE
+# Trailing windows shorter than this (0.1 s) carry no speech worth a decoder pass
+MIN_WINDOW = SAMPLE_RATE // 10
+
+
+class WhisperBatcher:
+    def __init__(
+        self,
+        pool: ModelPool,
+        max_batch: int = MAX_BATCH,
+        max_wait: float = MAX_WAIT,
+    ):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._reset()
+        # The collector thread does not survive fork (e.g. prefork Thrift servers)
+        os.register_at_fork(after_in_child=self._reset)
+
+    def submit(self, audio: np.ndarray) -> concurrent.futures.Future:
+        """Queue 16 kHz mono float32 samples; the future resolves to the transcript.
+
+        Raises ``PoolBusy`` once the pool's queue size worth of requests is waiting.
+        """
+        self._start()
+        if self.pool.queue_size and self._queue.qsize() >= self.pool.queue_size:
+            raise PoolBusy(f"{self.pool.name}: {self._queue.qsize()} requests already waiting")
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put((audio, future))
+        return future
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        return self.submit(audio).result()
+
+    async def transcribe_async(self, audio: np.ndarray) -> str:
+        return await asyncio.wrap_future(self.submit(audio))
+
+    def transcribe_speech(self, audio: np.ndarray, vad: bool = VAD) -> Tuple[str, List[dict]]:
+        """(text, segments); segments carry start/end seconds and are empty without VAD."""
+        if not vad:
+            return self.transcribe(audio), []
+        spans = speech_segments(audio, SAMPLE_RATE)
+        futures = [self.submit(audio[start:end]) for start, end in spans]
+        return _stitch(spans, [future.result() for future in futures])
+
+    async def transcribe_speech_async(self, audio: np.ndarray, vad: bool = VAD) -> Tuple[str, List[dict]]:
+        if not vad:
+            return await self.transcribe_async(audio), []
+        spans = speech_segments(audio, SAMPLE_RATE)
+        futures = [asyncio.wrap_future(self.submit(audio[start:end])) for start, end in spans]
+        return _stitch(spans, await asyncio.gather(*futures))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            }
+
+    def _reset(self) -> None:
+        self._queue: "queue.Queue[Tuple[np.ndarray, concurrent.futures.Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        # One batch in flight per replica; the next one is collected when a replica frees up
+        self._slots = threading.Semaphore(self.pool.replicas)
+        self._started = False
+        self.batches = 0
+        self.requests = 0
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name="whisper-batch", daemon=True).start()
+
+    def _collect(self) -> list:
+        jobs = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                jobs.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self) -> None:
+        while True:
+            self._slots.acquire()
+            jobs = self._collect()
+            # Callers that gave up (e.g. cancelled) are not worth a decoder pass
+            jobs = [(audio, future) for audio, future in jobs if future.set_running_or_notify_cancel()]
+            if not jobs:
+                self._slots.release()
+                continue
+            with self._lock:
+                self.batches += 1
+                self.requests += len(jobs)
+            try:
+                batch = self.pool.submit(transcribe_batch, [audio for audio, _ in jobs], self.max_batch)
+            except Exception as e:
+                self._deliver(jobs, None, e)
+                continue
+            batch.add_done_callback(lambda done, jobs=jobs: self._deliver(jobs, done))
+
+    def _deliver(self, jobs: list, batch: Optional[concurrent.futures.Future], error: Optional[BaseException] = None) -> None:
+        self._slots.release()
+        if error is None:
+            error = batch.exception()
+        if error is not None:
+            logger.error(f"Batched transcription failed: {error!r}")
+            for _, future in jobs:
+                future.set_exception(error)
+            return
+        for (_, future), text in zip(jobs, batch.result()):
+            future.set_result(text)
+
+
+def _stitch(spans: Sequence[Tuple[int, int]], texts: Sequence[str]) -> Tuple[str, List[dict]]:
+    segments = [
+        {"start": round(start / SAMPLE_RATE, 2), "end": round(end / SAMPLE_RATE, 2), "text": text.strip()}
+        for (start, end), text in zip(spans, texts)
+        if text.strip()
+    ]
+    return " ".join(segment["text"] for segment in segments), segments
+
+
+def transcribe_batch(engine, audios: Sequence[np.ndarray], max_batch: int) -> List[str]:
+    """Pool job: transcripts for ``audios``, decoding up to ``max_batch`` windows per pass."""
+    if max_batch == 1 or len(audios) == 1:
+        # Nothing to batch with: keep transcribe's timestamp-driven seeking
+        return [engine.transcribe(audio) for audio in audios]
+    # (owner, window samples) for every 30-second window of every request
+    windows: List[Tuple[int, np.ndarray]] = []
+    for owner, audio in enumerate(audios):
+        for start in range(0, max(len(audio), 1), WINDOW):
+            window = audio[start : start + WINDOW]
+            if start == 0 or len(window) >= MIN_WINDOW:
+                windows.append((owner, window))
+    texts: List[str] = []
+    for first in range(0, len(windows), max_batch):
+        texts.extend(engine.decode_windows([window for _, window in windows[first : first + max_batch]]))
+    joined = [""] * len(audios)
+    for (owner, _), text in zip(windows, texts):
+        joined[owner] += text
+    return joined
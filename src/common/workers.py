@@ -0,0 +1,449 @@
+"""Model replicas that keep inference off the event loop and off the handler threads.
+
+A ``ModelPool`` holds ``replicas`` copies of a model, each used by exactly one
+worker (a thread, or a forked process with ``mode="process"``), so models
+need no locks. Handlers submit jobs to a bounded queue. A job is a
+module-level function, called as ``fn(model, *args, **kwargs)`` on the first
+free replica:
+
+    POOL = pool_from_env("llm", "LLM", _load_model)
+    text = await POOL.run(_complete, messages, params)       # asyncio
+    text = POOL.call(_complete, messages, params)            # threads
+    async for chunk in POOL.stream(_complete_stream, ...):   # generator jobs
+        ...
+
+When the queue is full, ``PoolBusy`` is raised instead of letting latency pile
+up. ``stats()`` reports each replica's busy time and how long jobs waited in
+the queue. Those are the numbers to size replicas against cores: waits that
+grow while every replica is busy call for more replicas (or cores).
+
+Settings are ``<PREFIX>_REPLICAS`` (default 1), ``<PREFIX>_WORKERS_MODE``
+(thread|process) and ``<PREFIX>_QUEUE_SIZE`` (jobs allowed to wait, default
+64; 0 = unbounded).
+
+With ``background=True``, thread replicas load on ``start()`` in background
+threads rather than in the constructor, so a server can listen (and answer
+liveness probes) while its models load. ``available`` counts the replicas
+that can take jobs: a readiness check. Jobs submitted before that wait in the
+queue. Background loading is for servers that do not fork after ``start()``.
+
+``concurrency`` gives each replica that many workers sharing its model, for
+models that take concurrent calls and batch them (``llm_batch.BatchEngine``).
+It is 1 by default: one job at a time per model.
+
+Thread replicas are enough for models that release the GIL while computing
+(llama.cpp, PyTorch). Process replicas isolate models that do not. In process
+mode, jobs and results are pickled, each replica loads its own model in its
+own process, and a job cancelled after it was dispatched still runs to the
+end. Workers start on first use, or on ``start()``, and again in every forked
+child (e.g. with THRIFT_SERVER_MODE=prefork).
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("workers")
+
+MODES = ("thread", "process")
+
+
+class PoolBusy(RuntimeError):
+    """The job queue is full; the caller should shed the request (e.g. 503)."""
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "emit", "submitted", "cancelled")
+
+    def __init__(self, fn, args, kwargs, emit):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.emit: Optional[Callable[[Any], None]] = emit
+        self.submitted = time.monotonic()
+        self.cancelled = False
+
+
+class _Replica:
+    __slots__ = ("jobs", "errors", "active", "busy_seconds", "busy_since", "wait_seconds", "wait_max")
+
+    def __init__(self):
+        self.jobs = 0
+        self.active = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.busy_since = 0.0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+
+
+def _post(loop: asyncio.AbstractEventLoop, items: asyncio.Queue, message: tuple) -> None:
+    try:
+        loop.call_soon_threadsafe(items.put_nowait, message)
+    except RuntimeError:
+        # The consumer's loop is closed: nobody is left to read the item
+        pass
+
+
+def _send(results, kind: str, replica: int, job_id: Optional[int], value: Any) -> None:
+    # Pickle here rather than in the queue's feeder thread, where a failure would be lost
+    try:
+        data = pickle.dumps((kind, replica, job_id, value))
+    except Exception as e:
+        data = pickle.dumps(("error", replica, job_id, RuntimeError(f"Unpicklable {kind}: {e!r}")))
+    results.put(data)
+
+
+def _process_worker(load_fn, replica: int, jobs, results, concurrency: int = 1) -> None:
+    try:
+        model = load_fn()
+    except Exception as e:
+        _send(results, "dead", replica, None, repr(e))
+        return
+    _send(results, "ready", replica, None, None)
+    for _ in range(concurrency - 1):
+        threading.Thread(target=_process_jobs, args=(model, replica, jobs, results), daemon=True).start()
+    _process_jobs(model, replica, jobs, results)
+
+
+def _process_jobs(model, replica: int, jobs, results) -> None:
+    while True:
+        job_id, fn, args, kwargs, streaming = pickle.loads(jobs.get())
+        _send(results, "start", replica, job_id, None)
+        try:
+            result = fn(model, *args, **kwargs)
+            if streaming:
+                for item in result:
+                    _send(results, "item", replica, job_id, item)
+                result = None
+            _send(results, "done", replica, job_id, result)
+        except Exception as e:
+            _send(results, "error", replica, job_id, e)
+
+
+class ModelPool:
+    def __init__(
+        self,
+        name: str,
+        load_fn: Callable[[], Any],
+        replicas: int = 1,
+        mode: str = "thread",
+        queue_size: int = 64,
+        concurrency: int = 1,
+        background: bool = False,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown workers mode {mode!r}, expected one of {MODES}")
+        self.name = name
+        self.load_fn = load_fn
+        self.replicas = max(1, replicas)
+        self.mode = mode
+        self.queue_size = queue_size
+        self.concurrency = max(1, concurrency)
+        self.background = background and mode == "thread"
+        self._lock = threading.Lock()
+        self._models: List[Any] = [None] * self.replicas if mode == "thread" else []
+        # Thread replicas whose load has finished, successfully or not
+        self._loaded = 0
+        if mode == "thread" and not self.background:
+            # Thread replicas load up front (load errors show at boot); forked children inherit them
+            self._models = [self._load(i) for i in range(self.replicas)]
+            self._loaded = self.replicas
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    @property
+    def available(self) -> int:
+        """Replicas with a loaded model, ready for jobs (process replicas count once they report ready)."""
+        if self.mode == "thread":
+            return sum(model is not None for model in self._models)
+        return self._ready
+
+    @property
+    def failed(self) -> bool:
+        """True when no replica has, or will get, a model."""
+        if self.mode == "thread":
+            return self._loaded >= self.replicas and self.available == 0
+        return self._dead >= self.replicas
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._started_at = time.monotonic()
+            if self.mode == "thread":
+                for replica, model in enumerate(self._models):
+                    if self.background:
+                        threading.Thread(
+                            target=self._load_and_serve, args=(replica,), name=f"{self.name}-load-{replica}", daemon=True
+                        ).start()
+                    elif model is not None:
+                        self._serve(replica, model)
+                return
+            ctx = multiprocessing.get_context("fork")
+            self._jobs_q = ctx.Queue()
+            self._results_q = ctx.Queue()
+            for replica in range(self.replicas):
+                ctx.Process(
+                    target=_process_worker,
+                    args=(self.load_fn, replica, self._jobs_q, self._results_q, self.concurrency),
+                    name=f"{self.name}-replica-{replica}",
+                    daemon=True,
+                ).start()
+            threading.Thread(target=self._reader, name=f"{self.name}-results", daemon=True).start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+        """Queue ``fn(model, *args, **kwargs)``; raises ``PoolBusy`` when the queue is full."""
+        return self._submit(fn, args, kwargs, None).future
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # Cancelling the caller cancels the job if no replica has picked it up yet
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def stream(self, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """Run a generator job, yielding its items on the event loop as they are produced."""
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        job = self._submit(fn, args, kwargs, lambda item: _post(loop, items, (True, item)))
+        job.future.add_done_callback(lambda _: _post(loop, items, (False, None)))
+        try:
+            while True:
+                more, item = await items.get()
+                if not more:
+                    break
+                yield item
+            job.future.result()
+        finally:
+            # Stops a thread replica at its next item when the consumer goes away
+            job.cancelled = True
+            job.future.cancel()
+
+    def iterate(self, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """Blocking version of :meth:`stream` for handler threads."""
+        items: "queue.Queue" = queue.Queue()
+        job = self._submit(fn, args, kwargs, lambda item: items.put((True, item)))
+        job.future.add_done_callback(lambda _: items.put((False, None)))
+        try:
+            while True:
+                more, item = items.get()
+                if not more:
+                    break
+                yield item
+            job.future.result()
+        finally:
+            job.cancelled = True
+            job.future.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            uptime = now - self._started_at if self._started else 0.0
+            waited = sum(r.jobs for r in self._stats)
+            replicas = []
+            for i, r in enumerate(self._stats):
+                busy = r.busy_seconds + (now - r.busy_since if r.busy_since else 0.0)
+                replicas.append({
+                    "replica": i,
+                    "busy": bool(r.busy_since),
+                    "active": r.active,
+                    "jobs": r.jobs,
+                    "errors": r.errors,
+                    "busy_seconds": round(busy, 3),
+                    "utilization": round(busy / uptime, 3) if uptime else 0.0,
+                    "queue_wait_avg_ms": round(r.wait_seconds / r.jobs * 1000, 1) if r.jobs else 0.0,
+                    "queue_wait_max_ms": round(r.wait_max * 1000, 1),
+                })
+                # Models with counters of their own (e.g. a BatchEngine's slots) report them too
+                model = self._models[i] if self.mode == "thread" else None
+                if hasattr(model, "stats"):
+                    replicas[-1]["model"] = model.stats()
+            return {
+                "name": self.name,
+                "mode": self.mode,
+                "replicas": self.replicas,
+                "concurrency": self.concurrency,
+                "available": self.available,
+                "queued": self._pending,
+                "queue_size": self.queue_size,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "queue_wait_avg_ms": round(sum(r.wait_seconds for r in self._stats) / waited * 1000, 1) if waited else 0.0,
+                "queue_wait_max_ms": round(max(r.wait_max for r in self._stats) * 1000, 1),
+                "per_replica": replicas,
+            }
+
+    def _load(self, replica: int) -> Any:
+        try:
+            logger.info(f"{self.name}: loading replica {replica}")
+            return self.load_fn()
+        except Exception:
+            logger.exception(f"{self.name}: failed to load replica {replica}")
+            return None
+
+    def _serve(self, replica: int, model: Any) -> None:
+        for worker in range(self.concurrency):
+            threading.Thread(
+                target=self._thread_worker,
+                args=(replica, model),
+                name=f"{self.name}-replica-{replica}" + (f"-{worker}" if self.concurrency > 1 else ""),
+                daemon=True,
+            ).start()
+
+    def _load_and_serve(self, replica: int) -> None:
+        started = time.monotonic()
+        model = self._load(replica)
+        with self._lock:
+            self._models[replica] = model
+            self._loaded += 1
+        if model is not None:
+            logger.info(f"{self.name}: replica {replica} ready in {time.monotonic() - started:.1f}s")
+            self._serve(replica, model)
+
+    def _reset(self) -> None:
+        # Fresh per-process state: worker threads and the results reader do not survive fork
+        self._lock = threading.Lock()
+        self._started = False
+        self._started_at = 0.0
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._inflight: Dict[int, _Job] = {}
+        self._ids = itertools.count()
+        self._ready = 0
+        self._dead = 0
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._stats = [_Replica() for _ in range(self.replicas)]
+
+    def _submit(self, fn, args, kwargs, emit) -> _Job:
+        self.start()
+        if self.failed:
+            raise RuntimeError(f"{self.name}: model not loaded")
+        with self._lock:
+            if self.queue_size and self._pending >= self.queue_size:
+                self._rejected += 1
+                raise PoolBusy(f"{self.name}: {self._pending} jobs already waiting")
+            self._pending += 1
+            self._submitted += 1
+        job = _Job(fn, args, kwargs, emit)
+        if self.mode == "thread":
+            self._queue.put(job)
+            return job
+        job_id = next(self._ids)
+        try:
+            data = pickle.dumps((job_id, fn, args, kwargs, emit is not None))
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._inflight[job_id] = job
+        self._jobs_q.put(data)
+        return job
+
+    def _begin(self, replica: int, job: _Job) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._pending -= 1
+            running = job.future.set_running_or_notify_cancel()
+            if running or self.mode == "process":
+                # A dispatched process job runs even if its caller is gone
+                stats = self._stats[replica]
+                wait = now - job.submitted
+                stats.wait_seconds += wait
+                stats.wait_max = max(stats.wait_max, wait)
+                # Busy while any of the replica's workers runs a job
+                stats.active += 1
+                if stats.active == 1:
+                    stats.busy_since = now
+            return running
+
+    def _end(self, replica: int, job: _Job, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            stats = self._stats[replica]
+            stats.active = max(0, stats.active - 1)
+            if stats.busy_since and not stats.active:
+                stats.busy_seconds += time.monotonic() - stats.busy_since
+                stats.busy_since = 0.0
+            stats.jobs += 1
+            stats.errors += error is not None
+        if not job.future.running():
+            return
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def _thread_worker(self, replica: int, model: Any) -> None:
+        while True:
+            job = self._queue.get()
+            if not self._begin(replica, job):
+                continue
+            try:
+                result = job.fn(model, *job.args, **job.kwargs)
+                if job.emit is not None:
+                    for item in result:
+                        if job.cancelled:
+                            getattr(result, "close", lambda: None)()
+                            break
+                        job.emit(item)
+                    result = None
+            except Exception as e:
+                self._end(replica, job, error=e)
+            else:
+                self._end(replica, job, result=result)
+
+    def _reader(self) -> None:
+        while True:
+            kind, replica, job_id, value = pickle.loads(self._results_q.get())
+            if kind == "ready":
+                with self._lock:
+                    self._ready += 1
+                logger.info(f"{self.name}: replica {replica} ready")
+                continue
+            if kind == "dead":
+                with self._lock:
+                    self._dead += 1
+                logger.error(f"{self.name}: failed to load replica {replica}: {value}")
+                continue
+            job = self._inflight.get(job_id)
+            if job is None:
+                continue
+            if kind == "start":
+                self._begin(replica, job)
+            elif kind == "item":
+                if job.emit is not None and not job.cancelled:
+                    job.emit(value)
+            else:
+                self._inflight.pop(job_id, None)
+                self._end(replica, job, **({"result": value} if kind == "done" else {"error": value}))
+
+
+def pool_from_env(
+    name: str,
+    prefix: str,
+    load_fn: Callable[[], Any],
+    replicas: int = 1,
+    queue_size: int = 64,
+    concurrency: int = 1,
+    background: bool = False,
+) -> ModelPool:
+    return ModelPool(
+        name,
+        load_fn,
+        replicas=int(os.getenv(f"{prefix}_REPLICAS", str(replicas))),
+        mode=os.getenv(f"{prefix}_WORKERS_MODE", "thread").lower(),
+        queue_size=int(os.getenv(f"{prefix}_QUEUE_SIZE", str(queue_size))),
+        concurrency=concurrency,
+        background=background,
+    )
@@ -1,17 +1,22 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
 from fastapi.responses import StreamingResponse
 import io
 import os
 import logging
 import asyncio
+import hashlib
+from typing import AsyncIterator, Optional, Tuple
+
 import grpc
 
-from stt_pb2 import TranscribeRequest
+from stt_pb2 import AudioChunk
 from stt_pb2_grpc import STTServiceStub
 from llm_pb2 import GenRequest
 from llm_pb2_grpc import LLMServiceStub
 from tts_pb2 import SynthRequest
 from tts_pb2_grpc import TTSServiceStub
+from cache import cache_from_env, make_key
+from pipeline import stream_sentence_audio
 
 # Logger setup
 logger = logging.getLogger("mpes-maestro")
@@ -29,22 +34,37 @@ TTS_GRPC_ADDR = os.getenv("TTS_GRPC_ADDR", "localhost:50053")
 MAX_CONNECTIONS = int(os.getenv("MAESTRO_MAX_CONNECTIONS", "1000"))
 MAX_KEEPALIVE = int(os.getenv("MAESTRO_MAX_KEEPALIVE", "200"))
 CONCURRENCY_LIMIT = int(os.getenv("MAESTRO_MAX_CONCURRENCY", "1000"))
+# Upload chunk size for TranscribeStream
+UPLOAD_CHUNK_SIZE = int(os.getenv("MAESTRO_UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Sentences synthesized in parallel per request in streaming mode
+TTS_PARALLEL = int(os.getenv("MAESTRO_TTS_PARALLEL", "4"))
+
+# Sampling settings sent with every LLM request (empty: the LLM service defaults)
+LLM_PARAMS = {}
+
+# End-to-end cache: final WAV by audio content hash + everything else that shapes
+# the answer. Limits from MAESTRO_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL (0 entries disables it);
+# bump MAESTRO_CACHE_NAMESPACE after changing settings on the services themselves.
+PIPELINE_CACHE = cache_from_env("maestro", "MAESTRO_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
+PIPELINE_PARAMS = {
+    "namespace": os.getenv("MAESTRO_CACHE_NAMESPACE", ""),
+    "stt_model": os.getenv("WHISPER_MODEL_SIZE", "small"),
+    "llm_model": os.getenv("LLM_MODEL_ID", "Meta-Llama-3-8B-Instruct.Q5_K_S"),
+    "llm_params": LLM_PARAMS,
+    "tts_model": os.getenv("TTS_MODEL_ID", "tts_models/pt/cv/vits"),
+}
 
 @app.on_event("startup")
 async def on_startup():    
     # Concurrency guard to avoid too many in-flight requests
     app.state.sem = asyncio.Semaphore(CONCURRENCY_LIMIT)
     # gRPC channels and stubs
-    app.state.stt_channel = grpc.aio.insecure_channel(STT_GRPC_ADDR, options=[
-        ("grpc.max_send_message_length", 64 * 1024 * 1024),
-        ("grpc.max_receive_message_length", 64 * 1024 * 1024),
-    ])
+    # Audio is uploaded in UPLOAD_CHUNK_SIZE messages, so default limits apply
+    app.state.stt_channel = grpc.aio.insecure_channel(STT_GRPC_ADDR)
     app.state.stt_stub = STTServiceStub(app.state.stt_channel)
-    app.state.llm_channel = grpc.aio.insecure_channel(LLM_GRPC_ADDR, options=[
-        ("grpc.max_send_message_length", 64 * 1024 * 1024),
-        ("grpc.max_receive_message_length", 64 * 1024 * 1024),
-    ])
+    app.state.llm_channel = grpc.aio.insecure_channel(LLM_GRPC_ADDR)
     app.state.llm_stub = LLMServiceStub(app.state.llm_channel)
+    # Unary Synthesize replies still carry a whole WAV
     app.state.tts_channel = grpc.aio.insecure_channel(TTS_GRPC_ADDR, options=[
         ("grpc.max_send_message_length", 64 * 1024 * 1024),
         ("grpc.max_receive_message_length", 64 * 1024 * 1024),
@@ -62,32 +82,109 @@ async def on_shutdown():
 def health():
     return {"status": "healthy"}
 
-@app.post("/assist")
-async def assist(file: UploadFile = File(...)):
-    #log
-    logger.info(f"Received file: {file.filename}")    
+@app.get("/cache/stats")
+def cache_stats():
+    return PIPELINE_CACHE.stats()
+
+async def _read_upload(file: UploadFile) -> Tuple[str, bytes]:
+    # Hash the spooled upload in chunks; the pipeline gets the bytes, not the file,
+    # since FastAPI closes the file when the request ends and a cached computation can outlive it
+    digest = hashlib.md5()
+    chunks = []
+    while True:
+        data = await file.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        digest.update(data)
+        chunks.append(data)
+    return make_key(digest.hexdigest(), PIPELINE_PARAMS), b"".join(chunks)
+
+def _cache_enabled(bypass: Optional[str]) -> bool:
+    return PIPELINE_CACHE.maxsize > 0 and (bypass or "").lower() not in ("1", "true", "yes")
+
+async def _upload_data(file: Optional[UploadFile], content: Optional[bytes]):
+    """The upload in fixed-size chunks: from memory once read for the cache key, else from the spooled file."""
+    if content is not None:
+        for start in range(0, len(content), UPLOAD_CHUNK_SIZE):
+            yield content[start:start + UPLOAD_CHUNK_SIZE]
+        return
+    while True:
+        data = await file.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        yield data
+
+async def _audio_chunks(audio: AsyncIterator[bytes], filename: str, content_type: str):
+    """Wrap the upload chunks in AudioChunk messages; metadata travels in the first one."""
+    filename = filename or "audio.wav"
+    content_type = content_type or "audio/wav"
+    async for data in audio:
+        yield AudioChunk(data=data, filename=filename, content_type=content_type)
+        filename = content_type = ""
+
+async def _transcribe(audio: AsyncIterator[bytes], filename: str, content_type: str) -> str:
+    stub: STTServiceStub = app.state.stt_stub
+    stt_reply = await stub.TranscribeStream(_audio_chunks(audio, filename, content_type))
+    if getattr(stt_reply, "error", ""):
+        raise HTTPException(status_code=502, detail=f"STT error: {stt_reply.error}")
+    logger.info(f"STT result: {stt_reply.text}")
+    return stt_reply.text
+
+async def _llm_deltas(prompt: str):
+    """Yield text deltas from GenerateStream as the LLM decodes them."""
+    llm_stub: LLMServiceStub = app.state.llm_stub
+    async for chunk in llm_stub.GenerateStream(GenRequest(prompt=prompt, **LLM_PARAMS)):
+        if chunk.error:
+            raise RuntimeError(f"LLM error: {chunk.error}")
+        if chunk.done:
+            logger.info(
+                f"LLM stream finished: {chunk.finish_reason} "
+                f"({chunk.prompt_tokens} prompt / {chunk.completion_tokens} completion tokens)"
+            )
+        elif chunk.delta:
+            yield chunk.delta
+
+async def _synthesize(text: str) -> bytes:
+    tts_stub: TTSServiceStub = app.state.tts_stub
+    tts_reply = await tts_stub.Synthesize(SynthRequest(text=text))
+    if getattr(tts_reply, "error", ""):
+        raise RuntimeError(f"TTS error: {tts_reply.error}")
+    return tts_reply.audio
+
+async def _assist_stream(audio: AsyncIterator[bytes], filename: str, content_type: str):
+    stt_text = await _transcribe(audio, filename, content_type)
+    chunks = stream_sentence_audio(_llm_deltas(stt_text), _synthesize, max_parallel=TTS_PARALLEL)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+async def _stream_body(first: bytes, chunks, sem: asyncio.Semaphore):
+    try:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated stream
+        logger.error(f"Streaming error: {e}")
+    finally:
+        await chunks.aclose()
+        sem.release()
+
+async def _assist_once(audio: AsyncIterator[bytes], filename: str, content_type: str) -> bytes:
     sem: asyncio.Semaphore = app.state.sem
     async with sem:
         try:
-            content = await file.read()
             # Log
-            logger.info(f"STT request: {file.filename}")            
-            # 1. STT via gRPC
-            stub: STTServiceStub = app.state.stt_stub
-            stt_reply = await stub.Transcribe(TranscribeRequest(
-                audio=content,
-                filename=file.filename or "audio.wav",
-                content_type=file.content_type or "audio/wav",
-            ))
-            if getattr(stt_reply, "error", ""):
-                raise HTTPException(status_code=502, detail=f"STT error: {stt_reply.error}")
-            stt_text = stt_reply.text
-            logger.info(f"STT result: {stt_text}")
+            logger.info(f"STT request: {filename}")            
+            # 1. STT via gRPC (upload streamed in chunks)
+            stt_text = await _transcribe(audio, filename, content_type)
 
             # 2. LLM via gRPC
             logger.info(f"LLM request: {stt_text}")
             llm_stub: LLMServiceStub = app.state.llm_stub
-            llm_reply = await llm_stub.Generate(GenRequest(prompt=stt_text))
+            llm_reply = await llm_stub.Generate(GenRequest(prompt=stt_text, **LLM_PARAMS))
             if getattr(llm_reply, "error", ""):
                 raise HTTPException(status_code=502, detail=f"LLM error: {llm_reply.error}")
             generated = llm_reply.generated
@@ -98,14 +195,59 @@ async def assist(file: UploadFile = File(...)):
             tts_reply = await tts_stub.Synthesize(SynthRequest(text=generated))
             if getattr(tts_reply, "error", ""):
                 raise HTTPException(status_code=502, detail=f"TTS error: {tts_reply.error}")
-            audio_bytes = tts_reply.audio
+            return tts_reply.audio
         except Exception as e:
             logger.error(f"Request error: {e}")
             raise HTTPException(status_code=502, detail=str(e))
 
+@app.post("/assist")
+async def assist(
+    file: UploadFile = File(...),
+    stream: bool = False,
+    x_cache_bypass: Optional[str] = Header(None),
+):
+    #log
+    logger.info(f"Received file: {file.filename}")    
+    sem: asyncio.Semaphore = app.state.sem
+    filename, content_type = file.filename, file.content_type
+    key, content = await _read_upload(file) if _cache_enabled(x_cache_bypass) else (None, None)
+    if stream and key is not None:
+        cached_audio = PIPELINE_CACHE.get(key)
+        if cached_audio is not None:
+            # The whole answer is already known: send it at once instead of streaming
+            return StreamingResponse(io.BytesIO(cached_audio), media_type="audio/wav", headers={"X-Cache": "HIT"})
+    if stream:
+        # Sentence-level streaming: audio starts after the first sentence is synthesized
+        await sem.acquire()
+        chunks = _assist_stream(_upload_data(file, content), filename, content_type)
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            sem.release()
+            raise HTTPException(status_code=502, detail="Empty response from pipeline")
+        except Exception as e:
+            sem.release()
+            logger.error(f"Request error: {e}")
+            raise HTTPException(status_code=502, detail=str(e))
+        return StreamingResponse(_stream_body(first, chunks, sem), media_type="audio/wav")
+
+    if key is None:
+        audio_bytes = await _assist_once(_upload_data(file, None), filename, content_type)
+        cache_status = "BYPASS"
+    else:
+        computed = False
+
+        async def compute() -> bytes:
+            nonlocal computed
+            computed = True
+            return await _assist_once(_upload_data(None, content), filename, content_type)
+
+        # Hits skip all three services; identical concurrent uploads share one pipeline run
+        audio_bytes = await PIPELINE_CACHE.get_or_compute(key, compute)
+        cache_status = "MISS" if computed else "HIT"
+
     # Stream back WAV audio
-    # return {"text": generated}
-    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav")
+    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav", headers={"X-Cache": cache_status})
 
 if __name__ == "__main__":
     import uvicorn
@@ -39,6 +39,11 @@ class LLMServiceStub(object):
                 request_serializer=llm__pb2.GenRequest.SerializeToString,
                 response_deserializer=llm__pb2.GenReply.FromString,
                 _registered_method=True)
+        self.GenerateStream = channel.unary_stream(
+                '/mpes.llm.LLMService/GenerateStream',
+                request_serializer=llm__pb2.GenRequest.SerializeToString,
+                response_deserializer=llm__pb2.GenChunk.FromString,
+                _registered_method=True)
 
 
 class LLMServiceServicer(object):
@@ -50,6 +55,13 @@ class LLMServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GenerateStream(self, request, context):
+        """Streams the answer as llama.cpp decodes it; the last message has done=true
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_LLMServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +70,11 @@ def add_LLMServiceServicer_to_server(servicer, server):
                     request_deserializer=llm__pb2.GenRequest.FromString,
                     response_serializer=llm__pb2.GenReply.SerializeToString,
             ),
+            'GenerateStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.GenerateStream,
+                    request_deserializer=llm__pb2.GenRequest.FromString,
+                    response_serializer=llm__pb2.GenChunk.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'mpes.llm.LLMService', rpc_method_handlers)
@@ -95,3 +112,30 @@ class LLMService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def GenerateStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/mpes.llm.LLMService/GenerateStream',
+            llm__pb2.GenRequest.SerializeToString,
+            llm__pb2.GenChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
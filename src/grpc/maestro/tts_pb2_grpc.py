@@ -39,6 +39,11 @@ class TTSServiceStub(object):
                 request_serializer=tts__pb2.SynthRequest.SerializeToString,
                 response_deserializer=tts__pb2.SynthReply.FromString,
                 _registered_method=True)
+        self.SynthesizeStream = channel.unary_stream(
+                '/mpes.tts.TTSService/SynthesizeStream',
+                request_serializer=tts__pb2.SynthRequest.SerializeToString,
+                response_deserializer=tts__pb2.SynthChunk.FromString,
+                _registered_method=True)
 
 
 class TTSServiceServicer(object):
@@ -50,6 +55,13 @@ class TTSServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SynthesizeStream(self, request, context):
+        """One message per sentence: a streaming WAV header + PCM first, then PCM only
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_TTSServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +70,11 @@ def add_TTSServiceServicer_to_server(servicer, server):
                     request_deserializer=tts__pb2.SynthRequest.FromString,
                     response_serializer=tts__pb2.SynthReply.SerializeToString,
             ),
+            'SynthesizeStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.SynthesizeStream,
+                    request_deserializer=tts__pb2.SynthRequest.FromString,
+                    response_serializer=tts__pb2.SynthChunk.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'mpes.tts.TTSService', rpc_method_handlers)
@@ -95,3 +112,30 @@ class TTSService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def SynthesizeStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/mpes.tts.TTSService/SynthesizeStream',
+            tts__pb2.SynthRequest.SerializeToString,
+            tts__pb2.SynthChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -5,29 +5,60 @@ import os
 import hashlib
 import json
 from datetime import datetime
-from functools import wraps
+from typing import Optional
 
 import grpc
-import torch
-from llama_cpp import Llama
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from llama_cpp import Llama, LogitsProcessorList
 
 import llm_pb2
 import llm_pb2_grpc
+from cache import cache_from_env, cached, log_stats
+from gen_control import GenerationController, budget_settings, collect, controlled
+from kv_prefix import prime, restore
+from llm_batch import SLOTS, BatchEngine
+from llm_startup import device, load_params, warm_up
+from semantic_cache import semantic_cache_from_env
+from speculative import DRAFT_STATS, draft_from_env
+from workers import pool_from_env
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mpes-llm-grpc")
 
 MODEL_PATH = "./models/Meta-Llama-3-8B-Instruct-Q5_K_S.gguf"
 CTX = 512
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+SYSTEM_PROMPT = """
+            Você é um assistente financeiro. 
+            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
+            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
+            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
+            
+            """.strip()
+# From llama.cpp itself, without importing torch
+DEVICE = device()
 logger.info(f"Device: {DEVICE}")
-try:
+
+def _load_model() -> Llama:
     logger.info(f"Loading LLaMA from {MODEL_PATH}")
-    model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1)
+    # LLM_DRAFT: speculative decoding, verified by this model (plain replicas only, see llm_batch)
+    draft = draft_from_env(CTX) if SLOTS == 1 else None
+    model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1, draft_model=draft, **load_params())
     logger.info("Model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    model = None
+    if SLOTS > 1:
+        # LLM_SLOTS requests decoded together in one context, system prompt shared between them
+        model = BatchEngine(model)
+    else:
+        # The system prompt is evaluated once here, not on every request (LLM_PREFIX_SNAPSHOT)
+        prime(model, SYSTEM_PROMPT)
+    # The replica is ready only after a short generation, which the first request would pay for otherwise
+    warm_up(model, SYSTEM_PROMPT)
+    return model
+
+# Llama replicas, each driven by its own worker so no RPC blocks the event loop:
+# LLM_REPLICAS/LLM_WORKERS_MODE/LLM_QUEUE_SIZE,
+# and LLM_SLOTS jobs at once per replica when it batches them.
+# They load and warm up in the background while the server already listens (see _report_readiness)
+POOL = pool_from_env("llm", "LLM", _load_model, concurrency=SLOTS, background=True)
 
 def _generate_cache_key(req: llm_pb2.GenRequest) -> str:
     key_data = {
@@ -39,89 +70,195 @@ def _generate_cache_key(req: llm_pb2.GenRequest) -> str:
         "repeat_penalty": req.repeat_penalty,
         "presence_penalty": req.presence_penalty,
         "frequency_penalty": req.frequency_penalty,
+        # A budget cuts the answer, so changing one must not serve answers cut by the old one
+        "budgets": budget_settings(),
     }
     return hashlib.md5(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
 
-def async_lru_cache(maxsize: int = 1000):
-    cache = {}
-    queue = []
-
-    def decorator(fn):
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            if key in cache:
-                return cache[key]
-            result = await fn(*args, **kwargs)
-            if len(queue) >= maxsize:
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-            cache[key] = result
-            queue.append(key)
-            return result
-
-        return wrapper
-    return decorator
-
-@async_lru_cache(maxsize=1000)
+# Generations keyed by _generate_cache_key; limits from LLM_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+GENERATIONS = cache_from_env("llm", "LLM_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024)
+# Answers of earlier prompts, matched by embedding after an exact miss: LLM_SEMANTIC_CACHE*
+SEMANTIC = semantic_cache_from_env("LLM_SEMANTIC_CACHE", "./models/multilingual-e5-small-q8_0.gguf")
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
+
+def _build_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+def _sampling_params(req: llm_pb2.GenRequest) -> dict:
+    return dict(
+        max_tokens=req.max_tokens or 256,
+        temperature=req.temperature or 0.7,
+        top_p=req.top_p or 0.9,
+        top_k=req.top_k or 40,
+        repeat_penalty=req.repeat_penalty or 1.1,
+        presence_penalty=req.presence_penalty or 0.0,
+        frequency_penalty=req.frequency_penalty or 0.0,
+    )
+
+def _semantic_scope(req: llm_pb2.GenRequest) -> str:
+    """What a semantic hit must share with the request besides the meaning: the sampling params and budgets."""
+    return json.dumps({**_sampling_params(req), "budgets": budget_settings()}, sort_keys=True)
+
+async def _semantic_lookup(cache_key: str, req: llm_pb2.GenRequest) -> Optional[str]:
+    """The cached answer to a paraphrase of the prompt, unless the exact cache has one."""
+    if req.bypass_semantic_cache or not SEMANTIC.enabled or cache_key in GENERATIONS:
+        return None
+    hit = await asyncio.to_thread(SEMANTIC.lookup, req.prompt, _semantic_scope(req))
+    if hit is None:
+        return None
+    answer, provenance = hit
+    logger.info(f"Semantic cache hit ({provenance['similarity']}) for prompt: {req.prompt[:50]}... "
+                f"<- {provenance['source_prompt'][:50]}")
+    return answer
+
+def _remember(cache_key: str, req: llm_pb2.GenRequest, text: str) -> None:
+    """Index a fresh answer for paraphrases, off the request path (the embedding takes a few ms)."""
+    if SEMANTIC.enabled:
+        asyncio.get_running_loop().run_in_executor(None, SEMANTIC.add, req.prompt, text, _semantic_scope(req), cache_key)
+
+class _TokenCounter:
+    """Logits processor that leaves the scores alone; it only counts prompt and sampled tokens."""
+
+    def __init__(self):
+        self.prompt_tokens = None
+        self.sampled_tokens = 0
+
+    def __call__(self, input_ids, scores):
+        # Called before each sample with the ids evaluated so far (the new token excluded)
+        if self.prompt_tokens is None:
+            self.prompt_tokens = len(input_ids)
+        self.sampled_tokens += 1
+        return scores
+
+# Pool jobs: run on a replica's worker with that replica's model.
+# Decoding stops as soon as the answer fills its budget (LLM_MAX_WORDS, LLM_DEADLINE, ...) or looks empty
+def _complete(model: Llama, messages: list, params: dict) -> tuple:
+    """(answer, finish reason)"""
+    restore(model, messages)
+    return collect(model.create_chat_completion(messages=messages, stream=True, **params), GenerationController())
+
+def _complete_stream(model: Llama, messages: list, params: dict):
+    """Yield the streamed chunks, then {"usage": ...} with the token counts."""
+    restore(model, messages)
+    counter = _TokenCounter()
+    yield from controlled(
+        model.create_chat_completion(
+            messages=messages,
+            logits_processor=LogitsProcessorList([counter]),
+            stream=True,
+            **params,
+        ),
+        GenerationController(),
+    )
+    yield {"usage": {"prompt_tokens": counter.prompt_tokens or 0, "sampled_tokens": counter.sampled_tokens}}
+
+@cached(GENERATIONS, key_fn=lambda cache_key, req: cache_key)
 async def _cached_generate(cache_key: str, req: llm_pb2.GenRequest) -> str:
-    if model is None:
+    if POOL.failed:
         raise RuntimeError("Model not loaded")
 
     max_retries = 3
     text = ""
     for attempt in range(max_retries):
-        messages = [
-            {"role": "system", "content": """
-            Você é um assistente financeiro. 
-            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
-            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
-            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
-            
-            """.strip()},
-            {"role": "user", "content": req.prompt},
-        ]
-        out = model.create_chat_completion(
-            messages=messages,
-            max_tokens=req.max_tokens or 256,
-            temperature=req.temperature or 0.7,
-            top_p=req.top_p or 0.9,
-            top_k=req.top_k or 40,
-            repeat_penalty=req.repeat_penalty or 1.1,
-            presence_penalty=req.presence_penalty or 0.0,
-            frequency_penalty=req.frequency_penalty or 0.0,
-        )
-        text = out["choices"][0]["message"]['content'].strip()
-        logger.info(f"Generated response (attempt {attempt+1}): {text[:100]}...")
+        # With LLM_EMPTY_TOKENS set, an empty answer is given up after that many tokens, so a retry costs little
+        text, finish_reason = await POOL.run(_complete, _build_messages(req.prompt), _sampling_params(req))
+        logger.info(f"Generated response (attempt {attempt+1}, {finish_reason}): {text[:100]}...")
         if text:
             break
-        logger.warning(f"Empty response, retrying {attempt+1}/{max_retries}")
+        logger.warning(f"Empty response ({finish_reason}), retrying {attempt+1}/{max_retries}")
 
     if not text:
         raise RuntimeError("Empty response from model after retries")
+    _remember(cache_key, req, text)
     return text
 
 class LLMService(llm_pb2_grpc.LLMServiceServicer):
     async def Generate(self, request: llm_pb2.GenRequest, context: grpc.aio.ServicerContext) -> llm_pb2.GenReply:
         try:
             cache_key = _generate_cache_key(request)
-            generated = await _cached_generate(cache_key, request)
+            generated = await _semantic_lookup(cache_key, request) or await _cached_generate(cache_key, request)
             return llm_pb2.GenReply(generated=generated, error="")
         except Exception as e:
             logger.exception("Generation error")
             return llm_pb2.GenReply(generated="", error=str(e))
 
+    async def GenerateStream(self, request: llm_pb2.GenRequest, context: grpc.aio.ServicerContext):
+        if POOL.failed:
+            yield llm_pb2.GenChunk(done=True, error="Model not loaded")
+            return
+        cache_key = _generate_cache_key(request)
+        hit = _cached_generate.lookup(cache_key, request) or await _semantic_lookup(cache_key, request)
+        if hit is not None:
+            yield llm_pb2.GenChunk(delta=hit)
+            yield llm_pb2.GenChunk(done=True, finish_reason="stop")
+            return
+
+        usage = {"prompt_tokens": 0, "sampled_tokens": 0}
+        parts = []
+        finish_reason = ""
+        try:
+            # Decoding runs on a replica; chunks arrive here as they are sampled
+            async for chunk in POOL.stream(_complete_stream, _build_messages(request.prompt), _sampling_params(request)):
+                if "usage" in chunk:
+                    usage = chunk["usage"]
+                    continue
+                choice = chunk["choices"][0]
+                delta = choice["delta"].get("content")
+                if delta:
+                    parts.append(delta)
+                    yield llm_pb2.GenChunk(delta=delta)
+                finish_reason = choice.get("finish_reason") or finish_reason
+        except Exception as e:
+            logger.exception("Streaming generation error")
+            yield llm_pb2.GenChunk(done=True, error=str(e))
+            return
+
+        text = "".join(parts).strip()
+        if not text:
+            yield llm_pb2.GenChunk(done=True, error="Empty response from model")
+            return
+        _cached_generate.store(text, cache_key, request)
+        _remember(cache_key, request, text)
+        # The end-of-turn token is sampled but not part of the answer
+        completion_tokens = usage["sampled_tokens"] - (1 if finish_reason == "stop" else 0)
+        logger.info(f"Streamed response ({finish_reason}, {completion_tokens} tokens): {text[:100]}...")
+        yield llm_pb2.GenChunk(
+            done=True,
+            finish_reason=finish_reason or "stop",
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=max(completion_tokens, 0),
+        )
+
+async def _report_readiness(health_servicer: health.aio.HealthServicer) -> None:
+    """grpc.health.v1: NOT_SERVING until a replica has loaded and warmed up, then SERVING."""
+    status = health_pb2.HealthCheckResponse.NOT_SERVING
+    for service in ("", "mpes.llm.LLMService"):
+        await health_servicer.set(service, status)
+    while not POOL.available and not POOL.failed:
+        await asyncio.sleep(0.5)
+    if POOL.available:
+        status = health_pb2.HealthCheckResponse.SERVING
+        logger.info("Model ready, reporting SERVING")
+    for service in ("", "mpes.llm.LLMService"):
+        await health_servicer.set(service, status)
+
 async def serve() -> None:
-    server = grpc.aio.server(options=[
-        ("grpc.max_receive_message_length", 64 * 1024 * 1024),
-        ("grpc.max_send_message_length", 64 * 1024 * 1024),
-    ])
+    POOL.start()
+    log_stats(CACHE_STATS_INTERVAL, GENERATIONS, SEMANTIC, POOL, DRAFT_STATS)
+    server = grpc.aio.server()
     llm_pb2_grpc.add_LLMServiceServicer_to_server(LLMService(), server)
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    readiness = asyncio.create_task(_report_readiness(health_servicer))
     port = os.getenv("LLM_GRPC_PORT", "50052")
     server.add_insecure_port(f"0.0.0.0:{port}")
     logger.info(f"Starting LLM gRPC server on :{port}")
     await server.start()
     await server.wait_for_termination()
+    readiness.cancel()
 
 if __name__ == "__main__":
     asyncio.run(serve())
@@ -0,0 +1,56 @@
+# Synced from src/common/llm_startup.py by syncCommon.sh. DO NOT EDIT.
+"""How the llama.cpp LLM services bring a replica up: weight mapping and warm-up.
+
+The GGUF is mmap'd (``LLM_MMAP``, default on). Loading maps the file instead
+of reading it, and pages come in as the first evaluations touch them.
+Replicas and processes on the same node share them through the page cache.
+``LLM_MLOCK`` pins the weights in RAM so memory pressure never pages them
+out. It needs a memlock limit that fits the model (e.g. ``--ulimit
+memlock=-1``).
+
+The first evaluations of a fresh model are slow: the weights are paged in,
+the GPU kernels load, and the buffers grow to their working size.
+``warm_up`` runs a short generation (``LLM_WARMUP_TOKENS`` tokens, 0 = off,
+of ``LLM_WARMUP_PROMPT``) before the replica reports ready, so no request
+pays for it.
+
+``device()`` asks llama.cpp whether it offloads to a GPU. Importing torch
+for that took seconds at startup for a library the LLM never uses.
+"""
+import logging
+import os
+import time
+
+import llama_cpp
+
+logger = logging.getLogger("llm_startup")
+
+MMAP = os.getenv("LLM_MMAP", "1").lower() in ("1", "true", "yes")
+MLOCK = os.getenv("LLM_MLOCK", "0").lower() in ("1", "true", "yes")
+WARMUP_TOKENS = int(os.getenv("LLM_WARMUP_TOKENS", "16"))
+WARMUP_PROMPT = os.getenv("LLM_WARMUP_PROMPT", "Quanto rende uma poupança de 1000 reais em um ano?")
+
+
+def device() -> str:
+    return "cuda" if llama_cpp.llama_supports_gpu_offload() else "cpu"
+
+
+def load_params() -> dict:
+    """``Llama`` keyword arguments for how the weights are mapped."""
+    return dict(use_mmap=MMAP, use_mlock=MLOCK)
+
+
+def warm_up(model, system_prompt: str) -> None:
+    """One short generation on ``model`` (a ``Llama`` or a ``BatchEngine``), before it takes requests."""
+    if WARMUP_TOKENS <= 0:
+        return
+    started = time.perf_counter()
+    model.create_chat_completion(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": WARMUP_PROMPT},
+        ],
+        max_tokens=WARMUP_TOKENS,
+        temperature=0.0,
+    )
+    logger.info(f"Warm-up generation took {time.perf_counter() - started:.2f}s")
@@ -1,42 +1,129 @@
 import asyncio
 import logging
 import os
-import tempfile
 from concurrent import futures
 
 import grpc
-import whisper
 
 from google.protobuf import empty_pb2
 
 import stt_pb2
 import stt_pb2_grpc
+from audio import decode_audio
+from cache import cache_from_env, cached, log_stats
+from disk_cache import store_from_env
+from fingerprint import fingerprints_from_env
+from stt_engine import load_engine, transcript_key, upload_key
+from whisper_batch import VAD, WhisperBatcher
+from workers import pool_from_env
 
 logger = logging.getLogger("mpes-stt-grpc")
 logging.basicConfig(level=logging.INFO)
 
 MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "small")
-MODEL = whisper.load_model(MODEL_SIZE, download_root="./models/")
+LANGUAGE = "pt"
+
+def _load_model():
+    # STT_ENGINE picks the backend (whisper, whisper-int8, ctranslate2), see stt_engine.py
+    return load_engine(MODEL_SIZE, language=LANGUAGE)
+
+# Whisper replicas off the event loop: STT_REPLICAS/STT_WORKERS_MODE/STT_QUEUE_SIZE
+POOL = pool_from_env("stt", "STT", _load_model)
+# Concurrent RPCs share encoder/decoder passes; STT_MAX_BATCH/STT_BATCH_WAIT_MS
+BATCHER = WhisperBatcher(POOL)
+
+# Default gRPC limit (4 MB) applies: large uploads go through TranscribeStream
+MAX_UNARY_MESSAGE = int(os.getenv("STT_MAX_UNARY_MESSAGE", str(4 * 1024 * 1024)))
+
+# Transcripts keyed by decoded audio + model settings; memory limits from STT_CACHE_MAX_ENTRIES/
+# _MAX_BYTES/_TTL, backed by a disk store that survives restarts (STT_CACHE_DIR/_DIR_MAX_BYTES)
+TRANSCRIPTS = cache_from_env(
+    "stt", "STT_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024,
+    store=store_from_env("stt", "STT_CACHE", "./models/transcripts", max_bytes=256 * 1024 * 1024),
+)
+# Near duplicates (re-encoded, retagged, padded with silence) reuse a transcript after an
+# exact miss: STT_FINGERPRINT=1, STT_FINGERPRINT_THRESHOLD/_MAX_ENTRIES/_MAX_SECONDS
+FINGERPRINTS = fingerprints_from_env("STT_FINGERPRINT")
+# Upload bytes -> transcript key of their PCM, so identical uploads skip decoding:
+# STT_UPLOAD_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+UPLOADS = cache_from_env("stt-uploads", "STT_UPLOAD_CACHE", maxsize=10000, max_bytes=2 * 1024 * 1024)
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
+
+def _decode(audio: bytes, content_type: str = ""):
+    # Decoded in memory: no temp file and, for WAV, no ffmpeg process
+    samples = decode_audio(audio, content_type)
+    return transcript_key(samples, MODEL_SIZE, LANGUAGE, VAD), samples
+
+def _known_upload(audio: bytes, content_type: str = ""):
+    """(upload key, cached transcript if these exact bytes were decoded before, or None)."""
+    upload = upload_key(audio, content_type)
+    key = UPLOADS.get(upload)
+    return upload, TRANSCRIPTS.get(key) if key else None
+
+def _near_duplicate(samples):
+    fp, alias = FINGERPRINTS.lookup(samples)
+    return fp, TRANSCRIPTS.get(alias) if alias else None
+
+@cached(TRANSCRIPTS, key_fn=lambda key, samples: key)
+async def _cached_transcribe(key: str, samples) -> dict:
+    fp, result = await asyncio.to_thread(_near_duplicate, samples)
+    if result is not None:
+        logger.info(f"Reusing the transcript of a near-duplicate upload (key: {key})")
+        return result
+    # STT_VAD=1: silence is skipped and speech segments are transcribed in parallel
+    text, segments = await BATCHER.transcribe_speech_async(samples)
+    if fp is not None:
+        FINGERPRINTS.add(fp, key)
+    return {"text": text, "segments": segments}
+
+async def _transcribe_audio(audio: bytes, content_type: str = "") -> dict:
+    upload, result = await asyncio.to_thread(_known_upload, audio, content_type)
+    if result is not None:
+        return result
+    key, samples = await asyncio.to_thread(_decode, audio, content_type)
+    UPLOADS.set(upload, key)
+    return await _cached_transcribe(key, samples)
+
+def _reply(result: dict) -> stt_pb2.TranscribeReply:
+    segments = [
+        stt_pb2.Segment(start_time=s["start"], end_time=s["end"], text=s["text"])
+        for s in result["segments"]
+    ]
+    return stt_pb2.TranscribeReply(text=result["text"], error="", segments=segments)
 
 class STTService(stt_pb2_grpc.STTServiceServicer):
     async def Transcribe(self, request: stt_pb2.TranscribeRequest, context: grpc.aio.ServicerContext) -> stt_pb2.TranscribeReply:
         try:
-            suffix = os.path.splitext(request.filename)[1] if request.filename else ""
-            with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
-                tmp.write(request.audio)
-                tmp.flush()
-                logger.info(f"Transcribing audio via gRPC, filename={request.filename}")
-                result = MODEL.transcribe(tmp.name, language="pt")
-                text = result.get("text", "")
-                return stt_pb2.TranscribeReply(text=text, error="")
+            logger.info(f"Transcribing audio via gRPC, filename={request.filename}")
+            result = await _transcribe_audio(request.audio, request.content_type)
+            return _reply(result)
+        except Exception as e:
+            logger.exception("Transcription error")
+            return stt_pb2.TranscribeReply(text="", error=str(e))
+
+    async def TranscribeStream(self, request_iterator, context: grpc.aio.ServicerContext) -> stt_pb2.TranscribeReply:
+        filename = content_type = ""
+        audio = bytearray()
+        try:
+            # Chunks are collected in memory and decoded from there, without touching the disk
+            async for chunk in request_iterator:
+                if not audio:
+                    filename, content_type = chunk.filename, chunk.content_type
+                audio += chunk.data
+            if not audio:
+                return stt_pb2.TranscribeReply(text="", error="Empty audio stream")
+            logger.info(f"Transcribing streamed audio via gRPC, filename={filename}, bytes={len(audio)}")
+            result = await _transcribe_audio(bytes(audio), content_type)
+            return _reply(result)
         except Exception as e:
             logger.exception("Transcription error")
             return stt_pb2.TranscribeReply(text="", error=str(e))
 
 async def serve() -> None:
+    POOL.start()
+    log_stats(CACHE_STATS_INTERVAL, TRANSCRIPTS, UPLOADS, FINGERPRINTS, BATCHER, POOL)
     server = grpc.aio.server(options=[
-        ("grpc.max_receive_message_length", 64 * 1024 * 1024),
-        ("grpc.max_send_message_length", 64 * 1024 * 1024),
+        ("grpc.max_receive_message_length", MAX_UNARY_MESSAGE),
     ])
     stt_pb2_grpc.add_STTServiceServicer_to_server(STTService(), server)
     port = os.getenv("STT_GRPC_PORT", "50051")
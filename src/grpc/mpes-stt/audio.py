@@ -0,0 +1,110 @@
+# Synced from src/common/audio.py by syncCommon.sh. DO NOT EDIT.
+"""Decode uploaded audio in memory into what Whisper consumes: 16 kHz mono float32.
+
+WAV (PCM or float) and raw ``audio/L16`` bodies are converted with numpy
+without leaving the process. Everything else (MP3, OGG, FLAC, ...) is piped
+through ffmpeg over stdin/stdout, with no file on disk. Only containers that
+need a seekable input (MP4/M4A/MOV with the index at the end) fall back to a
+temporary file.
+"""
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from wavstream import WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, read_wav
+
+SAMPLE_RATE = 16000
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+
+def decode_audio(data: bytes, content_type: str = "", sr: int = SAMPLE_RATE) -> np.ndarray:
+    """Return ``data`` as a mono float32 waveform in [-1, 1] at ``sr`` Hz."""
+    if not data:
+        raise ValueError("Empty audio")
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            return _decode_wav(data, sr)
+        except ValueError:
+            # Compressed WAV encodings (ADPCM, mu-law, ...) are left to ffmpeg
+            pass
+    l16 = _parse_l16(content_type)
+    if l16 is not None:
+        rate, channels = l16
+        # RFC 2586: L16 is big-endian signed 16-bit
+        samples = np.frombuffer(data[: len(data) - len(data) % (2 * channels)], dtype=">i2")
+        return _mono_resampled(samples.astype(np.float32) / 32768.0, channels, rate, sr)
+    return _decode_ffmpeg(data, sr)
+
+
+def _decode_wav(data: bytes, sr: int) -> np.ndarray:
+    audio_format, fmt, frames = read_wav(data)
+    usable = len(frames) - len(frames) % fmt.block_align
+    raw = frames[:usable]
+    bits = fmt.bits_per_sample
+    if audio_format == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 24:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8
+        samples = ints.astype(np.float32) / 8388608.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 32:
+        samples = (np.frombuffer(raw, dtype="<i4") / 2147483648.0).astype(np.float32)
+    elif audio_format == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        samples = np.frombuffer(raw, dtype="<f4" if bits == 32 else "<f8").astype(np.float32)
+    else:
+        raise ValueError(f"Unsupported WAV encoding {audio_format}/{bits} bits")
+    return _mono_resampled(samples, fmt.channels, fmt.sample_rate, sr)
+
+
+def _mono_resampled(samples: np.ndarray, channels: int, rate: int, sr: int) -> np.ndarray:
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return np.ascontiguousarray(resample(samples, rate, sr), dtype=np.float32)
+
+
+def resample(samples: np.ndarray, rate: int, sr: int) -> np.ndarray:
+    """Band-limited resampling in the frequency domain (O(n log n), anti-aliased)."""
+    if rate == sr or len(samples) == 0:
+        return samples
+    n_out = max(int(round(len(samples) * sr / rate)), 1)
+    spectrum = np.fft.rfft(samples)
+    bins = n_out // 2 + 1
+    if bins <= len(spectrum):
+        # Drop everything above the new Nyquist frequency
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return np.fft.irfft(spectrum, n_out) * (n_out / len(samples))
+
+
+def _parse_l16(content_type: str):
+    """(rate, channels) for ``audio/L16; rate=...; channels=...``, else None."""
+    parts = [p.strip() for p in (content_type or "").split(";")]
+    if parts[0].lower() != "audio/l16":
+        return None
+    params = dict(p.split("=", 1) for p in parts[1:] if "=" in p)
+    return int(params.get("rate", SAMPLE_RATE)), int(params.get("channels", 1))
+
+
+def _decode_ffmpeg(data: bytes, sr: int) -> np.ndarray:
+    cmd = [
+        FFMPEG, "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr),
+        "-",
+    ]
+    proc = subprocess.run(cmd, input=data, capture_output=True)
+    if proc.returncode != 0 and data[4:8] == b"ftyp":
+        # MP4-family containers may need to seek to an index at the end of the file
+        with tempfile.NamedTemporaryFile(suffix=".mp4") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            cmd[cmd.index("pipe:0")] = tmp.name
+            proc = subprocess.run(cmd, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to decode audio: {proc.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(proc.stdout, np.int16).astype(np.float32) / 32768.0
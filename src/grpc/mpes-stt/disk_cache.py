@@ -0,0 +1,223 @@
+# Synced from src/common/disk_cache.py by syncCommon.sh. DO NOT EDIT.
+"""Persistent, content-addressed second tier for ``cache.LRUCache``.
+
+``DiskStore`` keeps one JSON file per key under ``directory``, sharded by the
+first two hex digits of the key (``ab/abcdef....json``). Keys are expected to
+be content hashes (see ``cache.make_key``), so an entry never goes stale: it
+is valid for as long as it exists, across restarts, processes and protocols
+pointing at the same directory.
+
+- Writes are atomic: the value goes to a temp file in the same directory,
+  then ``os.replace`` puts it in place, so readers see the whole file or none.
+- Reads refresh the file's mtime, which makes mtime the recency order.
+- Startup only ``stat``s the files (no reads), in a background thread, to
+  learn the total size; lookups go straight to the file and do not wait for it.
+- Once the total passes ``max_bytes``, the directory is rescanned (other
+  processes may have written to it too) and the least recently used files
+  are removed until the total is back under ``LOW_WATERMARK`` of the limit.
+
+Unreadable or corrupt files count as misses and are removed. Disk errors are
+logged and never fail the request: the in-memory tier keeps working.
+
+    TRANSCRIPTS = cache_from_env("stt", "STT_CACHE", store=store_from_env("stt", "STT_CACHE"))
+
+Settings: ``<PREFIX>_DIR`` (empty disables the store) and ``<PREFIX>_DIR_MAX_BYTES``
+(0 = no limit).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger("disk-cache")
+
+# Evict down to this fraction of max_bytes, so a full store is not rescanned on every write
+LOW_WATERMARK = 0.9
+# Temp files older than this were left behind by a crashed writer
+STALE_TMP_SECONDS = 3600
+
+
+class DiskStore:
+    def __init__(self, name: str, directory: str, max_bytes: int = 0):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.entries = 0
+        self.bytes = 0
+        self.indexed = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._evicting = False
+        self._start_index()
+        # Pre-forked servers: a lock held by the index thread at fork time would never be released
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(f.read())
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"{self.name}: dropping unreadable entry {path}: {e!r}")
+            self._remove(path)
+            with self._lock:
+                self.errors += 1
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted meanwhile (e.g. by another process); the value read is still good
+            pass
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                old = os.stat(path).st_size
+            except FileNotFoundError:
+                old = None
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"{self.name}: could not persist {key}: {e!r}")
+            self._remove(tmp)
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.writes += 1
+            self.bytes += len(data) - (old or 0)
+            self.entries += old is None
+            evict = self.max_bytes and self.bytes > self.max_bytes and not self._evicting
+            if evict:
+                self._evicting = True
+        if evict:
+            threading.Thread(target=self._evict, name=f"{self.name}-disk-evict", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "directory": self.directory,
+                "indexed": self.indexed,
+                "entries": self.entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+
+    def _start_index(self) -> None:
+        threading.Thread(target=self._index, name=f"{self.name}-disk-index", daemon=True).start()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._evicting = False
+        if not self.indexed:
+            self._start_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every entry; stale temp files are removed on the way."""
+        files = []
+        now = time.time()
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".json"):
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                elif entry.name.endswith(".tmp") and now - st.st_mtime > STALE_TMP_SECONDS:
+                    self._remove(entry.path)
+        return files
+
+    def _index(self) -> None:
+        started = time.perf_counter()
+        try:
+            files = self._scan()
+        except OSError as e:
+            logger.warning(f"{self.name}: could not index {self.directory}: {e!r}")
+            return
+        with self._lock:
+            # Writes that landed while scanning are already counted in the scan, or
+            # will be once the next eviction rescans; the index is an estimate either way
+            self.entries = len(files)
+            self.bytes = sum(size for _, size, _ in files)
+            self.indexed = True
+            evict = self.max_bytes and self.bytes > self.max_bytes and not self._evicting
+            if evict:
+                self._evicting = True
+        logger.info(
+            f"{self.name}: indexed {len(files)} entries ({self.bytes} bytes) in "
+            f"{self.directory} in {time.perf_counter() - started:.3f}s"
+        )
+        if evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        try:
+            files = sorted(self._scan())
+            total = sum(size for _, size, _ in files)
+            target = int(self.max_bytes * LOW_WATERMARK)
+            removed = 0
+            for _, size, path in files:
+                if total <= target:
+                    break
+                if self._remove(path):
+                    removed += 1
+                # Gone either way: removed here, or by another process sharing the directory
+                total -= size
+            with self._lock:
+                self.entries = len(files) - removed
+                self.bytes = total
+                self.evictions += removed
+        except OSError as e:
+            logger.warning(f"{self.name}: eviction failed: {e!r}")
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+def store_from_env(name: str, prefix: str, directory: str = "", max_bytes: int = 0) -> Optional[DiskStore]:
+    directory = os.getenv(f"{prefix}_DIR", directory)
+    if not directory:
+        return None
+    return DiskStore(name, directory, max_bytes=int(os.getenv(f"{prefix}_DIR_MAX_BYTES", str(max_bytes))))
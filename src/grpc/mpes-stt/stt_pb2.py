@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\tstt.proto\x12\x08mpes.stt\"J\n\x11TranscribeRequest\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x14\n\x0c\x63ontent_type\x18\x03 \x01(\t\".\n\x0fTranscribeReply\x12\x0c\n\x04text\x18\x01 \x01(\t\x12\r\n\x05\x65rror\x18\x02 \x01(\t2R\n\nSTTService\x12\x44\n\nTranscribe\x12\x1b.mpes.stt.TranscribeRequest\x1a\x19.mpes.stt.TranscribeReplyb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\tstt.proto\x12\x08mpes.stt\"J\n\x11TranscribeRequest\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x14\n\x0c\x63ontent_type\x18\x03 \x01(\t\"S\n\x0fTranscribeReply\x12\x0c\n\x04text\x18\x01 \x01(\t\x12\r\n\x05\x65rror\x18\x02 \x01(\t\x12#\n\x08segments\x18\x03 \x03(\x0b\x32\x11.mpes.stt.Segment\"=\n\x07Segment\x12\x12\n\nstart_time\x18\x01 \x01(\x02\x12\x10\n\x08\x65nd_time\x18\x02 \x01(\x02\x12\x0c\n\x04text\x18\x03 \x01(\t\"B\n\nAudioChunk\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x14\n\x0c\x63ontent_type\x18\x03 \x01(\t2\x99\x01\n\nSTTService\x12\x44\n\nTranscribe\x12\x1b.mpes.stt.TranscribeRequest\x1a\x19.mpes.stt.TranscribeReply\x12\x45\n\x10TranscribeStream\x12\x14.mpes.stt.AudioChunk\x1a\x19.mpes.stt.TranscribeReply(\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -34,7 +34,11 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_TRANSCRIBEREQUEST']._serialized_start=23
   _globals['_TRANSCRIBEREQUEST']._serialized_end=97
   _globals['_TRANSCRIBEREPLY']._serialized_start=99
-  _globals['_TRANSCRIBEREPLY']._serialized_end=145
-  _globals['_STTSERVICE']._serialized_start=147
-  _globals['_STTSERVICE']._serialized_end=229
+  _globals['_TRANSCRIBEREPLY']._serialized_end=182
+  _globals['_SEGMENT']._serialized_start=184
+  _globals['_SEGMENT']._serialized_end=245
+  _globals['_AUDIOCHUNK']._serialized_start=247
+  _globals['_AUDIOCHUNK']._serialized_end=313
+  _globals['_STTSERVICE']._serialized_start=316
+  _globals['_STTSERVICE']._serialized_end=469
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,11 @@ class STTServiceStub(object):
                 request_serializer=stt__pb2.TranscribeRequest.SerializeToString,
                 response_deserializer=stt__pb2.TranscribeReply.FromString,
                 _registered_method=True)
+        self.TranscribeStream = channel.stream_unary(
+                '/mpes.stt.STTService/TranscribeStream',
+                request_serializer=stt__pb2.AudioChunk.SerializeToString,
+                response_deserializer=stt__pb2.TranscribeReply.FromString,
+                _registered_method=True)
 
 
 class STTServiceServicer(object):
@@ -50,6 +55,13 @@ class STTServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def TranscribeStream(self, request_iterator, context):
+        """Upload the audio in fixed-size chunks; filename/content_type go in the first one
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_STTServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +70,11 @@ def add_STTServiceServicer_to_server(servicer, server):
                     request_deserializer=stt__pb2.TranscribeRequest.FromString,
                     response_serializer=stt__pb2.TranscribeReply.SerializeToString,
             ),
+            'TranscribeStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.TranscribeStream,
+                    request_deserializer=stt__pb2.AudioChunk.FromString,
+                    response_serializer=stt__pb2.TranscribeReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'mpes.stt.STTService', rpc_method_handlers)
@@ -95,3 +112,30 @@ class STTService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def TranscribeStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/mpes.stt.STTService/TranscribeStream',
+            stt__pb2.AudioChunk.SerializeToString,
+            stt__pb2.TranscribeReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
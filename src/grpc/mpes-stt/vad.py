@@ -0,0 +1,90 @@
+# Synced from src/common/vad.py by syncCommon.sh. DO NOT EDIT.
+"""Energy-based voice activity detection for 16 kHz mono float32 audio.
+
+``speech_segments`` returns the ``(start, end)`` sample ranges that hold
+speech. Frames are 30 ms long. A frame counts as speech when its level is
+``margin_db`` above the noise floor, estimated as a low percentile of all
+frame levels, but never more than ``margin_db`` below the loudest frame, so
+audio that is speech from start to end is still kept. Frames under
+``ABSOLUTE_FLOOR_DB`` are always silence. Pauses shorter than
+``min_silence`` are bridged, blips shorter than ``min_speech`` are dropped,
+and segments are padded by ``pad`` on both sides. Segments longer than
+``max_segment`` are split at their quietest frame, so each one fits a
+single Whisper window.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+# Anything below this level is silence, however quiet the recording
+ABSOLUTE_FLOOR_DB = -50.0
+
+
+def frame_levels(audio: np.ndarray, frame: int) -> np.ndarray:
+    """RMS level of each ``frame``-sample frame, in dBFS."""
+    n = len(audio) // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[: n * frame].reshape(n, frame).astype(np.float32)
+    return 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """[start, end) index ranges where ``mask`` is True."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def speech_segments(
+    audio: np.ndarray,
+    sr: int = SAMPLE_RATE,
+    margin_db: float = 12.0,
+    noise_percentile: float = 10.0,
+    min_speech: float = 0.25,
+    min_silence: float = 0.5,
+    pad: float = 0.2,
+    max_segment: float = 30.0,
+) -> List[Tuple[int, int]]:
+    frame = int(sr * FRAME_SECONDS)
+    levels = frame_levels(audio, frame)
+    if len(levels) == 0:
+        return []
+    noise = float(np.percentile(levels, noise_percentile))
+    threshold = max(min(noise + margin_db, float(levels.max()) - margin_db), ABSOLUTE_FLOOR_DB)
+    voiced = levels > threshold
+
+    # Bridge short pauses, then drop short blips
+    gap = int(round(min_silence / FRAME_SECONDS))
+    runs = _runs(voiced)
+    merged: List[List[int]] = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    shortest = int(round(min_speech / FRAME_SECONDS))
+    merged = [run for run in merged if run[1] - run[0] >= shortest]
+
+    # Frames -> padded sample ranges, merging the ones padding made overlap
+    padding = int(pad * sr)
+    segments: List[List[int]] = []
+    for start, end in merged:
+        lo, hi = max(0, start * frame - padding), min(len(audio), end * frame + padding)
+        if segments and lo <= segments[-1][1]:
+            segments[-1][1] = max(segments[-1][1], hi)
+        else:
+            segments.append([lo, hi])
+
+    limit = int(max_segment * sr)
+    result: List[Tuple[int, int]] = []
+    for lo, hi in segments:
+        while hi - lo > limit:
+            # Cut at the quietest frame of the second half of the allowed span
+            first, last = (lo + limit // 2) // frame, (lo + limit) // frame
+            cut = (first + int(np.argmin(levels[first:last]))) * frame if last > first else lo + limit
+            result.append((int(lo), int(cut)))
+            lo = cut
+        result.append((int(lo), int(hi)))
+    return result
@@ -1,8 +1,6 @@
 import asyncio
 import logging
 import os
-import tempfile
-from pathlib import Path
 
 import grpc
 from TTS.api import TTS as CoquiTTS
@@ -11,7 +9,12 @@ import tts_pb2
 import tts_pb2_grpc
 import hashlib
 import json
-from functools import wraps
+
+from cache import cache_from_env, cached, log_stats
+from textseg import split_sentences
+from tts_audio import sentence_wavs, set_threads, synthesize_text, synthesize_wav
+from wavstream import WavStreamWriter
+from workers import pool_from_env
 
 logger = logging.getLogger("mpes-tts-grpc")
 logging.basicConfig(level=logging.INFO)
@@ -19,12 +22,17 @@ logging.basicConfig(level=logging.INFO)
 # Load Coqui TTS model (Portuguese)
 MODEL_ID = os.getenv("TTS_MODEL_ID", "tts_models/pt/cv/vits")
 logger.info(f"Loading TTS model: {MODEL_ID}")
-try:
-    tts = CoquiTTS(MODEL_ID)
+
+def _load_model() -> CoquiTTS:
+    set_threads()
+    model = CoquiTTS(MODEL_ID)
     logger.info("TTS model loaded")
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
-    tts = None
+    return model
+
+# Coqui replicas, each used by its own worker so no RPC blocks the event loop:
+# TTS_REPLICAS/TTS_WORKERS_MODE/TTS_QUEUE_SIZE.
+# With TTS_SENTENCE_PARALLEL the sentences of a text are spread over them (see tts_audio)
+POOL = pool_from_env("tts", "TTS", _load_model)
 
 class TTSService(tts_pb2_grpc.TTSServiceServicer):
     async def Synthesize(self, request: tts_pb2.SynthRequest, context: grpc.aio.ServicerContext) -> tts_pb2.SynthReply:
@@ -33,50 +41,51 @@ class TTSService(tts_pb2_grpc.TTSServiceServicer):
             if not text:
                 return tts_pb2.SynthReply(audio=b"", error="Empty text provided")
 
-            if tts is None:
+            if POOL.failed:
                 return tts_pb2.SynthReply(audio=b"", error="TTS model not loaded")
             # Cache-aware synthesis
-            cache_key = _generate_cache_key(text)
-            data = await _cached_synthesize(cache_key, text)
+            data = await synthesize_text(_synthesize, text)
             return tts_pb2.SynthReply(audio=data, error="")
         except Exception as e:
             logger.exception("Synthesis error")
             return tts_pb2.SynthReply(audio=b"", error=str(e))
 
+    async def SynthesizeStream(self, request: tts_pb2.SynthRequest, context: grpc.aio.ServicerContext):
+        text = (request.text or "").strip()
+        if not text:
+            yield tts_pb2.SynthChunk(error="Empty text provided")
+            return
+        if POOL.failed:
+            yield tts_pb2.SynthChunk(error="TTS model not loaded")
+            return
+        try:
+            writer = WavStreamWriter()
+            # Sentences are cached individually, so repeated answers stream from memory
+            async for data in sentence_wavs(_synthesize, split_sentences(text)):
+                yield tts_pb2.SynthChunk(audio=writer.chunk(data))
+        except Exception as e:
+            logger.exception("Streaming synthesis error")
+            yield tts_pb2.SynthChunk(error=str(e))
+
 def _generate_cache_key(text: str) -> str:
     payload = {"text": text, "model": MODEL_ID}
     return hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-def async_lru_cache(maxsize: int = 1000):
-    cache = {}
-    queue = []
-
-    def decorator(fn):
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            if key in cache:
-                return cache[key]
-            result = await fn(*args, **kwargs)
-            if len(queue) >= maxsize:
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-            cache[key] = result
-            queue.append(key)
-            return result
-
-        return wrapper
-    return decorator
-
-@async_lru_cache(maxsize=1000)
+# WAVs keyed by _generate_cache_key (text + model); limits from TTS_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+WAVS = cache_from_env("tts", "TTS_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
+
+@cached(WAVS, key_fn=lambda cache_key, text: cache_key)
 async def _cached_synthesize(cache_key: str, text: str) -> bytes:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        out_path = Path(tmpdir) / "out.wav"
-        tts.tts_to_file(text=text, file_path=out_path)
-        data = out_path.read_bytes()
-    return data
+    # Pool job: synthesized on a replica's worker and encoded to WAV in memory
+    return await POOL.run(synthesize_wav, text)
+
+async def _synthesize(text: str) -> bytes:
+    return await _cached_synthesize(_generate_cache_key(text), text)
 
 async def serve() -> None:
+    POOL.start()
+    log_stats(CACHE_STATS_INTERVAL, WAVS, POOL)
     server = grpc.aio.server(options=[
         ("grpc.max_receive_message_length", 64 * 1024 * 1024),
         ("grpc.max_send_message_length", 64 * 1024 * 1024),
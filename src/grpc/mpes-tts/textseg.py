@@ -0,0 +1,84 @@
+# Synced from src/common/textseg.py by syncCommon.sh. DO NOT EDIT.
+"""Sentence segmentation for incremental (streamed) text."""
+import re
+from typing import List
+
+# Abbreviations that end in a period but do not end a sentence (pt-BR)
+ABBREVIATIONS = {
+    "sr", "sra", "srta", "dr", "dra", "prof", "profa", "av", "etc", "ex",
+    "exa", "art", "nº", "no", "pág", "pag", "tel", "obs", "aprox", "vs",
+}
+
+# Sentence end: terminal punctuation, optional closing quotes/brackets, then whitespace
+_BOUNDARY = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\n+")
+_SOFT_BOUNDARY = re.compile(r"[,;:]\s+")
+
+
+class SentenceSplitter:
+    """Cut a stream of text deltas into sentences as soon as they are complete.
+
+    A boundary is only accepted once the whitespace after the punctuation has
+    arrived, so "R$ 1.500" split across two deltas is never cut at the period.
+    Sentences shorter than ``min_chars`` are merged with the next one and
+    sentences longer than ``max_chars`` are cut at the last soft boundary
+    (comma, semicolon, colon) to keep the first audio chunk small.
+    """
+
+    def __init__(self, min_chars: int = 20, max_chars: int = 250):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """Append ``delta`` and return the sentences it completed."""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        search_from = 0
+        while True:
+            match = _BOUNDARY.search(self._buffer, search_from)
+            if match is None:
+                break
+            search_from = match.end()
+            candidate = self._buffer[start:match.end()].strip()
+            if self._ends_with_abbreviation(candidate) or len(candidate) < self.min_chars:
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        if len(self._buffer) > self.max_chars:
+            sentences.extend(self._cut_long())
+        return sentences
+
+    @property
+    def pending(self) -> str:
+        """Text fed since the last sentence returned (the start of the next one)."""
+        return self._buffer
+
+    def flush(self) -> List[str]:
+        """Return whatever text is left once the stream has ended."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+    def _cut_long(self) -> List[str]:
+        cut = None
+        for match in _SOFT_BOUNDARY.finditer(self._buffer, 0, self.max_chars):
+            cut = match.end()
+        if cut is None or cut < self.min_chars:
+            return []
+        head, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+        return [head]
+
+    @staticmethod
+    def _ends_with_abbreviation(text: str) -> bool:
+        if not text.endswith("."):
+            return False
+        words = text[:-1].rsplit(None, 1)
+        return bool(words) and words[-1].lower() in ABBREVIATIONS
+
+
+def split_sentences(text: str, min_chars: int = 20, max_chars: int = 250) -> List[str]:
+    """Split a complete text into sentences."""
+    splitter = SentenceSplitter(min_chars=min_chars, max_chars=max_chars)
+    return splitter.feed(text) + splitter.flush()
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ttts.proto\x12\x08mpes.tts\"\x1c\n\x0cSynthRequest\x12\x0c\n\x04text\x18\x01 \x01(\t\"*\n\nSynthReply\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\r\n\x05\x65rror\x18\x02 \x01(\t2H\n\nTTSService\x12:\n\nSynthesize\x12\x16.mpes.tts.SynthRequest\x1a\x14.mpes.tts.SynthReplyb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ttts.proto\x12\x08mpes.tts\"\x1c\n\x0cSynthRequest\x12\x0c\n\x04text\x18\x01 \x01(\t\"*\n\nSynthReply\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\r\n\x05\x65rror\x18\x02 \x01(\t\"*\n\nSynthChunk\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\r\n\x05\x65rror\x18\x02 \x01(\t2\x8c\x01\n\nTTSService\x12:\n\nSynthesize\x12\x16.mpes.tts.SynthRequest\x1a\x14.mpes.tts.SynthReply\x12\x42\n\x10SynthesizeStream\x12\x16.mpes.tts.SynthRequest\x1a\x14.mpes.tts.SynthChunk0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,6 +35,8 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_SYNTHREQUEST']._serialized_end=51
   _globals['_SYNTHREPLY']._serialized_start=53
   _globals['_SYNTHREPLY']._serialized_end=95
-  _globals['_TTSSERVICE']._serialized_start=97
-  _globals['_TTSSERVICE']._serialized_end=169
+  _globals['_SYNTHCHUNK']._serialized_start=97
+  _globals['_SYNTHCHUNK']._serialized_end=139
+  _globals['_TTSSERVICE']._serialized_start=142
+  _globals['_TTSSERVICE']._serialized_end=282
 # @@protoc_insertion_point(module_scope)
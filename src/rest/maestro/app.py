@@ -1,10 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
 from fastapi.responses import StreamingResponse
 import httpx
 import io
 import os
+import json
 import logging
 import asyncio
+import hashlib
+from typing import AsyncIterator, Optional, Tuple
+
+from cache import cache_from_env, make_key
+from pipeline import stream_sentence_audio
 
 # Logger setup
 logger = logging.getLogger("mpes-maestro")
@@ -15,13 +21,34 @@ app = FastAPI(title="mpes-maestro")
 
 # Service URLs (configurable via env vars)
 STT_URL = os.getenv("STT_URL", "http://mpes-stt:8000/transcribe")
+STT_STREAM_URL = os.getenv("STT_STREAM_URL", f"{STT_URL}/stream")
 LLM_URL = os.getenv("LLM_URL", "http://mpes-llm:8001/generate")
+LLM_STREAM_URL = os.getenv("LLM_STREAM_URL", f"{LLM_URL}/stream")
 TTS_URL = os.getenv("TTS_URL", "http://mpes-tts:8002/synthesize")
 
 # HTTPX client limits and timeouts (tune via env vars)
 MAX_CONNECTIONS = int(os.getenv("MAESTRO_MAX_CONNECTIONS", "100"))
 MAX_KEEPALIVE = int(os.getenv("MAESTRO_MAX_KEEPALIVE", "20"))
 CONCURRENCY_LIMIT = int(os.getenv("MAESTRO_MAX_CONCURRENCY", "50"))
+# Upload chunk size when forwarding audio to /transcribe/stream
+UPLOAD_CHUNK_SIZE = int(os.getenv("MAESTRO_UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Sentences synthesized in parallel per request in streaming mode
+TTS_PARALLEL = int(os.getenv("MAESTRO_TTS_PARALLEL", "4"))
+
+# Sampling settings sent with every LLM request (empty: the LLM service defaults)
+LLM_PARAMS = {}
+
+# End-to-end cache: final WAV by audio content hash + everything else that shapes
+# the answer. Limits from MAESTRO_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL (0 entries disables it);
+# bump MAESTRO_CACHE_NAMESPACE after changing settings on the services themselves.
+PIPELINE_CACHE = cache_from_env("maestro", "MAESTRO_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
+PIPELINE_PARAMS = {
+    "namespace": os.getenv("MAESTRO_CACHE_NAMESPACE", ""),
+    "stt_model": os.getenv("WHISPER_MODEL_SIZE", "small"),
+    "llm_model": os.getenv("LLM_MODEL_ID", "Meta-Llama-3-8B-Instruct.Q5_K_S"),
+    "llm_params": LLM_PARAMS,
+    "tts_model": os.getenv("TTS_MODEL_ID", "tts_models/pt/cv/vits"),
+}
 
 # Separate timeouts per phase; read can be long for TTS
 HTTP_TIMEOUT = httpx.Timeout(connect=10.0, read=240.0, write=60.0, pool=10.0)
@@ -43,31 +70,115 @@ async def on_shutdown():
 def health():
     return {"status": "healthy"}
 
-@app.post("/assist")
-async def assist(file: UploadFile = File(...)):
+@app.get("/cache/stats")
+def cache_stats():
+    return PIPELINE_CACHE.stats()
+
+async def _read_upload(file: UploadFile) -> Tuple[str, bytes]:
+    # Hash the spooled upload in chunks; the pipeline gets the bytes, not the file,
+    # since FastAPI closes the file when the request ends and a cached computation can outlive it
+    digest = hashlib.md5()
+    chunks = []
+    while True:
+        data = await file.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        digest.update(data)
+        chunks.append(data)
+    return make_key(digest.hexdigest(), PIPELINE_PARAMS), b"".join(chunks)
+
+def _cache_enabled(bypass: Optional[str]) -> bool:
+    return PIPELINE_CACHE.maxsize > 0 and (bypass or "").lower() not in ("1", "true", "yes")
+
+async def _audio_chunks(file: Optional[UploadFile], content: Optional[bytes]):
+    """The upload in fixed-size chunks: from memory once read for the cache key, else from the spooled file."""
+    if content is not None:
+        for start in range(0, len(content), UPLOAD_CHUNK_SIZE):
+            yield content[start:start + UPLOAD_CHUNK_SIZE]
+        return
+    while True:
+        data = await file.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        yield data
+
+async def _transcribe(client: httpx.AsyncClient, audio: AsyncIterator[bytes], filename: str, content_type: str) -> str:
+    # Forward the upload in fixed-size chunks (chunked transfer encoding)
+    stt_resp = await client.post(
+        STT_STREAM_URL,
+        content=audio,
+        params={"filename": filename or "audio.wav"},
+        headers={"Content-Type": content_type or "application/octet-stream"},
+    )
+    stt_resp.raise_for_status()
+    stt_text = stt_resp.json().get("text", "")
+    logger.info(f"STT result: {stt_text}")
+    return stt_text
+
+async def _llm_deltas(client: httpx.AsyncClient, prompt: str):
+    """Yield text deltas from the LLM streaming endpoint as they are decoded."""
+    async with client.stream("POST", LLM_STREAM_URL, json={"prompt": prompt, **LLM_PARAMS}) as resp:
+        if resp.is_error:
+            await resp.aread()
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            msg = json.loads(line)
+            if msg.get("error"):
+                raise RuntimeError(f"LLM error: {msg['error']}")
+            if msg.get("done"):
+                logger.info(f"LLM result: {msg.get('generated', '')}")
+            elif msg.get("delta"):
+                yield msg["delta"]
+
+async def _synthesize(client: httpx.AsyncClient, text: str) -> bytes:
+    tts_resp = await client.post(TTS_URL, json={"text": text})
+    tts_resp.raise_for_status()
+    return tts_resp.content
+
+async def _assist_stream(audio: AsyncIterator[bytes], filename: str, content_type: str):
+    client: httpx.AsyncClient = app.state.http_client
+    stt_text = await _transcribe(client, audio, filename, content_type)
+    chunks = stream_sentence_audio(
+        _llm_deltas(client, stt_text),
+        lambda sentence: _synthesize(client, sentence),
+        max_parallel=TTS_PARALLEL,
+    )
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+async def _stream_body(first: bytes, chunks, sem: asyncio.Semaphore):
+    try:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated stream
+        logger.error(f"Streaming error: {e}")
+    finally:
+        await chunks.aclose()
+        sem.release()
+
+async def _assist_once(audio: AsyncIterator[bytes], filename: str, content_type: str) -> bytes:
     sem: asyncio.Semaphore = app.state.sem
     async with sem:
         try:
-            content = await file.read()
             client: httpx.AsyncClient = app.state.http_client
             # 1. STT
-            files = {"file": (file.filename, content, file.content_type)}
-            params = {"forward": False}
-            stt_resp = await client.post(STT_URL, files=files, params=params)
-            stt_resp.raise_for_status()
-            stt_text = stt_resp.json().get("text", "")
-            logger.info(f"STT result: {stt_text}")
+            stt_text = await _transcribe(client, audio, filename, content_type)
 
             # 2. LLM
-            llm_resp = await client.post(LLM_URL, json={"prompt": stt_text})
+            llm_resp = await client.post(LLM_URL, json={"prompt": stt_text, **LLM_PARAMS})
             llm_resp.raise_for_status()
             generated = llm_resp.json().get("generated", "")
             logger.info(f"LLM result: {generated}")
 
             # 3. TTS
-            tts_resp = await client.post(TTS_URL, json={"text": generated})
-            tts_resp.raise_for_status()
-            audio_bytes = tts_resp.content
+            return await _synthesize(client, generated)
         except httpx.RequestError as e:
             logger.error(f"Request error: {e}")
             raise HTTPException(status_code=502, detail=str(e))
@@ -75,8 +186,56 @@ async def assist(file: UploadFile = File(...)):
             logger.error(f"HTTP error: {e}")
             raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
 
+@app.post("/assist")
+async def assist(
+    file: UploadFile = File(...),
+    stream: bool = False,
+    x_cache_bypass: Optional[str] = Header(None),
+):
+    sem: asyncio.Semaphore = app.state.sem
+    filename, content_type = file.filename, file.content_type
+    key, content = await _read_upload(file) if _cache_enabled(x_cache_bypass) else (None, None)
+    if stream and key is not None:
+        cached_audio = PIPELINE_CACHE.get(key)
+        if cached_audio is not None:
+            # The whole answer is already known: send it at once instead of streaming
+            return StreamingResponse(io.BytesIO(cached_audio), media_type="audio/wav", headers={"X-Cache": "HIT"})
+    if stream:
+        # Sentence-level streaming: audio starts after the first sentence is synthesized
+        await sem.acquire()
+        chunks = _assist_stream(_audio_chunks(file, content), filename, content_type)
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            sem.release()
+            raise HTTPException(status_code=502, detail="Empty response from pipeline")
+        except httpx.HTTPStatusError as e:
+            sem.release()
+            logger.error(f"HTTP error: {e}")
+            raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+        except Exception as e:
+            sem.release()
+            logger.error(f"Request error: {e}")
+            raise HTTPException(status_code=502, detail=str(e))
+        return StreamingResponse(_stream_body(first, chunks, sem), media_type="audio/wav")
+
+    if key is None:
+        audio_bytes = await _assist_once(_audio_chunks(file, None), filename, content_type)
+        cache_status = "BYPASS"
+    else:
+        computed = False
+
+        async def compute() -> bytes:
+            nonlocal computed
+            computed = True
+            return await _assist_once(_audio_chunks(None, content), filename, content_type)
+
+        # Hits skip all three services; identical concurrent uploads share one pipeline run
+        audio_bytes = await PIPELINE_CACHE.get_or_compute(key, compute)
+        cache_status = "MISS" if computed else "HIT"
+
     # Stream back WAV audio
-    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav")
+    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav", headers={"X-Cache": cache_status})
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,55 @@
+# Synced from src/common/pipeline.py by syncCommon.sh. DO NOT EDIT.
+"""Sentence-level LLM -> TTS pipelining for the maestro streaming mode."""
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from textseg import SentenceSplitter
+from wavstream import WavStreamWriter
+
+
+async def stream_sentence_audio(
+    deltas: AsyncIterator[str],
+    synthesize: Callable[[str], Awaitable[bytes]],
+    max_parallel: int = 4,
+) -> AsyncIterator[bytes]:
+    """Synthesize each sentence of ``deltas`` as soon as it is complete.
+
+    Sentences are dispatched to ``synthesize`` (which must return a WAV file)
+    while the LLM is still producing text; up to ``max_parallel`` of them are
+    in flight at once. The audio is yielded in sentence order as a single WAV
+    stream: one streaming header followed by the PCM frames of every sentence.
+    """
+    splitter = SentenceSplitter()
+    sem = asyncio.Semaphore(max_parallel)
+    pending: "asyncio.Queue[Optional[asyncio.Future]]" = asyncio.Queue()
+
+    async def synth(sentence: str) -> bytes:
+        async with sem:
+            return await synthesize(sentence)
+
+    async def produce() -> None:
+        try:
+            async for delta in deltas:
+                for sentence in splitter.feed(delta):
+                    pending.put_nowait(asyncio.ensure_future(synth(sentence)))
+            for sentence in splitter.flush():
+                pending.put_nowait(asyncio.ensure_future(synth(sentence)))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    writer = WavStreamWriter()
+    try:
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            yield writer.chunk(await task)
+        # Surface LLM stream errors raised after the last sentence
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
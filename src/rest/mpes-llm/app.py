@@ -1,14 +1,23 @@
 # File: llama_small_app.py
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
+import asyncio
 import logging
 from llama_cpp import Llama
 from datetime import datetime
-import torch
 import hashlib
-from functools import wraps
 import json
-import asyncio
+
+from cache import cache_from_env, cached
+from gen_control import GenerationController, budget_settings, collect, controlled
+from kv_prefix import prime, restore
+from llm_batch import SLOTS, BatchEngine
+from llm_startup import device, load_params, warm_up
+from semantic_cache import semantic_cache_from_env
+from speculative import DRAFT_STATS, draft_from_env
+from workers import PoolBusy, pool_from_env
 
 # logging
 logging.basicConfig(level=logging.INFO)
@@ -21,15 +30,36 @@ app = FastAPI(title="mpes-llm")
 MODEL_PATH = "./models/Meta-Llama-3-8B-Instruct.Q5_K_S.gguf"
 CTX = 512
 PRE_PROMPT = ""
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+SYSTEM_PROMPT = """
+            Você é um assistente financeiro. 
+            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
+            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
+            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
+            
+            """.strip()
+# From llama.cpp itself, without importing torch
+DEVICE = device()
 
-try:
+def _load_model() -> Llama:
 		logger.info(f"Loading LLaMA small from {MODEL_PATH}")
-		model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1)
+		# LLM_DRAFT: speculative decoding, verified by this model (plain replicas only, see llm_batch)
+		draft = draft_from_env(CTX) if SLOTS == 1 else None
+		model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1, draft_model=draft, **load_params())
 		logger.info("Model loaded successfully")
-except Exception as e:
-		logger.error(f"Failed to load model: {e}")
-		model = None
+		if SLOTS > 1:
+				# LLM_SLOTS requests decoded together in one context, system prompt shared between them
+				model = BatchEngine(model)
+		else:
+				# The system prompt is evaluated once here, not on every request (LLM_PREFIX_SNAPSHOT)
+				prime(model, SYSTEM_PROMPT)
+		# The replica is ready only after a short generation, which the first request would pay for otherwise
+		warm_up(model, SYSTEM_PROMPT)
+		return model
+
+# Llama replicas, each driven by its own worker: LLM_REPLICAS/LLM_WORKERS_MODE/LLM_QUEUE_SIZE,
+# and LLM_SLOTS jobs at once per replica when it batches them.
+# They load and warm up in the background after startup: /health answers meanwhile, /ready once one is up
+pool = pool_from_env("llm", "LLM", _load_model, concurrency=SLOTS, background=True)
 
 class GenRequest(BaseModel):
     prompt: str
@@ -40,17 +70,36 @@ class GenRequest(BaseModel):
     repeat_penalty: float = 1.1
     presence_penalty: float = 0.0
     frequency_penalty: float = 0.0
+    # Skip the semantic cache (answers reused for paraphrases); the exact cache still applies
+    bypass_semantic_cache: bool = False
 
 class GenResponse(BaseModel):
 		prompt: str
 		generated: str
+		# Set when the answer was generated for a paraphrase: its prompt, similarity, age and reuse count
+		semantic: Optional[dict] = None
+		# Why decoding ended: "stop"/"length" from the model, or the budget that cut it (see gen_control)
+		finish_reason: Optional[str] = None
+
+@app.on_event("startup")
+async def on_startup():
+    pool.start()
 
 @app.get("/health")
 async def health():
-		if model is None:
+		if pool.failed:
 				raise HTTPException(500, "Model not loaded")
 		return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+		# Readiness: a replica has loaded and warmed up (liveness is /health)
+		if pool.failed:
+				raise HTTPException(500, "Model not loaded")
+		if not pool.available:
+				raise HTTPException(503, "Model loading")
+		return {"status": "ready", "replicas": pool.available}
+
 def _generate_cache_key(req: GenRequest) -> str:
     """Generate a unique cache key based on the request parameters."""
     key_data = {
@@ -61,79 +110,102 @@ def _generate_cache_key(req: GenRequest) -> str:
         "top_k": req.top_k,
         "repeat_penalty": req.repeat_penalty,
         "presence_penalty": req.presence_penalty,
-        "frequency_penalty": req.frequency_penalty
+        "frequency_penalty": req.frequency_penalty,
+        # A budget cuts the answer, so changing one must not serve answers cut by the old one
+        "budgets": budget_settings(),
     }
     # Convert to JSON string and hash it for a fixed-length key
     return hashlib.md5(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
 
-def async_lru_cache(maxsize: int = 1000):
-    """Simple async LRU cache decorator."""
-    cache = {}
-    queue = []
-    
-    def decorator(fn):
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            
-            if key in cache:
-                logger.info(f"Cache hit for prompt: {args[1].prompt[:50]}...")
-                return cache[key]
-                
-            result = await fn(*args, **kwargs)
-            
-            if len(queue) >= maxsize:
-                # Remove the oldest item
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-                
-            cache[key] = result
-            queue.append(key)
-            return result
-            
-        return wrapper
-    return decorator
+# Generations keyed by _generate_cache_key; limits from LLM_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+GENERATIONS = cache_from_env("llm", "LLM_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024)
+# Answers of earlier prompts, matched by embedding after an exact miss: LLM_SEMANTIC_CACHE*
+SEMANTIC = semantic_cache_from_env("LLM_SEMANTIC_CACHE", "./models/multilingual-e5-small-q8_0.gguf")
+
+@app.get("/cache/stats")
+async def cache_stats():
+		return {**GENERATIONS.stats(), "semantic": SEMANTIC.stats()}
+
+@app.get("/workers/stats")
+async def workers_stats():
+		return pool.stats()
+
+@app.get("/draft/stats")
+async def draft_stats():
+		# Speculative decoding acceptance (LLM_DRAFT); counts this process's replicas only
+		return DRAFT_STATS.stats()
+
+def _build_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
 
-@async_lru_cache(maxsize=1000)  # Cache up to 1000 unique requests
+def _sampling_params(req: GenRequest) -> dict:
+    return dict(
+        max_tokens=req.max_tokens,
+        temperature=req.temperature,
+        top_p=req.top_p,
+        top_k=req.top_k,
+        repeat_penalty=req.repeat_penalty,
+        presence_penalty=req.presence_penalty,
+        frequency_penalty=req.frequency_penalty,
+    )
+
+def _semantic_scope(req: GenRequest) -> str:
+    """What a semantic hit must share with the request besides the meaning: the sampling params and budgets."""
+    return json.dumps({**_sampling_params(req), "budgets": budget_settings()}, sort_keys=True)
+
+async def _semantic_lookup(cache_key: str, req: GenRequest) -> Optional[dict]:
+    """The cached answer to a paraphrase of the prompt, unless the exact cache has one."""
+    if req.bypass_semantic_cache or not SEMANTIC.enabled or cache_key in GENERATIONS:
+        return None
+    hit = await asyncio.to_thread(SEMANTIC.lookup, req.prompt, _semantic_scope(req))
+    if hit is None:
+        return None
+    answer, provenance = hit
+    logger.info(f"Semantic cache hit ({provenance['similarity']}) for prompt: {req.prompt[:50]}... "
+                f"<- {provenance['source_prompt'][:50]}")
+    return {"prompt": req.prompt, "generated": answer, "semantic": provenance}
+
+def _remember(cache_key: str, req: GenRequest, text: str) -> None:
+    """Index a fresh answer for paraphrases, off the request path (the embedding takes a few ms)."""
+    if SEMANTIC.enabled:
+        asyncio.get_running_loop().run_in_executor(None, SEMANTIC.add, req.prompt, text, _semantic_scope(req), cache_key)
+
+# Pool jobs: run on a replica's worker with that replica's model
+# Decoding stops as soon as the answer fills its budget (LLM_MAX_WORDS, LLM_DEADLINE, ...) or looks empty
+def _complete(model: Llama, messages: list, params: dict) -> tuple:
+    """(answer, finish reason)"""
+    restore(model, messages)
+    return collect(model.create_chat_completion(messages=messages, stream=True, **params), GenerationController())
+
+def _complete_stream(model: Llama, messages: list, params: dict):
+    restore(model, messages)
+    yield from controlled(model.create_chat_completion(messages=messages, stream=True, **params), GenerationController())
+
+@cached(GENERATIONS, key_fn=lambda cache_key, req: cache_key)
 async def _cached_generate(cache_key: str, req: GenRequest) -> dict:
     """Generate response with retry logic, called by the cache wrapper."""
-    if model is None:
+    if pool.failed:
         raise HTTPException(500, "Model not loaded")
     
     max_retries = 3
     text = ""
     for attempt in range(max_retries):
         current_date = datetime.now().strftime("%d %B %Y")
-        messages = [
-            {"role": "system", "content": """
-            Você é um assistente financeiro. 
-            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
-            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
-            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
-            
-            """.strip()},
-            {"role": "user", "content": req.prompt},
-        ]
-        out = model.create_chat_completion(
-            messages=messages,
-            max_tokens=req.max_tokens,
-            temperature=req.temperature,
-            top_p=req.top_p,
-            top_k=req.top_k,
-            repeat_penalty=req.repeat_penalty,
-            presence_penalty=req.presence_penalty,
-            frequency_penalty=req.frequency_penalty
-        )
-        text = out["choices"][0]["message"]['content'].strip()
-        logger.info(f"Generated response (attempt {attempt+1}): {text[:100]}...")
+        # With LLM_EMPTY_TOKENS set, an empty answer is given up after that many tokens, so a retry costs little
+        text, finish_reason = await pool.run(_complete, _build_messages(req.prompt), _sampling_params(req))
+        logger.info(f"Generated response (attempt {attempt+1}, {finish_reason}): {text[:100]}...")
         if text:
             break
-        logger.warning(f"Empty response, retrying {attempt+1}/{max_retries}")
+        logger.warning(f"Empty response ({finish_reason}), retrying {attempt+1}/{max_retries}")
     
     if not text:
         raise HTTPException(502, "Empty response from model after retries")
     
-    return {"prompt": req.prompt, "generated": text}
+    _remember(cache_key, req, text)
+    return {"prompt": req.prompt, "generated": text, "finish_reason": finish_reason}
 
 @app.post("/generate", response_model=GenResponse)
 async def generate(req: GenRequest):
@@ -141,11 +213,66 @@ async def generate(req: GenRequest):
     try:
         cache_key = _generate_cache_key(req)
         logger.info(f"Cache key: {cache_key}")
+        hit = await _semantic_lookup(cache_key, req)
+        if hit is not None:
+            return hit
         return await _cached_generate(cache_key, req)
+    except PoolBusy as e:
+        raise HTTPException(503, str(e))
     except Exception as e:
         logger.error(f"Generation error: {e}")
         raise HTTPException(500, str(e))
 
+def _ndjson(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+async def _stream_generate(req: GenRequest):
+    """Yield NDJSON lines: {"delta": ...} per token, then {"done": true, ...} or {"error": ...}."""
+    cache_key = _generate_cache_key(req)
+    hit = _cached_generate.lookup(cache_key, req)
+    if hit is not None:
+        logger.info(f"Cache hit for prompt: {req.prompt[:50]}...")
+        yield _ndjson({"delta": hit["generated"]})
+        yield _ndjson({"done": True, "finish_reason": hit.get("finish_reason") or "stop", "generated": hit["generated"]})
+        return
+    hit = await _semantic_lookup(cache_key, req)
+    if hit is not None:
+        yield _ndjson({"delta": hit["generated"]})
+        yield _ndjson({"done": True, "finish_reason": "stop", "generated": hit["generated"], "semantic": hit["semantic"]})
+        return
+
+    parts = []
+    finish_reason = None
+    try:
+        # Decoding runs on a replica; chunks arrive here as they are sampled
+        async for chunk in pool.stream(_complete_stream, _build_messages(req.prompt), _sampling_params(req)):
+            choice = chunk["choices"][0]
+            delta = choice["delta"].get("content")
+            if delta:
+                parts.append(delta)
+                yield _ndjson({"delta": delta})
+            finish_reason = choice.get("finish_reason") or finish_reason
+    except Exception as e:
+        logger.error(f"Streaming generation error: {e}")
+        yield _ndjson({"error": str(e)})
+        return
+
+    text = "".join(parts).strip()
+    if not text:
+        yield _ndjson({"error": "Empty response from model"})
+        return
+    finish_reason = finish_reason or "stop"
+    _cached_generate.store({"prompt": req.prompt, "generated": text, "finish_reason": finish_reason}, cache_key, req)
+    _remember(cache_key, req, text)
+    yield _ndjson({"done": True, "finish_reason": finish_reason, "generated": text})
+
+@app.post("/generate/stream")
+async def generate_stream(req: GenRequest):
+    """Stream the response as it is decoded (NDJSON)."""
+    if pool.failed:
+        raise HTTPException(500, "Model not loaded")
+    return StreamingResponse(_stream_generate(req), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
 		import uvicorn
 		uvicorn.run(app, host="0.0.0.0", port=8001)
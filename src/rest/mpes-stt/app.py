@@ -1,84 +1,138 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException
 import os
-import tempfile
-import hashlib
-from functools import wraps
-from typing import Callable
 import asyncio
 
-import whisper
 import uvicorn
 import logging
 
+from audio import decode_audio
+from cache import cache_from_env, cached
+from disk_cache import store_from_env
+from fingerprint import fingerprints_from_env
+from stt_engine import load_engine, transcript_key, upload_key
+from whisper_batch import VAD, WhisperBatcher
+from workers import PoolBusy, pool_from_env
+
 logger = logging.getLogger("mpes-stt")
 logger.setLevel(logging.INFO)
 
 app = FastAPI()
 
 model_size = os.getenv("WHISPER_MODEL_SIZE", "small")
-model = whisper.load_model(model_size, download_root="./models/")
+language = "pt"
+
+def _load_model():
+    # STT_ENGINE picks the backend (whisper, whisper-int8, ctranslate2), see stt_engine.py
+    return load_engine(model_size, language=language)
+
+# Whisper replicas off the event loop: STT_REPLICAS/STT_WORKERS_MODE/STT_QUEUE_SIZE
+pool = pool_from_env("stt", "STT", _load_model)
+# Concurrent requests share encoder/decoder passes; STT_MAX_BATCH/STT_BATCH_WAIT_MS
+batcher = WhisperBatcher(pool)
+
+@app.on_event("startup")
+async def on_startup():
+    pool.start()
 
 @app.get("/health")
 def health() -> dict:
     return {"status": "healthy"}
 
-def _generate_audio_hash(content: bytes) -> str:
-    """Generate a hash of the audio content for caching."""
-    return hashlib.md5(content).hexdigest()
-
-# Custom async LRU cache implementation
-def async_lru_cache(maxsize: int = 128):
-    cache = {}
-    queue = []
-    
-    def decorator(fn):
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            
-            if key in cache:
-                logger.info(f"Cache hit for key: {key}")
-                return cache[key]
-                
-            result = await fn(*args, **kwargs)
-            
-            if len(queue) >= maxsize:
-                # Remove the oldest item
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-                
-            cache[key] = result
-            queue.append(key)
-            return result
-            
-        return wrapper
-    return decorator
-
-@async_lru_cache(maxsize=1000)  # Cache up to 1000 unique audio files
-async def _cached_transcribe(audio_hash: str, audio_content: bytes, suffix: str) -> str:
-    """Transcribe audio with caching support."""
-    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
-        tmp.write(audio_content)
-        tmp.flush()
-        logger.info(f"Transcribing audio (hash: {audio_hash})")
-        result = model.transcribe(tmp.name, language="pt")
-        return result.get("text", "")
+# Transcripts keyed by decoded audio + model settings; memory limits from STT_CACHE_MAX_ENTRIES/
+# _MAX_BYTES/_TTL, backed by a disk store that survives restarts (STT_CACHE_DIR/_DIR_MAX_BYTES)
+TRANSCRIPTS = cache_from_env(
+    "stt", "STT_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024,
+    store=store_from_env("stt", "STT_CACHE", "./models/transcripts", max_bytes=256 * 1024 * 1024),
+)
+
+# Near duplicates (re-encoded, retagged, padded with silence) reuse a transcript after an
+# exact miss: STT_FINGERPRINT=1, STT_FINGERPRINT_THRESHOLD/_MAX_ENTRIES/_MAX_SECONDS
+FINGERPRINTS = fingerprints_from_env("STT_FINGERPRINT")
+# Upload bytes -> transcript key of their PCM, so identical uploads skip decoding:
+# STT_UPLOAD_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+UPLOADS = cache_from_env("stt-uploads", "STT_UPLOAD_CACHE", maxsize=10000, max_bytes=2 * 1024 * 1024)
+
+@app.get("/cache/stats")
+def cache_stats() -> dict:
+    return {**TRANSCRIPTS.stats(), "fingerprints": FINGERPRINTS.stats(), "uploads": UPLOADS.stats()}
+
+@app.get("/batch/stats")
+def batch_stats() -> dict:
+    return batcher.stats()
+
+@app.get("/workers/stats")
+def workers_stats() -> dict:
+    return pool.stats()
+
+def _decode(audio: bytes, content_type: str = ""):
+    """(transcript key, samples); decoded in memory, no temp file."""
+    samples = decode_audio(audio, content_type)
+    return transcript_key(samples, model_size, language, VAD), samples
+
+def _known_upload(audio: bytes, content_type: str = ""):
+    """(upload key, cached transcript if these exact bytes were decoded before, or None)."""
+    upload = upload_key(audio, content_type)
+    key = UPLOADS.get(upload)
+    return upload, TRANSCRIPTS.get(key) if key else None
+
+def _near_duplicate(samples):
+    """(fingerprint, cached transcript of a near-duplicate upload or None)."""
+    fp, alias = FINGERPRINTS.lookup(samples)
+    return fp, TRANSCRIPTS.get(alias) if alias else None
+
+# Concurrent uploads of the same audio share one transcription
+@cached(TRANSCRIPTS, key_fn=lambda key, samples: key)
+async def _cached_transcribe(key: str, samples) -> dict:
+    """Transcribe decoded audio with caching support."""
+    fp, result = await asyncio.to_thread(_near_duplicate, samples)
+    if result is not None:
+        logger.info(f"Reusing the transcript of a near-duplicate upload (key: {key})")
+        return result
+    logger.info(f"Transcribing audio (key: {key})")
+    # STT_VAD=1: silence is skipped and speech segments are transcribed in parallel
+    text, segments = await batcher.transcribe_speech_async(samples)
+    if fp is not None:
+        FINGERPRINTS.add(fp, key)
+    return {"text": text, "segments": segments}
+
+async def _transcribe_audio(audio: bytes, content_type: str = "") -> dict:
+    upload, result = await asyncio.to_thread(_known_upload, audio, content_type)
+    if result is not None:
+        return result
+    key, samples = await asyncio.to_thread(_decode, audio, content_type)
+    UPLOADS.set(upload, key)
+    return await _cached_transcribe(key, samples)
 
 @app.post("/transcribe")
 async def transcribe(file: UploadFile = File(...)) -> dict:
     try:
         # Read the file content once
         content = await file.read()
-        suffix = os.path.splitext(file.filename)[1]
-        
-        # Generate cache key and get/cache the transcription
-        audio_hash = _generate_audio_hash(content)
-        logger.info(f"Audio hash: {audio_hash}")
-        
+
         # Get the transcription (from cache or generate)
-        text = await _cached_transcribe(audio_hash, content, suffix)
-        
-        return {"text": text}
+        return await _transcribe_audio(content, file.content_type or "")
+    except PoolBusy as e:
+        raise HTTPException(503, str(e))
+    except Exception as e:
+        logger.error(f"Transcription error: {e}")
+        return {"error": str(e), "text": ""}
+
+@app.post("/transcribe/stream")
+async def transcribe_stream(request: Request, filename: str = "audio.wav") -> dict:
+    """Transcribe a raw audio body sent with chunked transfer encoding.
+
+    Chunks are collected in memory; the audio is decoded from that buffer,
+    without a round trip through the disk.
+    """
+    try:
+        audio = bytearray()
+        async for chunk in request.stream():
+            audio += chunk
+        if not audio:
+            return {"error": "Empty audio stream", "text": ""}
+        return await _transcribe_audio(bytes(audio), request.headers.get("content-type", ""))
+    except PoolBusy as e:
+        raise HTTPException(503, str(e))
     except Exception as e:
         logger.error(f"Transcription error: {e}")
         return {"error": str(e), "text": ""}
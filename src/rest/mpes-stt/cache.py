@@ -0,0 +1,363 @@
+# Synced from src/common/cache.py by syncCommon.sh. DO NOT EDIT.
+"""Result cache shared by the STT, LLM and TTS services.
+
+``LRUCache`` is a true LRU (hits refresh recency, O(1) eviction) bounded by
+entry count and by an approximate byte budget, with an optional TTL. It is
+safe to share between threads and event loops, and concurrent misses on the
+same key are coalesced into a single computation (single-flight): the other
+callers wait for it, and a failure is raised to all of them without being
+cached.
+
+    TRANSCRIPTS = cache_from_env("stt", "STT_CACHE", max_bytes=16 * 1024 * 1024)
+
+    @cached(TRANSCRIPTS, key_fn=lambda audio_hash, audio_path: audio_hash)
+    async def _cached_transcribe(audio_hash, audio_path): ...
+
+Limits come from ``<PREFIX>_MAX_ENTRIES``, ``<PREFIX>_MAX_BYTES`` (0 = no
+byte limit) and ``<PREFIX>_TTL`` (seconds, 0 = no expiry).
+
+An optional ``store`` (e.g. ``disk_cache.DiskStore``) is a second tier behind
+the memory: a memory miss is looked up there before computing, inside the
+single flight, and computed values are written through to it. Stored values
+must be JSON-serializable.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("cache")
+
+_MISSING = object()
+
+
+def approx_size(value: Any) -> int:
+    """Approximate payload size in bytes (what dominates memory for our results)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(approx_size(v) for v in value) + 56
+    return sys.getsizeof(value)
+
+
+def _canonical(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        # Key on the content, not on a (possibly huge) repr
+        return {"__bytes__": hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if hasattr(obj, "SerializeToString"):
+        # protobuf message
+        data = obj.SerializeToString(deterministic=True)
+        return {"__pb__": type(obj).__name__, "sha256": hashlib.sha256(data).hexdigest()}
+    if hasattr(obj, "model_dump"):
+        return _canonical(obj.model_dump())
+    if hasattr(obj, "thrift_spec"):
+        fields = [spec[1] for spec in obj.thrift_spec.values()]
+        return {"__thrift__": type(obj).__name__, **{f: _canonical(getattr(obj, f, None)) for f in fields}}
+    if hasattr(obj, "dict") and callable(obj.dict):
+        # pydantic v1
+        return _canonical(obj.dict())
+    if hasattr(obj, "__dict__"):
+        return {"__type__": type(obj).__name__, **_canonical(vars(obj))}
+    return repr(obj)
+
+
+def make_key(*args: Any, **kwargs: Any) -> str:
+    """Stable key for the given arguments (same values -> same key, across processes)."""
+    payload = json.dumps([_canonical(args), _canonical(kwargs)], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(
+        self,
+        name: str = "cache",
+        maxsize: int = 1000,
+        max_bytes: int = 0,
+        ttl: float = 0.0,
+        size_fn: Callable[[Any], int] = approx_size,
+        store: Any = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_fn = size_fn
+        self.store = store
+        # key -> (value, size, expires_at); insertion order is recency order
+        self._data: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+        self.store_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether ``key`` is in memory and fresh; counters and recency are left alone."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not (entry[2] and entry[2] <= time.monotonic())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = self._load(key)
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._set_locked(key, value)
+        if self.store is not None:
+            self.store.put(key, value)
+
+    def pop(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self.bytes -= entry[1]
+            return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def get_or_call(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Return the cached value or compute it with ``fn`` (blocking, single-flight)."""
+        value, future, leader = self._begin(key)
+        if future is None:
+            return value
+        if not leader:
+            return future.result()
+        result = self._load(key)
+        if result is not _MISSING:
+            self._finish(key, future, result=result, persist=False)
+            return result
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def get_or_compute(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Async version of :meth:`get_or_call` for coroutine functions.
+
+        The computation runs as its own task, so a caller that is cancelled
+        (e.g. a client disconnecting) does not cancel the work others wait on.
+        """
+        value, future, leader = self._begin(key)
+        if future is None:
+            return value
+        if leader:
+            task = asyncio.ensure_future(self._load_or_compute(key, fn, *args, **kwargs))
+            task.add_done_callback(lambda t: self._finish_task(key, future, t))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def _load_or_compute(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Tuple[Any, bool]:
+        """(value, computed): the stored value if there is one, else ``fn``'s result."""
+        if self.store is not None:
+            value = await asyncio.to_thread(self._load, key)
+            if value is not _MISSING:
+                return value, False
+        return await fn(*args, **kwargs), True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "name": self.name,
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_entries": self.maxsize,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejected": self.rejected,
+            }
+        if self.store is not None:
+            stats["store_hits"] = self.store_hits
+            stats["store"] = self.store.stats()
+        return stats
+
+    def _load(self, key: str) -> Any:
+        """Value from the store (promoted to memory), or _MISSING."""
+        if self.store is None:
+            return _MISSING
+        value = self.store.get(key)
+        if value is None:
+            return _MISSING
+        with self._lock:
+            self.store_hits += 1
+            self._set_locked(key, value)
+        return value
+
+    def _get_locked(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, size, expires_at = entry
+        if expires_at and expires_at <= time.monotonic():
+            del self._data[key]
+            self.bytes -= size
+            self.expirations += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _set_locked(self, key: str, value: Any) -> None:
+        size = self.size_fn(value) + len(key)
+        if self.max_bytes and size > self.max_bytes:
+            # Would evict everything else; serve it uncached instead
+            self.rejected += 1
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (value, size, expires_at)
+        self.bytes += size
+        while len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes):
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def _begin(self, key: str) -> Tuple[Any, Optional[concurrent.futures.Future], bool]:
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return _MISSING, future, False
+            self.misses += 1
+            future = self._inflight[key] = concurrent.futures.Future()
+            return _MISSING, future, True
+
+    def _finish(
+        self,
+        key: str,
+        future: concurrent.futures.Future,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+        persist: bool = True,
+    ) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            if error is None:
+                self._set_locked(key, result)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+        # Waiters are released first; the write-through only delays the leader
+        if error is None and persist and self.store is not None:
+            self.store.put(key, result)
+
+    def _finish_task(self, key: str, future: concurrent.futures.Future, task: "asyncio.Future") -> None:
+        if task.cancelled():
+            self._finish(key, future, error=RuntimeError(f"{self.name} computation was cancelled"))
+        elif task.exception() is not None:
+            self._finish(key, future, error=task.exception())
+        else:
+            result, computed = task.result()
+            self._finish(key, future, result=result, persist=computed)
+
+
+def cached(cache: LRUCache, key_fn: Optional[Callable[..., str]] = None):
+    """Memoize a sync or async function in ``cache``.
+
+    ``key_fn`` receives the call arguments and returns the key (default:
+    :func:`make_key`). The wrapper exposes ``lookup(*args)`` and
+    ``store(result, *args)`` so other code paths (e.g. streaming) can share
+    entries with it.
+    """
+    make = key_fn or make_key
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                return await cache.get_or_compute(make(*args, **kwargs), fn, *args, **kwargs)
+        else:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                return cache.get_or_call(make(*args, **kwargs), fn, *args, **kwargs)
+
+        wrapper.cache = cache
+        wrapper.lookup = lambda *args, **kwargs: cache.get(make(*args, **kwargs))
+        wrapper.store = lambda result, *args, **kwargs: cache.set(make(*args, **kwargs), result)
+        return wrapper
+
+    return decorator
+
+
+def cache_from_env(name: str, prefix: str, maxsize: int = 1000, max_bytes: int = 0, ttl: float = 0.0, store: Any = None) -> LRUCache:
+    return LRUCache(
+        name,
+        maxsize=int(os.getenv(f"{prefix}_MAX_ENTRIES", str(maxsize))),
+        max_bytes=int(os.getenv(f"{prefix}_MAX_BYTES", str(max_bytes))),
+        ttl=float(os.getenv(f"{prefix}_TTL", str(ttl))),
+        store=store,
+    )
+
+
+def log_stats(interval: float, *caches: Any) -> None:
+    """Log the counters of ``caches`` every ``interval`` seconds (0 disables).
+
+    Anything with a ``stats()`` method can be passed along (e.g. the STT batcher).
+    """
+    if interval <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            for c in caches:
+                logger.info(f"{type(c).__name__} stats: {c.stats()}")
+
+    def start():
+        threading.Thread(target=loop, name="cache-stats", daemon=True).start()
+
+    start()
+    # Pre-forked servers: threads do not survive fork, and each child has its own cache copy
+    os.register_at_fork(after_in_child=start)
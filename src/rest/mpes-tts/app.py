@@ -1,30 +1,78 @@
 from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from pathlib import Path
-import tempfile
 from TTS.api import TTS
 
+from cache import cache_from_env, cached, make_key
+from textseg import split_sentences
+from tts_audio import sentence_wavs, set_threads, synthesize_text, synthesize_wav
+from wavstream import WavStreamWriter
+from workers import PoolBusy, pool_from_env
+
 app = FastAPI()
 
 # carrega modelo pré-treinado (troque para outro se quiser mais rápido ou pt-BR específico)
 # veja lista: https://tts.readthedocs.io/en/latest/models.html
-tts = TTS("tts_models/pt/cv/vits")
+MODEL_ID = "tts_models/pt/cv/vits"
+
+def _load_model() -> TTS:
+    set_threads()
+    return TTS(MODEL_ID)
+
+# Coqui replicas, each used by its own worker: TTS_REPLICAS/TTS_WORKERS_MODE/TTS_QUEUE_SIZE.
+# With TTS_SENTENCE_PARALLEL the sentences of a text are spread over them (see tts_audio)
+pool = pool_from_env("tts", "TTS", _load_model)
+
+@app.on_event("startup")
+async def on_startup():
+    pool.start()
+
+# WAVs keyed by text + model; limits from TTS_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+WAVS = cache_from_env("tts", "TTS_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
 
 class SynthesisRequest(BaseModel):
     text: str
 
+@app.get("/cache/stats")
+def cache_stats() -> dict:
+    return WAVS.stats()
+
+@app.get("/workers/stats")
+def workers_stats() -> dict:
+    return pool.stats()
+
+# Streamed sentences are cached individually, so repeated answers stream from memory
+@cached(WAVS, key_fn=lambda text: make_key(MODEL_ID, text))
+async def _synthesize_wav(text: str) -> bytes:
+    # Pool job: synthesized on a replica's worker and encoded to WAV in memory
+    return await pool.run(synthesize_wav, text)
+
 @app.post("/synthesize")
 async def synthesize(req: SynthesisRequest) -> Response:
     if not req.text.strip():
         return Response(content="Empty text provided", status_code=400)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        out_path = Path(tmpdir) / "out.wav"
-        tts.tts_to_file(text=req.text, file_path=out_path)
-        data = out_path.read_bytes()
+    try:
+        data = await synthesize_text(_synthesize_wav, req.text)
+    except PoolBusy as e:
+        return Response(content=str(e), status_code=503)
 
     return Response(content=data, media_type="audio/wav")
 
+async def _stream_sentences(text: str):
+    """Yield one streamed WAV, one chunk per synthesized sentence."""
+    writer = WavStreamWriter()
+    async for wav in sentence_wavs(_synthesize_wav, split_sentences(text)):
+        yield writer.chunk(wav)
+
+@app.post("/synthesize/stream")
+async def synthesize_stream(req: SynthesisRequest) -> Response:
+    if not req.text.strip():
+        return Response(content="Empty text provided", status_code=400)
+
+    # Sent with chunked transfer encoding; synthesis runs on the pool, not on the event loop
+    return StreamingResponse(_stream_sentences(req.text), media_type="audio/wav")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8002)
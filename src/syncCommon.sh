@@ -0,0 +1,50 @@
+#!/usr/bin/env bash
+set -e
+
+# Run from src/: ./syncCommon.sh
+# Copies the shared modules in common/ into every service that imports them.
+# Each service directory is its own build context, so the copies are vendored
+# next to app.py (like the generated gRPC stubs). Edit common/, never the copies.
+
+cd "$(dirname "$0")"
+
+sync() {
+  module="$1"
+  shift
+  for dir in "$@"; do
+    echo "[SYNC] common/${module} -> ${dir}"
+    {
+      echo "# Synced from src/common/${module} by syncCommon.sh. DO NOT EDIT."
+      cat "common/${module}"
+    } > "${dir}/${module}"
+  done
+}
+
+MAESTROS="rest/maestro grpc/maestro thrift/maestro"
+TTS="rest/mpes-tts grpc/mpes-tts thrift/mpes-tts"
+STT="rest/mpes-stt grpc/mpes-stt thrift/mpes-stt"
+LLM="rest/mpes-llm grpc/mpes-llm thrift/mpes-llm"
+
+sync textseg.py ${MAESTROS} ${LLM} ${TTS}
+sync tts_audio.py ${TTS}
+sync wavstream.py ${MAESTROS} ${TTS} ${STT}
+sync audio.py ${STT}
+sync vad.py ${STT}
+sync fingerprint.py ${STT}
+sync stt_engine.py ${STT}
+sync whisper_batch.py ${STT}
+sync workers.py ${STT} ${LLM} ${TTS}
+sync kv_prefix.py ${LLM}
+sync llm_batch.py ${LLM}
+sync llm_startup.py ${LLM}
+sync semantic_cache.py ${LLM}
+sync speculative.py ${LLM}
+sync gen_control.py ${LLM}
+sync pipeline.py ${MAESTROS}
+sync cache.py ${MAESTROS} ${STT} ${LLM} ${TTS}
+sync disk_cache.py ${STT}
+sync thrift_pool.py thrift/maestro
+sync thrift_wire.py thrift/maestro thrift/mpes-stt thrift/mpes-llm thrift/mpes-tts
+sync thrift_server.py thrift/mpes-stt thrift/mpes-llm thrift/mpes-tts
+
+echo "[DONE] Synced shared modules"
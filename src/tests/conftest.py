@@ -0,0 +1,17 @@
+"""Helpers to import the services, each a self-contained directory with its own app.py."""
+import importlib.util
+import os
+import sys
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(service: str, name: str):
+    """Import ``src/<service>/app.py`` as module ``name``, with its vendored modules importable."""
+    directory = os.path.join(SRC, service)
+    sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,103 @@
+import os
+import shutil
+import struct
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from audio import SAMPLE_RATE, decode_audio, resample  # noqa: E402
+from wavstream import WAVE_FORMAT_IEEE_FLOAT, WavFormat, wav_header  # noqa: E402
+
+
+def sine(freq: float, rate: int, seconds: float = 0.5, amplitude: float = 0.5) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def wav(frames: bytes, channels: int, rate: int, bits: int, tag: int = 1) -> bytes:
+    header = bytearray(wav_header(WavFormat(channels, rate, bits), len(frames)))
+    struct.pack_into("<H", header, 20, tag)
+    return bytes(header) + frames
+
+
+def peak_hz(samples: np.ndarray, rate: int) -> float:
+    spectrum = np.abs(np.fft.rfft(samples))
+    return np.argmax(spectrum) * rate / len(samples)
+
+
+def test_pcm16_mono_at_16k_is_only_scaled():
+    ints = np.array([0, 16384, -16384, 32767, -32768], dtype="<i2")
+    out = decode_audio(wav(ints.tobytes(), 1, SAMPLE_RATE, 16))
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, ints / 32768.0)
+
+
+def test_stereo_is_mixed_down_to_mono():
+    left = np.full(100, 0.5, dtype=np.float32)
+    right = np.full(100, -0.25, dtype=np.float32)
+    frames = np.stack([left, right], axis=1).astype("<f4").tobytes()
+    out = decode_audio(wav(frames, 2, SAMPLE_RATE, 32, WAVE_FORMAT_IEEE_FLOAT))
+    np.testing.assert_allclose(out, np.full(100, 0.125), atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "bits, encode",
+    [
+        (8, lambda x: np.round(x * 128 + 128).astype(np.uint8).tobytes()),
+        (24, lambda x: b"".join(int(v).to_bytes(3, "little", signed=True) for v in np.round(x * 8388607))),
+        (32, lambda x: np.round(x * 2147483647).astype("<i4").tobytes()),
+    ],
+)
+def test_other_pcm_widths(bits, encode):
+    x = sine(440, SAMPLE_RATE, 0.05)
+    out = decode_audio(wav(encode(x), 1, SAMPLE_RATE, bits))
+    np.testing.assert_allclose(out, x, atol=1.5 / 2 ** (bits - 1))
+
+
+def test_wav_at_44k_is_resampled_to_16k():
+    x = sine(1000, 44100)
+    out = decode_audio(wav((x * 32767).astype("<i2").tobytes(), 1, 44100, 16))
+    assert len(out) == SAMPLE_RATE // 2
+    assert abs(peak_hz(out, SAMPLE_RATE) - 1000) <= 2
+    assert 0.45 < np.abs(out).max() < 0.55
+
+
+def test_resampling_drops_content_above_the_new_nyquist():
+    x = sine(1000, 48000) + sine(12000, 48000)
+    out = resample(x, 48000, SAMPLE_RATE)
+    spectrum = np.abs(np.fft.rfft(out))
+    assert spectrum[int(1000 * len(out) / SAMPLE_RATE)] > 100 * spectrum[int(4000 * len(out) / SAMPLE_RATE)]
+
+
+def test_l16_body_is_big_endian_with_rate_and_channels_from_the_content_type():
+    x = sine(500, 8000)
+    stereo = np.repeat((x * 32767).astype(">i2"), 2)
+    out = decode_audio(stereo.tobytes(), "audio/L16; rate=8000; channels=2")
+    assert len(out) == SAMPLE_RATE // 2
+    assert abs(peak_hz(out, SAMPLE_RATE) - 500) <= 2
+
+
+def test_empty_upload_is_rejected():
+    with pytest.raises(ValueError):
+        decode_audio(b"")
+
+
+def test_compressed_uploads_are_left_to_ffmpeg(monkeypatch):
+    import audio
+
+    calls = []
+    monkeypatch.setattr(audio, "_decode_ffmpeg", lambda data, sr: calls.append((data[:3], sr)) or np.zeros(1))
+    decode_audio(b"ID3-mp3-bytes", "audio/mpeg")
+    # 8-bit mu-law WAV: not decoded with numpy either
+    decode_audio(wav(b"\xff" * 100, 1, SAMPLE_RATE, 8, tag=7), "audio/wav")
+    assert calls == [(b"ID3", SAMPLE_RATE), (b"RIF", SAMPLE_RATE)]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+def test_ffmpeg_decodes_from_memory():
+    frames = np.random.default_rng(0).integers(0, 256, 1600, dtype=np.uint8).tobytes()
+    out = decode_audio(wav(frames, 1, SAMPLE_RATE, 8, tag=7))
+    assert out.dtype == np.float32
+    assert len(out) == 1600
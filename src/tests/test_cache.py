@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from cache import LRUCache, cache_from_env, cached, make_key  # noqa: E402
+
+
+def test_concurrent_sync_misses_share_one_call():
+    cache = LRUCache("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_call("k", compute, 21))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    while cache.stats()["coalesced"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == [42] * 4
+    assert calls == [21]
+    assert cache.stats()["misses"] == 1
+    assert cache.get_or_call("k", compute, 0) == 42
+
+
+def test_concurrent_async_misses_share_one_computation():
+    cache = LRUCache("test")
+    calls = []
+
+    @cached(cache, key_fn=lambda x: f"k{x}")
+    async def compute(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    async def scenario():
+        return await asyncio.gather(*(compute(21) for _ in range(5)), compute(1))
+
+    assert asyncio.run(scenario()) == [42] * 5 + [2]
+    assert calls == [21, 1]
+    assert cache.stats()["coalesced"] == 4
+    assert compute.lookup(21) == 42
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached():
+    cache = LRUCache("test")
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("model not loaded")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("k", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert [type(e) for e in errors] == [ValueError] * 3
+    assert calls == [1]
+    assert "k" not in cache
+
+    async def ok():
+        return "ok"
+
+    assert asyncio.run(cache.get_or_compute("k", ok)) == "ok"
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_computation():
+    cache = LRUCache("test")
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def compute():
+            await gate.wait()
+            return "answer"
+
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        gate.set()
+        return await follower
+
+    assert asyncio.run(scenario()) == "answer"
+    assert cache.get("k") == "answer"
+
+
+def test_hits_refresh_recency_and_the_oldest_entry_is_evicted():
+    cache = LRUCache("test", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_until_the_entries_fit():
+    cache = LRUCache("test", maxsize=100, max_bytes=250)
+    for key in "abc":
+        cache.set(key, b"x" * 99)
+    # 3 x (99 + 1 byte of key) > 250: the oldest goes
+    assert "a" not in cache
+    assert len(cache) == 2
+    assert cache.bytes == 200
+
+
+def test_entry_larger_than_the_byte_budget_is_served_uncached():
+    cache = LRUCache("test", maxsize=100, max_bytes=100)
+    cache.set("small", b"x" * 10)
+    assert cache.get_or_call("big", lambda: b"x" * 1000) == b"x" * 1000
+    assert "big" not in cache
+    assert "small" in cache
+    assert cache.stats()["rejected"] == 1
+
+
+def test_expired_entries_are_recomputed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = LRUCache("test", ttl=10)
+    cache.set("k", "old")
+    now[0] += 9
+    assert cache.get("k") == "old"
+    now[0] += 2
+    assert "k" not in cache
+    assert cache.get_or_call("k", lambda: "new") == "new"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cache_from_env_reads_the_limits(monkeypatch):
+    monkeypatch.setenv("TEST_CACHE_MAX_ENTRIES", "0")
+    monkeypatch.setenv("TEST_CACHE_TTL", "30")
+    cache = cache_from_env("test", "TEST_CACHE", maxsize=1000, max_bytes=1024)
+    assert (cache.maxsize, cache.max_bytes, cache.ttl) == (0, 1024, 30.0)
+
+
+def test_make_key_hashes_bytes_by_content():
+    assert make_key(b"audio", lang="pt") == make_key(bytearray(b"audio"), lang="pt")
+    assert make_key(b"audio", lang="pt") != make_key(b"audio", lang="en")
+    assert make_key(b"audio") != make_key(b"other")
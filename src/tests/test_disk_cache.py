@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from cache import LRUCache, make_key  # noqa: E402
+from disk_cache import DiskStore, store_from_env  # noqa: E402
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_entries_survive_a_restart(tmp_path):
+    key = make_key("audio-hash", "small")
+    DiskStore("stt", str(tmp_path)).put(key, {"text": "quanto rende a poupança?"})
+    assert (tmp_path / key[:2] / f"{key}.json").exists()
+
+    store = DiskStore("stt", str(tmp_path))
+    wait_for(lambda: store.stats()["indexed"])
+    assert store.get(key) == {"text": "quanto rende a poupança?"}
+    assert store.get(make_key("other")) is None
+    assert store.stats()["entries"] == 1
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_corrupt_entry_is_a_miss_and_is_removed(tmp_path):
+    store = DiskStore("stt", str(tmp_path))
+    key = make_key("audio-hash")
+    store.put(key, "ok")
+    path = tmp_path / key[:2] / f"{key}.json"
+    path.write_bytes(b'{"truncated')
+    assert store.get(key) is None
+    assert not path.exists()
+    assert store.stats()["errors"] == 1
+
+
+def test_unserializable_value_is_not_persisted(tmp_path):
+    store = DiskStore("stt", str(tmp_path))
+    store.put(make_key("k"), object())
+    assert store.stats()["errors"] == 1
+    assert store.stats()["writes"] == 0
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    store = DiskStore("stt", str(tmp_path), max_bytes=350)
+    wait_for(lambda: store.stats()["indexed"])
+    keys = [make_key(i) for i in range(3)]
+    for age, key in zip((30, 20), keys):
+        store.put(key, "x" * 100)
+        path = str(tmp_path / key[:2] / f"{key}.json")
+        os.utime(path, (time.time() - age, time.time() - age))
+    # Reading refreshes recency: the first key is now the newest
+    assert store.get(keys[0]) is not None
+    store.put(keys[2], "x" * 200)
+    wait_for(lambda: store.stats()["evictions"] == 1)
+    assert store.get(keys[1]) is None
+    assert store.get(keys[0]) is not None and store.get(keys[2]) is not None
+
+
+def test_lru_cache_reads_through_and_writes_through_the_store(tmp_path):
+    key = make_key("audio-hash")
+    first = LRUCache("stt", store=DiskStore("stt", str(tmp_path)))
+    assert first.get_or_call(key, lambda: {"text": "oi"}) == {"text": "oi"}
+
+    # A restarted service finds the transcript on disk and does not compute it again
+    second = LRUCache("stt", store=DiskStore("stt", str(tmp_path)))
+    assert second.get_or_call(key, lambda: pytest.fail("computed again")) == {"text": "oi"}
+    assert key in second
+    assert second.stats()["store_hits"] == 1
+
+
+def test_store_is_off_without_a_directory(monkeypatch, tmp_path):
+    monkeypatch.delenv("STT_CACHE_DIR", raising=False)
+    assert store_from_env("stt", "STT_CACHE") is None
+    monkeypatch.setenv("STT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("STT_CACHE_DIR_MAX_BYTES", "1024")
+    store = store_from_env("stt", "STT_CACHE")
+    assert (store.directory, store.max_bytes) == (str(tmp_path), 1024)
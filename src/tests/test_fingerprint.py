@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from fingerprint import FingerprintIndex, bit_error_rate, fingerprint, fingerprints_from_env  # noqa: E402
+from vad import SAMPLE_RATE  # noqa: E402
+
+SR = SAMPLE_RATE
+
+
+def utterance(seed: int, seconds: float = 2.0) -> np.ndarray:
+    """Speech-like audio: 200 ms syllables of a harmonic voice with random pitch and formants."""
+    rng = np.random.default_rng(seed)
+    out = np.zeros(int(seconds * SR), dtype=np.float32)
+    syllable = int(0.2 * SR)
+    for start in range(0, len(out), syllable):
+        t = np.arange(min(syllable, len(out) - start)) / SR
+        f0 = rng.uniform(100, 220)
+        formants = rng.uniform([300, 900, 2000], [800, 2000, 3200])
+        voice = np.zeros_like(t)
+        for harmonic in np.arange(f0, 3400, f0):
+            amplitude = np.exp(-(((harmonic - formants) / 150) ** 2)).sum() + 0.02
+            voice += amplitude * np.sin(2 * np.pi * harmonic * t + rng.uniform(0, 2 * np.pi))
+        out[start:start + len(t)] = voice * np.sin(np.pi * np.arange(len(t)) / len(t))
+    return (0.3 * out / np.abs(out).max()).astype(np.float32)
+
+
+def reencoded(audio: np.ndarray) -> np.ndarray:
+    """The same utterance at half the gain, 50 ms later, with a noise floor and 16-bit quantization."""
+    x = np.concatenate([np.zeros(800, dtype=np.float32), 0.5 * audio])
+    x += np.random.default_rng(9).standard_normal(len(x)).astype(np.float32) * 1e-4
+    return (np.round(x * 32767) / 32767).astype(np.float32)
+
+
+@pytest.fixture
+def index():
+    index = FingerprintIndex(enabled=True)
+    index.add(fingerprint(utterance(1)), "key-1")
+    return index
+
+
+def test_near_duplicate_matches(index):
+    fp, key = index.lookup(reencoded(utterance(1)))
+    assert fp is not None
+    assert key == "key-1"
+    assert index.stats()["matches"] == 1
+
+
+def test_different_utterance_does_not_match(index):
+    assert index.lookup(utterance(2))[1] is None
+    assert bit_error_rate(fingerprint(utterance(2)), fingerprint(utterance(1)), 12) > index.threshold
+
+
+def test_longer_audio_with_the_same_start_is_rejected_by_length(index):
+    longer = np.concatenate([utterance(1), utterance(3, 1.0)])
+    # The bits agree over the whole shared part; only the length ratio tells them apart
+    assert bit_error_rate(fingerprint(longer), fingerprint(utterance(1)), 12) <= index.threshold
+    assert index.lookup(longer)[1] is None
+
+
+def test_silence_short_and_long_audio_are_not_fingerprinted():
+    index = FingerprintIndex(enabled=True, max_seconds=3)
+    assert fingerprint(np.zeros(2 * SR, dtype=np.float32)) is None
+    assert fingerprint(utterance(1, 0.1)) is None
+    assert index.fingerprint(utterance(1, 4.0)) is None
+
+
+def test_disabled_index_does_nothing():
+    assert FingerprintIndex(enabled=False).lookup(utterance(1)) == (None, None)
+
+
+def test_oldest_fingerprint_is_evicted_with_its_words():
+    index = FingerprintIndex(enabled=True, maxsize=1)
+    index.add(fingerprint(utterance(1)), "key-1")
+    index.add(fingerprint(utterance(2)), "key-2")
+    assert index.stats()["entries"] == 1
+    assert index.lookup(utterance(1))[1] is None
+    assert index.lookup(utterance(2))[1] == "key-2"
+    assert all(keys == {"key-2"} for keys in index._index.values())
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("STT_FINGERPRINT", "1")
+    monkeypatch.setenv("STT_FINGERPRINT_THRESHOLD", "0.1")
+    index = fingerprints_from_env("STT_FINGERPRINT")
+    assert index.enabled and index.threshold == 0.1
+    assert not fingerprints_from_env("OTHER_FINGERPRINT").enabled
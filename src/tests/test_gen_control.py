@@ -0,0 +1,119 @@
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import gen_control  # noqa: E402
+from gen_control import GenerationController, collect, controlled  # noqa: E402
+
+OFF = dict(max_words=0, max_sentences=0, max_paragraphs=0, deadline=0, empty_tokens=0)
+
+
+def controller(**budgets):
+    return GenerationController(**{**OFF, **budgets})
+
+
+def chunks(deltas, finish_reason="stop", closed=None):
+    try:
+        for delta in deltas:
+            yield {"choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def test_budgets_are_off_by_default(monkeypatch):
+    for name in ("LLM_MAX_WORDS", "LLM_MAX_SENTENCES", "LLM_MAX_PARAGRAPHS", "LLM_DEADLINE", "LLM_EMPTY_TOKENS"):
+        monkeypatch.delenv(name, raising=False)
+    module = importlib.reload(gen_control)
+    try:
+        assert set(module.budget_settings().values()) == {0}
+        text = "Uma frase. " * 100 + "\n\nOutro parágrafo."
+        assert module.collect(chunks([text]), module.GenerationController()) == (text.strip(), "stop")
+    finally:
+        monkeypatch.undo()
+        importlib.reload(gen_control)
+
+
+def test_budget_settings_follow_the_environment(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_WORDS", "50")
+    monkeypatch.setenv("LLM_DEADLINE", "2.5")
+    module = importlib.reload(gen_control)
+    try:
+        assert module.budget_settings()["max_words"] == 50
+        assert module.budget_settings()["deadline"] == 2.5
+        assert module.GenerationController().max_words == 50
+    finally:
+        monkeypatch.undo()
+        importlib.reload(gen_control)
+
+
+def test_word_budget_stops_at_the_next_sentence_boundary():
+    ctl = controller(max_words=5)
+    assert ctl.feed("Um dois três. ") == ("Um dois três. ", False)
+    # The sentence that crosses the budget is finished; the start of the next one is dropped
+    assert ctl.feed("Quatro cinco seis. Sete") == ("Quatro cinco seis. ", True)
+    assert ctl.reason == "words"
+    assert ctl.text == "Um dois três. Quatro cinco seis."
+
+
+def test_word_budget_without_boundary_stops_at_the_hard_limit():
+    ctl = controller(max_words=4)
+    assert ctl.feed("um dois três quatro ") == ("um dois três quatro ", False)
+    assert ctl.feed("cinco seis") == ("cinco seis", True)
+    assert ctl.reason == "words"
+
+
+def test_sentence_budget():
+    ctl = controller(max_sentences=2)
+    assert ctl.feed("Primeira. ") == ("Primeira. ", False)
+    assert ctl.feed("Segunda. Terceira") == ("Segunda. ", True)
+    assert ctl.reason == "sentences"
+
+
+def test_paragraph_budget_cuts_at_the_blank_line():
+    ctl = controller(max_paragraphs=1)
+    assert ctl.feed("A poupança rende pouco") == ("A poupança rende pouco", False)
+    assert ctl.feed(".\n\nOutro") == (".", True)
+    assert ctl.reason == "paragraphs"
+    assert ctl.text == "A poupança rende pouco."
+
+
+def test_deadline_stops_at_once():
+    ctl = controller(deadline=0.5)
+    assert ctl.feed("A poupança") == ("A poupança", False)
+    ctl.started -= 1
+    assert ctl.feed(" rende") == (" rende", True)
+    assert ctl.reason == "deadline"
+
+
+def test_empty_answer_is_given_up_after_empty_tokens():
+    ctl = controller(empty_tokens=3)
+    assert ctl.feed("\n") == ("\n", False)
+    assert ctl.feed(" ") == (" ", False)
+    assert ctl.feed("*") == ("", True)
+    assert ctl.reason == "empty"
+    assert ctl.text == ""
+
+
+def test_answer_with_content_is_not_empty():
+    ctl = controller(empty_tokens=2)
+    ctl.feed("\n")
+    assert ctl.feed("Sim") == ("Sim", False)
+    assert ctl.feed(" ") == (" ", False)
+
+
+def test_controlled_closes_the_source_and_reports_the_budget():
+    closed = []
+    out = list(controlled(chunks(["Primeira. ", "Segunda. ", "Terceira. "], closed=closed), controller(max_sentences=1)))
+    assert [c["choices"][0]["delta"].get("content") for c in out] == ["Primeira. ", None]
+    assert out[-1]["choices"][0]["finish_reason"] == "sentences"
+    assert closed == [True]
+
+
+def test_collect_keeps_the_model_finish_reason_when_no_budget_applies():
+    assert collect(chunks(["A poupança ", "rende pouco."], finish_reason="length"), controller()) == (
+        "A poupança rende pouco.",
+        "length",
+    )
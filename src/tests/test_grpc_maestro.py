@@ -0,0 +1,80 @@
+import asyncio
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("grpc")
+pytest.importorskip("multipart")
+
+from conftest import load_app  # noqa: E402
+
+
+class FakeSTTStub:
+    def __init__(self):
+        self.uploads = []
+
+    async def TranscribeStream(self, chunks):
+        chunks = [chunk async for chunk in chunks]
+        self.uploads.append((b"".join(c.data for c in chunks), chunks[0].filename, chunks[0].content_type))
+        return SimpleNamespace(text="quanto rende a poupança?", error="")
+
+
+class FakeStub:
+    def __init__(self, **methods):
+        for name, reply in methods.items():
+            setattr(self, name, self._answer(reply))
+
+    @staticmethod
+    def _answer(reply):
+        async def call(request):
+            return reply
+
+        return call
+
+
+@pytest.fixture
+def maestro(monkeypatch):
+    monkeypatch.setenv("MAESTRO_CACHE_MAX_ENTRIES", "1000")
+    return load_app(os.path.join("grpc", "maestro"), "grpc_maestro_app")
+
+
+def test_cached_pipeline_outlives_the_leader_request(maestro):
+    from starlette.datastructures import Headers, UploadFile
+
+    data = os.urandom(200_000)
+
+    def upload():
+        return UploadFile(io.BytesIO(data), filename="a.wav", headers=Headers({"content-type": "audio/mpeg"}))
+
+    async def scenario():
+        state = maestro.app.state
+        state.sem = asyncio.Semaphore(1)
+        state.stt_stub = FakeSTTStub()
+        state.llm_stub = FakeStub(Generate=SimpleNamespace(generated="Rende pouco.", error=""))
+        state.tts_stub = FakeStub(Synthesize=SimpleNamespace(audio=b"RIFF-fake-wav", error=""))
+        # Saturated: the shared computation waits for the semaphore after the leader has gone
+        await state.sem.acquire()
+        leader_file = upload()
+        leader = asyncio.create_task(maestro.assist(file=leader_file, stream=False, x_cache_bypass=None))
+        while not maestro.PIPELINE_CACHE.stats()["in_flight"]:
+            await asyncio.sleep(0.001)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # FastAPI closes the upload once the request is gone
+        await leader_file.close()
+
+        follower = asyncio.create_task(maestro.assist(file=upload(), stream=False, x_cache_bypass=None))
+        await asyncio.sleep(0)
+        state.sem.release()
+        response = await follower
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return response, body
+
+    response, body = asyncio.run(scenario())
+
+    assert body == b"RIFF-fake-wav"
+    assert response.headers["x-cache"] == "HIT"
+    assert maestro.app.state.stt_stub.uploads == [(data, "a.wav", "audio/mpeg")]
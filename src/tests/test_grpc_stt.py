@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("grpc")
+
+from conftest import load_app  # noqa: E402
+
+
+@pytest.fixture
+def stt(monkeypatch, tmp_path):
+    monkeypatch.setenv("STT_CACHE_DIR", str(tmp_path / "transcripts"))
+    module = load_app(os.path.join("grpc", "mpes-stt"), "grpc_stt_app")
+    decoded = []
+
+    def decode_audio(audio, content_type=""):
+        decoded.append(content_type)
+        # Raw L16 decodes differently at each rate
+        return np.full(1600, len(content_type), dtype=np.float32)
+
+    async def transcribe_speech_async(samples):
+        return f"rate {samples[0]:.0f}", []
+
+    monkeypatch.setattr(module, "decode_audio", decode_audio)
+    monkeypatch.setattr(module.BATCHER, "transcribe_speech_async", transcribe_speech_async)
+    return module, decoded
+
+
+def test_unary_transcribe_passes_the_content_type(stt):
+    stt, decoded = stt
+    request = stt.stt_pb2.TranscribeRequest(audio=b"pcm", filename="a.raw", content_type="audio/L16;rate=16000")
+    reply = asyncio.run(stt.STTService().Transcribe(request, None))
+    assert reply.error == ""
+    assert decoded == ["audio/L16;rate=16000"]
+
+
+def test_stream_takes_the_content_type_of_the_first_chunk(stt):
+    stt, decoded = stt
+    async def chunks():
+        yield stt.stt_pb2.AudioChunk(data=b"pc", filename="a.raw", content_type="audio/L16;rate=8000")
+        yield stt.stt_pb2.AudioChunk(data=b"m")
+
+    reply = asyncio.run(stt.STTService().TranscribeStream(chunks(), None))
+    assert reply.error == ""
+    assert decoded == ["audio/L16;rate=8000"]
+
+
+def test_same_bytes_at_other_rates_are_not_aliased(stt):
+    stt, decoded = stt
+    first = asyncio.run(stt._transcribe_audio(b"pcm", "audio/L16;rate=8000"))
+    second = asyncio.run(stt._transcribe_audio(b"pcm", "audio/L16;rate=16000"))
+    again = asyncio.run(stt._transcribe_audio(b"pcm", "audio/L16;rate=8000"))
+    assert first != second
+    assert again == first
+    # The repeat is answered through the upload alias of its own rate, without decoding
+    assert decoded == ["audio/L16;rate=8000", "audio/L16;rate=16000"]
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import kv_prefix  # noqa: E402
+from kv_prefix import prime, restore  # noqa: E402
+
+SYSTEM = "Você é um assistente financeiro."
+
+
+class FakeLlama:
+    """Keeps the tokens of the last chat it evaluated, like a Llama's input_ids/n_tokens."""
+
+    def __init__(self):
+        self.input_ids = np.zeros(256, dtype=np.intc)
+        self.n_tokens = 0
+        self.chats = 0
+        self.loaded = []
+
+    @staticmethod
+    def render(messages):
+        return [ord(c) for m in messages for c in f"<{m['role']}>{m['content']}"]
+
+    def create_chat_completion(self, messages, **kwargs):
+        self.chats += 1
+        tokens = self.render(messages)
+        self.input_ids[: len(tokens)] = tokens
+        self.n_tokens = len(tokens)
+
+    def save_state(self):
+        return np.array(self.input_ids[: self.n_tokens])
+
+    def load_state(self, state):
+        self.loaded.append(state)
+        self.input_ids[: len(state)] = state
+        self.n_tokens = len(state)
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(kv_prefix, "ENABLED", True)
+
+
+def chat(user, system=SYSTEM):
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+def test_prime_keeps_the_tokens_every_request_shares():
+    model = FakeLlama()
+    prefix = prime(model, SYSTEM)
+    # Everything up to the user's text: the system message and the user turn's opening
+    expected = FakeLlama.render(chat(""))
+    assert prefix.tokens.tolist() == expected
+    assert model.n_tokens == len(expected)
+    assert prefix.state.tolist() == expected
+
+
+def test_restore_reloads_the_snapshot_only_when_the_cache_lost_it():
+    model = FakeLlama()
+    prime(model, SYSTEM)
+    restore(model, chat("quanto rende a poupança?"))
+    assert model.loaded == []
+
+    model.create_chat_completion(chat("oi", system="Outro sistema."))
+    restore(model, chat("quanto rende a poupança?"))
+    assert len(model.loaded) == 1
+    assert model.input_ids[: model.n_tokens].tolist() == FakeLlama.render(chat(""))
+
+
+def test_new_system_prompt_is_primed_on_first_use():
+    model = FakeLlama()
+    prime(model, SYSTEM)
+    chats = model.chats
+    restore(model, chat("oi", system="Seja breve."))
+    assert model.chats == chats + 2
+    assert kv_prefix._PREFIXES[model].system_prompt == "Seja breve."
+
+
+def test_restore_leaves_other_models_and_messages_alone():
+    model = FakeLlama()
+    restore(model, [{"role": "user", "content": "oi"}])
+    assert model.chats == 0
+
+    class BatchEngine:
+        def create_chat_completion(self, **kwargs):
+            raise AssertionError("primed a BatchEngine")
+
+    restore(BatchEngine(), chat("oi"))
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(kv_prefix, "ENABLED", False)
+    model = FakeLlama()
+    assert prime(model, SYSTEM) is None
+    restore(model, chat("oi"))
+    assert model.chats == 0
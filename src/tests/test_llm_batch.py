@@ -0,0 +1,81 @@
+"""Smoke tests of the llama.cpp binding surface llm_batch.BatchEngine is built on.
+
+The engine drives raw llama.cpp calls through llama-cpp-python's ctypes
+bindings, whose signatures change between releases (the services pin the
+version in requirements.txt). Skipped when llama_cpp is not installed. Set
+LLM_TEST_MODEL to a GGUF with a chat template to also run a batched
+generation.
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+llama_cpp = pytest.importorskip("llama_cpp")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import llm_batch  # noqa: E402
+
+# Binding name -> number of C arguments, as BatchEngine calls them
+BINDINGS = {
+    "llama_new_context_with_model": 2,
+    "llama_free": 1,
+    "llama_batch_init": 3,
+    "llama_batch_free": 1,
+    "llama_decode": 2,
+    "llama_get_logits_ith": 2,
+    "llama_kv_cache_clear": 1,
+    "llama_kv_cache_seq_rm": 4,
+    "llama_kv_cache_seq_cp": 5,
+    "llama_token_get_text": 2,
+    "llama_token_is_eog": 2,
+}
+CONTEXT_PARAMS = ("n_seq_max", "n_ctx", "n_batch", "n_ubatch", "logits_all")
+BATCH_FIELDS = ("n_tokens", "token", "pos", "n_seq_id", "seq_id", "logits")
+
+
+@pytest.mark.parametrize("name,n_args", sorted(BINDINGS.items()))
+def test_binding_signature(name, n_args):
+    binding = getattr(llama_cpp, name, None)
+    assert binding is not None, f"llama_cpp.{name} is gone"
+    assert len(binding.argtypes) == n_args
+
+
+def test_struct_fields():
+    context_fields = {field for field, _ in llama_cpp.llama_context_params._fields_}
+    assert set(CONTEXT_PARAMS) <= context_fields
+    batch_fields = {field for field, _ in llama_cpp.llama_batch._fields_}
+    assert set(BATCH_FIELDS) <= batch_fields
+
+
+def test_chat_formatter():
+    formatter = llm_batch.llama_chat_format.Jinja2ChatFormatter(
+        template="{% for m in messages %}<{{ m['role'] }}>{{ m['content'] }}{% endfor %}",
+        eos_token="</s>",
+        bos_token="<s>",
+        stop_token_ids=[2],
+    )
+    result = formatter(messages=[{"role": "user", "content": "oi"}])
+    assert result.prompt == "<user>oi"
+
+
+@pytest.mark.skipif(not os.getenv("LLM_TEST_MODEL"), reason="LLM_TEST_MODEL not set")
+def test_batched_generation():
+    llm = llama_cpp.Llama(model_path=os.environ["LLM_TEST_MODEL"], n_ctx=256, n_gpu_layers=0, verbose=False)
+    engine = llm_batch.BatchEngine(llm, slots=2, prefill_chunk=32)
+    messages = [{"role": "system", "content": "Responda curto."}, {"role": "user", "content": "Diga oi."}]
+    results = []
+
+    def run():
+        out = engine.create_chat_completion(messages, max_tokens=8, temperature=0.0)
+        results.append(out["choices"][0]["message"]["content"])
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Greedy decoding: every sequence gets the same answer, batched or not
+    assert len(results) == 3 and len(set(results)) == 1
+    assert engine.stats()["completed"] == 3
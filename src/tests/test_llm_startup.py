@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("llama_cpp")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import llm_startup  # noqa: E402
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def create_chat_completion(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def test_warm_up_runs_one_short_generation(monkeypatch):
+    monkeypatch.setattr(llm_startup, "WARMUP_TOKENS", 4)
+    model = FakeModel()
+    llm_startup.warm_up(model, "Você é um assistente financeiro.")
+    assert len(model.calls) == 1
+    assert model.calls[0]["max_tokens"] == 4
+    assert model.calls[0]["messages"][0] == {"role": "system", "content": "Você é um assistente financeiro."}
+
+
+def test_warm_up_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(llm_startup, "WARMUP_TOKENS", 0)
+    model = FakeModel()
+    llm_startup.warm_up(model, "Você é um assistente financeiro.")
+    assert model.calls == []
+
+
+def test_weights_are_mapped_by_default():
+    assert llm_startup.load_params() == {"use_mmap": llm_startup.MMAP, "use_mlock": llm_startup.MLOCK}
+    assert llm_startup.device() in ("cpu", "cuda")
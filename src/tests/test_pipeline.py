@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from pipeline import stream_sentence_audio  # noqa: E402
+from wavstream import WavFormat, parse_wav, wav_header  # noqa: E402
+
+FMT = WavFormat(1, 16000, 16)
+
+
+async def deltas(parts):
+    for part in parts:
+        await asyncio.sleep(0)
+        yield part
+
+
+def collect(parts, synthesize, max_parallel=4):
+    async def run():
+        return [chunk async for chunk in stream_sentence_audio(deltas(parts), synthesize, max_parallel)]
+
+    return asyncio.run(run())
+
+
+def test_sentences_are_streamed_in_order_as_one_wav():
+    sentences = ["Primeira frase da resposta.", "Segunda frase, bem mais curta.", "Terceira e última frase"]
+
+    async def synthesize(sentence):
+        # Later sentences finish first; the output must still follow the text
+        await asyncio.sleep(0.01 * (3 - sentences.index(sentence)))
+        pcm = bytes([sentences.index(sentence) + 1, 0])
+        return wav_header(FMT, len(pcm)) + pcm
+
+    chunks = collect(["Primeira frase da ", "resposta. Segunda frase, ", "bem mais curta. Terceira e última frase"], synthesize)
+    assert len(chunks) == 3
+    fmt, frames = parse_wav(b"".join(chunks))
+    assert fmt == FMT
+    assert bytes(frames) == b"\x01\x00\x02\x00\x03\x00"
+
+
+def test_synthesis_is_bounded_by_max_parallel():
+    running = []
+    peak = []
+
+    async def synthesize(sentence):
+        running.append(sentence)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(sentence)
+        return wav_header(FMT, 2) + b"\x00\x00"
+
+    text = [f"Esta é a frase número {i} da resposta. " for i in range(6)]
+    assert len(collect(text, synthesize, max_parallel=2)) == 6
+    assert max(peak) == 2
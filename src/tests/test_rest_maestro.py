@@ -0,0 +1,65 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+pytest.importorskip("multipart")
+import httpx  # noqa: E402
+
+from conftest import load_app  # noqa: E402
+
+
+@pytest.fixture
+def maestro(monkeypatch):
+    monkeypatch.setenv("MAESTRO_CACHE_MAX_ENTRIES", "1000")
+    return load_app(os.path.join("rest", "maestro"), "rest_maestro_app")
+
+
+def test_cached_pipeline_outlives_the_leader_request(maestro):
+    from starlette.datastructures import Headers, UploadFile
+
+    data = os.urandom(200_000)
+    uploads = []
+
+    def upload():
+        return UploadFile(io.BytesIO(data), filename="a.wav", headers=Headers({"content-type": "audio/mpeg"}))
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        url = str(request.url.copy_with(query=None))
+        if url == maestro.STT_STREAM_URL:
+            uploads.append((await request.aread(), request.url.params["filename"], request.headers["content-type"]))
+            return httpx.Response(200, json={"text": "quanto rende a poupança?"})
+        if url == maestro.LLM_URL:
+            return httpx.Response(200, json={"generated": "Rende pouco."})
+        return httpx.Response(200, content=b"RIFF-fake-wav")
+
+    async def scenario():
+        state = maestro.app.state
+        state.sem = asyncio.Semaphore(1)
+        state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        # Saturated: the shared computation waits for the semaphore after the leader has gone
+        await state.sem.acquire()
+        leader_file = upload()
+        leader = asyncio.create_task(maestro.assist(file=leader_file, stream=False, x_cache_bypass=None))
+        while not maestro.PIPELINE_CACHE.stats()["in_flight"]:
+            await asyncio.sleep(0.001)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # FastAPI closes the upload once the request is gone
+        await leader_file.close()
+
+        follower = asyncio.create_task(maestro.assist(file=upload(), stream=False, x_cache_bypass=None))
+        await asyncio.sleep(0)
+        state.sem.release()
+        response = await follower
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        await state.http_client.aclose()
+        return response, body
+
+    response, body = asyncio.run(scenario())
+
+    assert body == b"RIFF-fake-wav"
+    assert response.headers["x-cache"] == "HIT"
+    assert uploads == [(data, "a.wav", "audio/mpeg")]
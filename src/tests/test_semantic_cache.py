@@ -0,0 +1,111 @@
+import os
+import sys
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from semantic_cache import SemanticCache, normalize, numbers  # noqa: E402
+
+
+class FakeEmbedder:
+    """Bag of words that ignores numbers, like a real embedding model nearly does."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        vector = np.zeros(256, dtype=np.float32)
+        for word in text.split():
+            if not word.isdigit():
+                vector[zlib.crc32(word.encode()) % 256] += 1
+        return vector
+
+
+def semantic(**kwargs):
+    return SemanticCache(FakeEmbedder(), enabled=True, **kwargs)
+
+
+def test_normalize_and_numbers():
+    assert normalize("  Quanto RENDE a poupança?! ") == "quanto rende a poupanca"
+    assert numbers("Quanto rende R$ 1.500,00 em 12 meses?") == ("1.500,00", "12")
+
+
+def test_paraphrase_gets_the_earlier_answer_with_provenance():
+    cache = semantic(threshold=0.9)
+    cache.add("Quanto rende a poupança?", "Rende pouco.", scope="s", source_key="key-1")
+    answer, provenance = cache.lookup("quanto rende a poupanca", scope="s")
+    assert answer == "Rende pouco."
+    assert provenance["source_prompt"] == "Quanto rende a poupança?"
+    assert provenance["source_key"] == "key-1"
+    assert provenance["hits"] == 1
+    assert provenance["similarity"] == pytest.approx(1.0)
+
+
+def test_dissimilar_prompt_misses():
+    cache = semantic(threshold=0.9)
+    cache.add("Quanto rende a poupança?", "Rende pouco.", scope="s")
+    assert cache.lookup("Como declarar o imposto de renda?", scope="s") is None
+    assert cache.stats()["hits"] == 0
+
+
+def test_other_scope_misses_without_embedding():
+    cache = semantic()
+    cache.add("Quanto rende a poupança?", "Rende pouco.", scope='{"temperature": 0.7}')
+    embeds = len(cache.embed.calls)
+    assert cache.lookup("Quanto rende a poupança?", scope='{"temperature": 0.2}') is None
+    assert len(cache.embed.calls) == embeds
+
+
+def test_prompts_with_other_numbers_never_share_an_answer():
+    cache = semantic()
+    cache.add("Quanto rendem 100 reais na poupança?", "Uns 50 centavos por mês.")
+    # The embeddings are identical; only the number guard keeps them apart
+    assert cache.lookup("Quanto rendem 1000 reais na poupança?") is None
+    assert cache.lookup("quanto rendem 100 reais na poupanca") is not None
+
+
+def test_number_guard_keeps_the_separators():
+    cache = semantic()
+    cache.add("Quanto rendem 1.500 reais?", "Uns 7 reais por mês.")
+    assert cache.lookup("Quanto rendem 1,500 reais?") is None
+    assert cache.lookup("quanto rendem 1500 reais") is None
+    assert cache.lookup("Quanto rendem 1.500 reais") is not None
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = semantic(maxsize=2)
+    cache.add("Quanto rende a poupança?", "a")
+    cache.add("Como declarar o imposto de renda?", "b")
+    assert cache.lookup("quanto rende a poupança") is not None
+    cache.add("Vale a pena investir em CDB?", "c")
+    assert cache.lookup("Como declarar o imposto de renda?") is None
+    assert cache.lookup("Quanto rende a poupança?")[0] == "a"
+    assert cache.stats()["entries"] == 2
+
+
+def test_same_normalized_prompt_replaces_the_answer():
+    cache = semantic()
+    cache.add("Quanto rende a poupança?", "old")
+    cache.add("quanto rende a poupanca", "new")
+    assert cache.lookup("Quanto rende a poupança?")[0] == "new"
+    assert cache.stats()["entries"] == 1
+
+
+def test_embedding_failure_disables_the_layer():
+    def broken(text):
+        raise RuntimeError("model file missing")
+
+    cache = SemanticCache(broken, enabled=True)
+    cache.add("Quanto rende a poupança?", "Rende pouco.")
+    assert not cache.enabled
+    assert cache.lookup("Quanto rende a poupança?") is None
+
+
+def test_without_embedder_the_layer_is_off():
+    cache = SemanticCache(None, enabled=True)
+    assert not cache.enabled
+    cache.add("Quanto rende a poupança?", "Rende pouco.")
+    assert cache.lookup("Quanto rende a poupança?") is None
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("llama_cpp")
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import speculative  # noqa: E402
+from speculative import DraftStats, MeasuredDraft, draft_from_env  # noqa: E402
+
+
+class FixedDraft(LlamaDraftModel):
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        return np.array(self.tokens, dtype=np.intc)
+
+
+def ids(*tokens):
+    return np.array(tokens, dtype=np.intc)
+
+
+def test_acceptance_is_counted_by_the_next_call():
+    stats = DraftStats()
+    draft = MeasuredDraft(FixedDraft([5, 6, 7]), stats)
+    assert draft(ids(1, 2)).tolist() == [5, 6, 7]
+    # The main model kept 5 and 6, then sampled 9
+    draft(ids(1, 2, 5, 6, 9))
+    # All three kept, plus its own sample
+    draft(ids(1, 2, 5, 6, 9, 5, 6, 7, 8))
+    summary = stats.stats()
+    assert (summary["steps"], summary["proposed"], summary["accepted"]) == (2, 6, 5)
+    assert summary["tokens_per_step"] == 3.5
+
+
+def test_a_new_generation_does_not_verify_the_old_proposal():
+    stats = DraftStats()
+    draft = MeasuredDraft(FixedDraft([5, 6]), stats)
+    draft(ids(1, 2, 3))
+    draft(ids(4))
+    assert stats.stats()["steps"] == 0
+
+
+def test_draft_from_env(monkeypatch):
+    monkeypatch.setattr(speculative, "DRAFT", "")
+    assert draft_from_env(4096) is None
+    monkeypatch.setattr(speculative, "DRAFT", "prompt-lookup")
+    draft = draft_from_env(4096)
+    assert isinstance(draft, MeasuredDraft)
+    assert isinstance(draft.draft, LlamaPromptLookupDecoding)
+    monkeypatch.setattr(speculative, "DRAFT", "medusa")
+    with pytest.raises(ValueError):
+        draft_from_env(4096)
@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import stt_engine  # noqa: E402
+from stt_engine import load_engine, transcript_key, upload_key  # noqa: E402
+
+AUDIO = np.linspace(-0.5, 0.5, 16000, dtype=np.float32)
+
+
+def test_transcript_key_depends_on_the_pcm_and_the_settings():
+    key = transcript_key(AUDIO, "small", "pt", vad=False, engine="whisper")
+    assert key == transcript_key(AUDIO.astype(np.float64), "small", "pt", vad=False, engine="whisper")
+    assert key != transcript_key(AUDIO[:-1], "small", "pt", vad=False, engine="whisper")
+    assert key != transcript_key(AUDIO, "medium", "pt", vad=False, engine="whisper")
+    assert key != transcript_key(AUDIO, "small", "pt", vad=True, engine="whisper")
+    # Engines are cached apart: int8 weights can change the text
+    assert key != transcript_key(AUDIO, "small", "pt", vad=False, engine="whisper-int8")
+
+
+def test_ctranslate2_key_includes_the_compute_type(monkeypatch):
+    key = transcript_key(AUDIO, "small", "pt", vad=False, engine="ctranslate2")
+    monkeypatch.setattr(stt_engine, "COMPUTE_TYPE", "float16")
+    assert key != transcript_key(AUDIO, "small", "pt", vad=False, engine="ctranslate2")
+    # Other engines ignore it
+    assert transcript_key(AUDIO, "small", "pt", False, "whisper") == transcript_key(AUDIO, "small", "pt", False, "whisper")
+
+
+def test_upload_key_includes_the_content_type():
+    assert upload_key(b"pcm") == upload_key(b"pcm")
+    assert upload_key(b"pcm", "audio/L16; rate=8000") != upload_key(b"pcm", "audio/L16; rate=16000")
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError, match="Unknown STT_ENGINE"):
+        load_engine("small", engine="whisper-cpp")
+
+
+@pytest.mark.skipif(importlib.util.find_spec("faster_whisper") is not None, reason="faster-whisper installed")
+def test_ctranslate2_without_faster_whisper_says_what_to_install():
+    with pytest.raises(RuntimeError, match="faster-whisper"):
+        load_engine("small", engine="ctranslate2")
+
+
+def test_int8_quantization_swaps_the_linear_layers():
+    torch = pytest.importorskip("torch")
+    whisper_model = pytest.importorskip("whisper.model")
+    dims = whisper_model.ModelDimensions(
+        n_mels=80, n_audio_ctx=8, n_audio_state=16, n_audio_head=2, n_audio_layer=1,
+        n_vocab=64, n_text_ctx=8, n_text_state=16, n_text_head=2, n_text_layer=1,
+    )
+    model = stt_engine._quantize_int8(whisper_model.Whisper(dims))
+    modules = list(model.modules())
+    assert any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in modules)
+    assert not any(type(m) in (whisper_model.Linear, torch.nn.Linear) for m in modules)
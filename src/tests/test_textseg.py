@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from textseg import SentenceSplitter, split_sentences  # noqa: E402
+
+
+def feed_all(splitter, deltas):
+    sentences = []
+    for delta in deltas:
+        sentences.extend(splitter.feed(delta))
+    return sentences
+
+
+def test_sentence_is_returned_once_the_space_after_it_arrives():
+    splitter = SentenceSplitter(min_chars=1)
+    assert splitter.feed("A poupança rende pouco.") == []
+    assert splitter.feed(" Invista") == ["A poupança rende pouco."]
+    assert splitter.pending == "Invista"
+    assert splitter.flush() == ["Invista"]
+
+
+def test_number_split_across_deltas_is_not_cut():
+    splitter = SentenceSplitter(min_chars=1)
+    sentences = feed_all(splitter, ["O saldo é R$ 1.", "500,00 hoje. ", "Fim"])
+    assert sentences == ["O saldo é R$ 1.500,00 hoje."]
+
+
+def test_abbreviations_do_not_end_a_sentence():
+    splitter = SentenceSplitter(min_chars=1)
+    sentences = feed_all(splitter, ["Fale com o Sr. Silva sobre a conta. ", "Depois"])
+    assert sentences == ["Fale com o Sr. Silva sobre a conta."]
+
+
+def test_short_sentences_are_merged_with_the_next_one():
+    assert split_sentences("Sim. A taxa anual é de seis por cento.", min_chars=20) == [
+        "Sim. A taxa anual é de seis por cento."
+    ]
+
+
+def test_long_sentences_are_cut_at_the_last_soft_boundary():
+    text = "Primeiro, guarde uma reserva; depois, invista o resto em renda fixa"
+    splitter = SentenceSplitter(min_chars=5, max_chars=40)
+    assert splitter.feed(text) == ["Primeiro, guarde uma reserva; depois,"]
+    assert splitter.flush() == ["invista o resto em renda fixa"]
+
+
+def test_other_terminators_and_newlines():
+    assert split_sentences("Quanto rende? Muito pouco!\nAté logo…  Tchau", min_chars=1) == [
+        "Quanto rende?", "Muito pouco!", "Até logo…", "Tchau",
+    ]
@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("thriftpy2")
+pytest.importorskip("multipart")
+from fastapi.testclient import TestClient  # noqa: E402
+
+from conftest import load_app  # noqa: E402
+
+
+class FakePool:
+    """Stands in for an AsyncThriftPool: records calls and answers with canned replies."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+
+    async def call(self, method, *args):
+        self.calls += 1
+        return self.reply
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class FakeLLMStream:
+    """Stands in for the LLM pool in streaming mode: GenerateNext hands out one canned delta per poll."""
+
+    def __init__(self, deltas, events):
+        self.deltas = list(deltas)
+        self.events = events
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        yield self
+
+    async def GenerateOpen(self, req):
+        return "stream-1"
+
+    async def GenerateNext(self, stream_id, wait_ms):
+        # Gives the sentences already complete a chance to reach TTS, as a network round trip would
+        await asyncio.sleep(0.01)
+        delta = self.deltas.pop(0)
+        self.events.append(("llm", delta))
+        done = not self.deltas
+        return SimpleNamespace(delta=delta, done=done, finish_reason="stop" if done else "", error="")
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class FakeTTS(FakePool):
+    def __init__(self, events, wav):
+        super().__init__(SimpleNamespace(audio=wav, error=""))
+        self.events = events
+
+    async def call(self, method, text):
+        self.events.append(("tts", text))
+        return await super().call(method, text)
+
+
+@pytest.fixture
+def maestro(monkeypatch):
+    # No connections opened at startup: the downstream pools are replaced below
+    monkeypatch.setenv("THRIFT_POOL_MIN_SIZE", "0")
+    monkeypatch.setenv("MAESTRO_CACHE_MAX_ENTRIES", "1000")
+    return load_app(os.path.join("thrift", "maestro"), "thrift_maestro_app")
+
+
+def test_assist_with_pipeline_cache(maestro):
+    assert maestro.PIPELINE_CACHE.maxsize > 0
+    with TestClient(maestro.app) as client:
+        pools = {
+            "stt_pool": FakePool(SimpleNamespace(text="quanto rende a poupança?", error="")),
+            "llm_pool": FakePool(SimpleNamespace(generated="Rende pouco.", error="")),
+            "tts_pool": FakePool(SimpleNamespace(audio=b"RIFF-fake-wav", error="")),
+        }
+        for name, pool in pools.items():
+            setattr(maestro.app.state, name, pool)
+        files = {"file": ("a.wav", b"x" * 200_000, "audio/wav")}
+
+        first = client.post("/assist", files=files)
+        second = client.post("/assist", files=files)
+
+    assert first.status_code == 200
+    assert first.headers["x-cache"] == "MISS"
+    assert first.content == b"RIFF-fake-wav"
+    assert second.status_code == 200
+    assert second.headers["x-cache"] == "HIT"
+    assert second.content == first.content
+    assert [pool.calls for pool in pools.values()] == [1, 1, 1]
+
+
+def test_assist_stream_synthesizes_while_the_llm_decodes(maestro):
+    from wavstream import WavFormat, wav_header
+
+    pcm = b"\x01\x00" * 160
+    wav = wav_header(WavFormat(1, 16000, 16), len(pcm)) + pcm
+    events = []
+    deltas = ["Rende cerca de seis por cento ao ano. ", "O valor ", "depende da taxa Selic."]
+    with TestClient(maestro.app) as client:
+        maestro.app.state.stt_pool = FakePool(SimpleNamespace(text="quanto rende a poupança?", error=""))
+        maestro.app.state.llm_pool = FakeLLMStream(deltas, events)
+        maestro.app.state.tts_pool = FakeTTS(events, wav)
+        files = {"file": ("a.wav", b"x" * 1000, "audio/wav")}
+        response = client.post("/assist?stream=true", files=files, headers={"X-Cache-Bypass": "1"})
+
+    assert response.status_code == 200
+    assert response.content[44:] == pcm * 2
+    # The first sentence went to TTS before the LLM produced the rest of the answer
+    assert events.index(("tts", "Rende cerca de seis por cento ao ano.")) < events.index(("llm", deltas[-1]))
+    assert ("tts", "O valor depende da taxa Selic.") in events
+
+
+def test_cached_pipeline_outlives_the_leader_request(maestro):
+    from starlette.datastructures import Headers, UploadFile
+
+    data = b"x" * 200_000
+
+    def upload():
+        return UploadFile(io.BytesIO(data), filename="a.wav", headers=Headers({"content-type": "audio/mpeg"}))
+
+    class RecordingSTT(FakePool):
+        async def call(self, method, content, filename, content_type):
+            self.args = (content, filename, content_type)
+            return await super().call(method, content, filename, content_type)
+
+    async def scenario():
+        state = maestro.app.state
+        state.sem = asyncio.Semaphore(1)
+        state.stt_pool = RecordingSTT(SimpleNamespace(text="quanto rende a poupança?", error=""))
+        state.llm_pool = FakePool(SimpleNamespace(generated="Rende pouco.", error=""))
+        state.tts_pool = FakePool(SimpleNamespace(audio=b"RIFF-fake-wav", error=""))
+        # Saturated: the shared computation waits for the semaphore after the leader has gone
+        await state.sem.acquire()
+        leader_file = upload()
+        leader = asyncio.create_task(maestro.assist(file=leader_file, stream=False, x_cache_bypass=None))
+        while not maestro.PIPELINE_CACHE.stats()["in_flight"]:
+            await asyncio.sleep(0.001)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # FastAPI closes the upload once the request is gone
+        await leader_file.close()
+
+        follower = asyncio.create_task(maestro.assist(file=upload(), stream=False, x_cache_bypass=None))
+        await asyncio.sleep(0)
+        state.sem.release()
+        response = await follower
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return state.stt_pool, response, body
+
+    stt, response, body = asyncio.run(scenario())
+
+    assert body == b"RIFF-fake-wav"
+    assert response.headers["x-cache"] == "HIT"
+    assert stt.calls == 1
+    assert stt.args == (data, "a.wav", "audio/mpeg")
+
+
+def test_cache_bypass_header_runs_the_pipeline_every_time(maestro):
+    with TestClient(maestro.app) as client:
+        pools = {
+            "stt_pool": FakePool(SimpleNamespace(text="quanto rende a poupança?", error="")),
+            "llm_pool": FakePool(SimpleNamespace(generated="Rende pouco.", error="")),
+            "tts_pool": FakePool(SimpleNamespace(audio=b"RIFF-fake-wav", error="")),
+        }
+        for name, pool in pools.items():
+            setattr(maestro.app.state, name, pool)
+        files = {"file": ("a.wav", b"x" * 1000, "audio/wav")}
+        responses = [client.post("/assist", files=files, headers={"X-Cache-Bypass": "1"}) for _ in range(2)]
+
+    assert [r.headers["x-cache"] for r in responses] == ["BYPASS", "BYPASS"]
+    assert [r.content for r in responses] == [b"RIFF-fake-wav"] * 2
+    assert [pool.calls for pool in pools.values()] == [2, 2, 2]
+    assert len(maestro.PIPELINE_CACHE) == 0
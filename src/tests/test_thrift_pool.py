@@ -0,0 +1,110 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+thriftpy2 = pytest.importorskip("thriftpy2")
+from thriftpy2.rpc import make_server  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import thrift_wire  # noqa: E402
+from thrift_pool import AsyncThriftPool  # noqa: E402
+
+IDL = "service Echo {\n  string echo(1: string text, 2: double delay)\n}\n"
+
+
+class Handler:
+    def echo(self, text, delay):
+        time.sleep(delay)
+        return text
+
+
+@pytest.fixture
+def server(tmp_path):
+    """A threaded Thrift server on localhost that closes connections idle for 200 ms."""
+    (tmp_path / "echo.thrift").write_text(IDL)
+    service = thriftpy2.load(str(tmp_path / "echo.thrift"), module_name="echo_thrift").Echo
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    srv = make_server(service, Handler(), "127.0.0.1", port, client_timeout=200, **thrift_wire.factories())
+    threading.Thread(target=srv.serve, daemon=True).start()
+    time.sleep(0.1)
+    yield service, port
+    srv.close()
+
+
+def run(server, body, **pool_kwargs):
+    service, port = server
+
+    async def main():
+        pool = AsyncThriftPool(service, "127.0.0.1", port, **pool_kwargs, **thrift_wire.aio_factories())
+        await pool.start()
+        try:
+            return await body(pool)
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def test_sequential_calls_reuse_one_connection(server):
+    async def body(pool):
+        results = [await pool.call("echo", f"msg {i}", 0.0) for i in range(5)]
+        return results, pool.stats()
+
+    results, stats = run(server, body, min_size=1, max_size=4)
+    assert results == [f"msg {i}" for i in range(5)]
+    assert stats["created"] == 1
+    assert (stats["size"], stats["idle"], stats["in_use"]) == (1, 1, 0)
+
+
+def test_concurrent_calls_are_capped_at_max_size(server):
+    async def body(pool):
+        results = await asyncio.gather(*(pool.call("echo", str(i), 0.05) for i in range(6)))
+        return results, pool.stats()
+
+    results, stats = run(server, body, min_size=0, max_size=2)
+    assert results == [str(i) for i in range(6)]
+    assert stats["created"] == 2
+
+
+def test_connection_closed_by_the_server_is_dropped(server):
+    async def body(pool):
+        await pool.call("echo", "first", 0.0)
+        # The server closes the idle connection after its client timeout
+        await asyncio.sleep(0.5)
+        return await pool.call("echo", "second", 0.0), pool.stats()
+
+    result, stats = run(server, body, min_size=0, max_size=2)
+    assert result == "second"
+    assert (stats["created"], stats["evicted"], stats["size"]) == (2, 1, 1)
+
+
+def test_stale_connection_is_retried_on_a_fresh_one(server, monkeypatch):
+    # Pretend the health check missed the closed socket: the call itself fails and is retried
+    monkeypatch.setattr(AsyncThriftPool, "_healthy", staticmethod(lambda client: True))
+
+    async def body(pool):
+        await pool.call("echo", "first", 0.0)
+        await asyncio.sleep(0.5)
+        return await pool.call("echo", "second", 0.0), pool.stats()
+
+    result, stats = run(server, body, min_size=0, max_size=2)
+    assert result == "second"
+    assert (stats["created"], stats["broken"], stats["size"]) == (2, 1, 1)
+
+
+def test_idle_connections_expire_after_max_idle(server):
+    async def body(pool):
+        await pool.call("echo", "first", 0.0)
+        await asyncio.sleep(0.05)
+        return await pool.call("echo", "second", 0.0), pool.stats()
+
+    result, stats = run(server, body, min_size=0, max_size=2, max_idle=0.01)
+    assert result == "second"
+    assert (stats["created"], stats["evicted"]) == (2, 1)
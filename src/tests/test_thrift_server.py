@@ -0,0 +1,99 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+thriftpy2 = pytest.importorskip("thriftpy2")
+from thriftpy2.rpc import make_client  # noqa: E402
+from thriftpy2.transport import TServerSocket  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import thrift_server  # noqa: E402
+import thrift_wire  # noqa: E402
+
+IDL = "service Echo {\n  string echo(1: string text)\n}\n"
+
+
+class Handler:
+    def echo(self, text):
+        return f"{threading.current_thread().name}:{text}"
+
+
+@pytest.fixture
+def service(tmp_path):
+    (tmp_path / "echo.thrift").write_text(IDL)
+    return thriftpy2.load(str(tmp_path / "echo.thrift"), module_name="echo_server_thrift").Echo
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def client(service, port):
+    return make_client(service, "127.0.0.1", port, timeout=2000, **thrift_wire.factories())
+
+
+def test_pool_server_serves_requests_on_each_connection(service):
+    port = free_port()
+    server = thrift_server._pool_server(service, Handler(), "127.0.0.1", port, client_timeout=None)
+    threading.Thread(target=server.serve, daemon=True).start()
+    time.sleep(0.1)
+    clients = [client(service, port) for _ in range(3)]
+    try:
+        for _ in range(3):
+            for i, c in enumerate(clients):
+                # Handled by the worker pool, not by a thread per connection
+                assert c.echo(str(i)).startswith("thrift-worker-")
+    finally:
+        for c in clients:
+            c.close()
+        server.close()
+
+
+def test_processes_sharing_a_listen_socket_keep_serving_their_connections(service):
+    # Two pool servers on one listening socket, as pre-forked children share it
+    port = free_port()
+    listener = TServerSocket(host="127.0.0.1", port=port)
+    listener.listen()
+    servers = [
+        thrift_server._pool_server(service, Handler(), "127.0.0.1", port, None, listen_sock=listener.sock)
+        for _ in range(2)
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve, daemon=True).start()
+    time.sleep(0.1)
+    clients = []
+    try:
+        for i in range(8):
+            clients.append(client(service, port))
+            clients[-1].echo("hello")
+        # Every connection is answered, whichever server accepted it and whichever lost the race last
+        for i, c in enumerate(clients):
+            assert c.echo(str(i)).endswith(f":{i}")
+    finally:
+        for c in clients:
+            c.close()
+        for server in servers:
+            server.close()
+
+
+def test_accept_returns_when_another_process_took_the_connection(service):
+    port = free_port()
+    listener = TServerSocket(host="127.0.0.1", port=port)
+    listener.listen()
+    server = thrift_server._pool_server(service, Handler(), "127.0.0.1", port, None, listen_sock=listener.sock)
+    threading.Thread(target=server.serve, daemon=True).start()
+    time.sleep(0.1)
+    assert not listener.sock.getblocking()
+    # The selector said "readable" but nothing is left to accept: no blocking until the next client
+    accepted = []
+    loser = threading.Thread(target=lambda: accepted.append(server._accept()), daemon=True)
+    loser.start()
+    loser.join(1.0)
+    server.close()
+    assert accepted == [None]
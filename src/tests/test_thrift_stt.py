@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("thriftpy2")
+
+from conftest import load_app  # noqa: E402
+
+
+@pytest.fixture
+def stt(monkeypatch, tmp_path):
+    monkeypatch.setenv("STT_CACHE_DIR", str(tmp_path / "transcripts"))
+    module = load_app(os.path.join("thrift", "mpes-stt"), "thrift_stt_app")
+    decoded = []
+
+    def decode_audio(audio, content_type=""):
+        decoded.append(audio)
+        # Every upload decodes to the same PCM, as a re-encoded copy would
+        return np.zeros(1600, dtype=np.float32)
+
+    monkeypatch.setattr(module, "decode_audio", decode_audio)
+    transcribed = []
+
+    def transcribe_speech(samples):
+        transcribed.append(samples)
+        return "olá", []
+
+    monkeypatch.setattr(module.BATCHER, "transcribe_speech", transcribe_speech)
+    return module, decoded, transcribed
+
+
+def test_identical_upload_skips_decoding(stt):
+    module, decoded, transcribed = stt
+    first = module._transcribe(b"mp3-bytes", "audio/mpeg")
+    second = module._transcribe(b"mp3-bytes", "audio/mpeg")
+    assert first == second == {"text": "olá", "segments": []}
+    assert len(decoded) == 1
+    assert len(transcribed) == 1
+
+
+def test_reencoded_upload_shares_the_pcm_key(stt):
+    module, decoded, transcribed = stt
+    module._transcribe(b"mp3-bytes", "audio/mpeg")
+    module._transcribe(b"ogg-bytes", "audio/ogg")
+    # Decoded again (other bytes), but transcribed once: same PCM, same transcript key
+    assert len(decoded) == 2
+    assert len(transcribed) == 1
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+thriftpy2 = pytest.importorskip("thriftpy2")
+from thriftpy2.rpc import make_aio_client, make_server  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import thrift_wire  # noqa: E402
+
+IDL = "service Echo {\n  binary echo(1: binary data, 2: string name)\n}\n"
+
+
+class Handler:
+    def echo(self, data, name):
+        return name.encode() + data
+
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    path = tmp_path_factory.mktemp("idl") / "wire_echo.thrift"
+    path.write_text(IDL)
+    return thriftpy2.load(str(path), module_name="wire_echo_thrift").Echo
+
+
+@pytest.mark.parametrize("protocol", thrift_wire.PROTOCOLS)
+@pytest.mark.parametrize("transport", thrift_wire.TRANSPORTS)
+def test_sync_server_and_aio_client_agree_on_every_wire_format(service, protocol, transport):
+    # The model services serve with factories(), the maestro calls them with aio_factories()
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = make_server(service, Handler(), "127.0.0.1", port, **thrift_wire.factories(protocol, transport))
+    threading.Thread(target=server.serve, daemon=True).start()
+    time.sleep(0.05)
+    payload = os.urandom(300_000)
+
+    async def call():
+        client = await make_aio_client(service, "127.0.0.1", port, **thrift_wire.aio_factories(protocol, transport))
+        try:
+            return await client.echo(payload, "cenário")
+        finally:
+            client.close()
+
+    try:
+        assert asyncio.run(call()) == "cenário".encode() + payload
+    finally:
+        server.close()
+
+
+def test_unknown_wire_format_is_rejected():
+    with pytest.raises(ValueError, match="THRIFT_PROTOCOL"):
+        thrift_wire.factories("json", "buffered")
+    with pytest.raises(ValueError, match="THRIFT_TRANSPORT"):
+        thrift_wire.aio_factories("binary", "zlib")
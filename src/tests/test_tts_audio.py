@@ -0,0 +1,104 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import tts_audio  # noqa: E402
+from tts_audio import concat_wavs, sentence_wavs, synthesize_text, synthesize_wav, wav_bytes  # noqa: E402
+from wavstream import WavFormat, parse_wav  # noqa: E402
+
+
+def test_wav_bytes_is_peak_normalized_16bit_pcm():
+    wav = wav_bytes([0.5, -0.25, 0.1, 0.0], 22050)
+    fmt, frames = parse_wav(wav)
+    assert fmt == WavFormat(1, 22050, 16)
+    # As Coqui's save_wav: scaled to the peak, then truncated to int16
+    expected = (np.array([0.5, -0.25, 0.1, 0.0], dtype=np.float32) * (32767 / 0.5)).astype(np.int16)
+    assert np.frombuffer(frames, dtype="<i2").tolist() == expected.tolist()
+
+
+def test_quiet_audio_is_not_blown_up():
+    _, frames = parse_wav(wav_bytes([0.001, -0.001], 16000))
+    assert np.abs(np.frombuffer(frames, dtype="<i2")).max() == int(0.001 * 32767 / 0.01)
+
+
+def test_empty_waveform_is_a_valid_wav():
+    wav = wav_bytes([], 16000)
+    assert len(wav) == 44
+    assert len(parse_wav(wav)[1]) == 0
+
+
+def test_synthesize_wav_uses_the_model_output_rate():
+    model = SimpleNamespace(
+        tts=lambda text: [0.1] * len(text),
+        synthesizer=SimpleNamespace(output_sample_rate=24000),
+    )
+    fmt, frames = parse_wav(synthesize_wav(model, "olá"))
+    assert fmt.sample_rate == 24000
+    assert len(frames) == 2 * len("olá")
+
+
+def pcm_wav(values, rate=16000):
+    return wav_bytes(np.array(values, dtype=np.float32), rate)
+
+
+def test_concat_wavs_keeps_order_and_inserts_the_gap():
+    joined = concat_wavs([pcm_wav([1.0, 1.0]), pcm_wav([-1.0])], gap_ms=0.25)
+    fmt, frames = parse_wav(joined)
+    assert fmt == WavFormat(1, 16000, 16)
+    assert np.frombuffer(frames, dtype="<i2").tolist() == [32767, 32767, 0, 0, 0, 0, -32767]
+
+
+def test_concat_wavs_rejects_mixed_formats():
+    with pytest.raises(ValueError):
+        concat_wavs([pcm_wav([1.0], 16000), pcm_wav([1.0], 22050)])
+
+
+def synthesizer(calls, delays=None):
+    async def synthesize(text):
+        calls.append(("start", text))
+        await asyncio.sleep((delays or {}).get(text, 0))
+        calls.append(("end", text))
+        return pcm_wav([0.5] * len(text))
+
+    return synthesize
+
+
+def test_sentences_are_synthesized_at_once_and_joined_in_order(monkeypatch):
+    monkeypatch.setattr(tts_audio, "SENTENCE_PARALLEL", True)
+    calls = []
+    text = "A poupança rende pouco este ano. O CDB rende mais."
+    wav = asyncio.run(synthesize_text(synthesizer(calls, {"A poupança rende pouco este ano.": 0.02}), text))
+    # Both started before the first one finished
+    assert [c[0] for c in calls[:2]] == ["start", "start"]
+    _, frames = parse_wav(wav)
+    assert len(frames) == 2 * (len("A poupança rende pouco este ano.") + len("O CDB rende mais."))
+
+
+def test_without_sentence_parallel_the_text_is_one_call(monkeypatch):
+    monkeypatch.setattr(tts_audio, "SENTENCE_PARALLEL", False)
+    calls = []
+    text = "A poupança rende pouco este ano. O CDB rende mais."
+    asyncio.run(synthesize_text(synthesizer(calls), text))
+    assert calls == [("start", text), ("end", text)]
+
+
+def test_sentence_wavs_drops_pending_jobs_when_the_consumer_stops(monkeypatch):
+    monkeypatch.setattr(tts_audio, "SENTENCE_PARALLEL", True)
+    calls = []
+    sentences = ["Primeira frase.", "Segunda frase.", "Terceira frase."]
+
+    async def scenario():
+        wavs = sentence_wavs(synthesizer(calls, {s: 0.05 for s in sentences[1:]}), sentences)
+        first = await wavs.__anext__()
+        await wavs.aclose()
+        await asyncio.sleep(0.1)
+        return first
+
+    assert parse_wav(asyncio.run(scenario()))[0].sample_rate == 16000
+    assert ("end", "Primeira frase.") in calls
+    assert ("end", "Segunda frase.") not in calls and ("end", "Terceira frase.") not in calls
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from vad import SAMPLE_RATE, speech_segments  # noqa: E402
+
+SR = SAMPLE_RATE
+
+
+def background(seconds: float, level: float = 1e-4) -> np.ndarray:
+    return (np.random.default_rng(0).standard_normal(int(seconds * SR)) * level).astype(np.float32)
+
+
+def speak(audio: np.ndarray, start: float, end: float) -> np.ndarray:
+    """Add a voiced stretch: a 200 Hz tone with syllable-rate amplitude modulation."""
+    t = np.arange(int(start * SR), int(end * SR)) / SR
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    audio[int(start * SR):int(end * SR)] += (0.3 * envelope * np.sin(2 * np.pi * 200 * t)).astype(np.float32)
+    return audio
+
+
+def seconds(segments):
+    return [(round(lo / SR, 2), round(hi / SR, 2)) for lo, hi in segments]
+
+
+def test_silence_has_no_segments():
+    assert speech_segments(np.zeros(5 * SR, dtype=np.float32)) == []
+    assert speech_segments(background(5)) == []
+    assert speech_segments(np.zeros(100, dtype=np.float32)) == []
+
+
+def test_speech_is_found_and_padded():
+    audio = speak(speak(background(6), 1.0, 2.0), 3.5, 4.5)
+    segments = seconds(speech_segments(audio, pad=0.2))
+    assert len(segments) == 2
+    for (lo, hi), (start, end) in zip(segments, [(1.0, 2.0), (3.5, 4.5)]):
+        assert start - 0.25 <= lo <= start - 0.15
+        assert end + 0.15 <= hi <= end + 0.25
+
+
+def test_short_pause_is_bridged():
+    audio = speak(speak(background(4), 1.0, 2.0), 2.3, 3.0)
+    assert len(speech_segments(audio, min_silence=0.5)) == 1
+    assert len(speech_segments(audio, min_silence=0.1, pad=0.0)) == 2
+
+
+def test_short_blip_is_dropped():
+    audio = speak(speak(background(4), 1.0, 2.0), 3.0, 3.1)
+    segments = seconds(speech_segments(audio, min_speech=0.25))
+    assert len(segments) == 1
+    assert segments[0][1] < 2.5
+
+
+def test_speech_from_start_to_end_is_kept():
+    audio = speak(background(3), 0.0, 3.0)
+    assert seconds(speech_segments(audio, pad=0.2)) == [(0.0, 3.0)]
+
+
+def test_long_speech_is_split_into_whisper_windows():
+    audio = speak(background(70), 0.0, 70.0)
+    segments = speech_segments(audio, max_segment=30.0)
+    assert len(segments) >= 3
+    assert all(hi - lo <= 30 * SR for lo, hi in segments)
+    # Contiguous: splitting loses no audio
+    assert segments[0][0] == 0 and segments[-1][1] == len(audio)
+    assert all(a[1] == b[0] for a, b in zip(segments, segments[1:]))
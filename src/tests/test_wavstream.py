@@ -0,0 +1,59 @@
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from wavstream import STREAM_SIZE, WavFormat, WavStreamWriter, parse_wav, wav_header  # noqa: E402
+
+FMT = WavFormat(1, 22050, 16)
+
+
+def wav(pcm: bytes, fmt: WavFormat = FMT) -> bytes:
+    return wav_header(fmt, len(pcm)) + pcm
+
+
+def test_header_layout():
+    header = wav_header(FMT, 1000)
+    assert len(header) == 44
+    riff, riff_size, wave, fmt_id, fmt_size, tag, channels, rate, byte_rate, align, bits, data_id, data_size = struct.unpack(
+        "<4sI4s4sIHHIIHH4sI", header
+    )
+    assert (riff, wave, fmt_id, data_id) == (b"RIFF", b"WAVE", b"fmt ", b"data")
+    assert (riff_size, fmt_size, tag, data_size) == (1036, 16, 1, 1000)
+    assert (channels, rate, bits, align, byte_rate) == (1, 22050, 16, 2, 44100)
+
+
+def test_streaming_header_has_unknown_sizes():
+    header = wav_header(FMT)
+    assert struct.unpack_from("<I", header, 4)[0] == STREAM_SIZE
+    assert struct.unpack_from("<I", header, 40)[0] == STREAM_SIZE
+    # Players read a stream header as running to the end of the data
+    fmt, frames = parse_wav(header + b"\x01\x00\x02\x00")
+    assert fmt == FMT
+    assert bytes(frames) == b"\x01\x00\x02\x00"
+
+
+def test_writer_sends_one_header_then_raw_frames():
+    writer = WavStreamWriter()
+    first = writer.chunk(wav(b"\x01\x00" * 4))
+    second = writer.chunk(wav(b"\x02\x00" * 3))
+    assert first == wav_header(FMT) + b"\x01\x00" * 4
+    assert second == b"\x02\x00" * 3
+    _, frames = parse_wav(first + second)
+    assert bytes(frames) == b"\x01\x00" * 4 + b"\x02\x00" * 3
+
+
+def test_writer_skips_extra_chunks_of_its_inputs():
+    pcm = b"\x03\x00" * 2
+    riff = b"WAVE" + wav_header(FMT, len(pcm))[12:36] + b"LIST" + struct.pack("<I", 3) + b"abc\x00" + b"data" + struct.pack("<I", len(pcm)) + pcm
+    data = b"RIFF" + struct.pack("<I", len(riff)) + riff
+    assert WavStreamWriter().chunk(data)[44:] == pcm
+
+
+def test_writer_rejects_a_format_change():
+    writer = WavStreamWriter()
+    writer.chunk(wav(b"\x00\x00"))
+    with pytest.raises(ValueError):
+        writer.chunk(wav(b"\x00\x00", WavFormat(1, 16000, 16)))
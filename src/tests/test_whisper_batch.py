@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from whisper_batch import WINDOW, transcribe_batch  # noqa: E402
+
+
+class FakeEngine:
+    def __init__(self):
+        self.transcribed = 0
+        self.windows = 0
+
+    def transcribe(self, audio):
+        self.transcribed += 1
+        return f"full:{len(audio)}"
+
+    def decode_windows(self, windows):
+        self.windows += len(windows)
+        return [f"[{len(w)}]" for w in windows]
+
+
+def test_single_request_keeps_transcribe():
+    engine = FakeEngine()
+    audio = np.zeros(3 * WINDOW, dtype=np.float32)
+    assert transcribe_batch(engine, [audio], max_batch=8) == [f"full:{len(audio)}"]
+    assert (engine.transcribed, engine.windows) == (1, 0)
+
+
+def test_batched_requests_are_windowed():
+    engine = FakeEngine()
+    audios = [np.zeros(WINDOW + WINDOW // 2, dtype=np.float32), np.zeros(WINDOW // 2, dtype=np.float32)]
+    texts = transcribe_batch(engine, audios, max_batch=8)
+    assert texts == [f"[{WINDOW}][{WINDOW // 2}]", f"[{WINDOW // 2}]"]
+    assert (engine.transcribed, engine.windows) == (0, 3)
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+from workers import ModelPool, PoolBusy, pool_from_env  # noqa: E402
+
+
+class Model:
+    loads = 0
+
+    def __init__(self):
+        Model.loads += 1
+        self.index = Model.loads
+
+
+# Jobs are module-level functions, as process replicas need to pickle them
+def whoami(model):
+    return model.index, threading.current_thread().name, os.getpid()
+
+
+def sleep_and_tag(model, seconds):
+    time.sleep(seconds)
+    return model.index
+
+
+def count_up(model, n):
+    for i in range(n):
+        yield i
+
+
+def fail(model):
+    raise ValueError("bad input")
+
+
+def test_each_replica_has_its_own_model_and_thread():
+    Model.loads = 0
+    pool = ModelPool("test", Model, replicas=2)
+    results = [pool.submit(sleep_and_tag, 0.05) for _ in range(2)]
+    assert sorted(f.result() for f in results) == [1, 2]
+    index, thread, pid = pool.call(whoami)
+    assert thread.startswith("test-replica-")
+    assert pid == os.getpid()
+    assert Model.loads == 2
+
+
+def test_replicas_run_jobs_in_parallel():
+    pool = ModelPool("test", Model, replicas=4)
+    started = time.monotonic()
+    for future in [pool.submit(sleep_and_tag, 0.2) for _ in range(4)]:
+        future.result()
+    assert time.monotonic() - started < 0.6
+
+
+def test_run_keeps_the_event_loop_free():
+    pool = ModelPool("test", Model)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await pool.run(sleep_and_tag, 0.2)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+
+
+def test_full_queue_raises_pool_busy():
+    pool = ModelPool("test", Model, queue_size=1)
+    running = pool.submit(sleep_and_tag, 0.2)
+    while pool.stats()["per_replica"][0]["active"] == 0:
+        time.sleep(0.001)
+    waiting = pool.submit(sleep_and_tag, 0)
+    with pytest.raises(PoolBusy):
+        pool.submit(sleep_and_tag, 0)
+    running.result()
+    waiting.result()
+    assert pool.stats()["rejected"] == 1
+
+
+def test_errors_reach_the_caller():
+    pool = ModelPool("test", Model)
+    with pytest.raises(ValueError):
+        pool.call(fail)
+    assert pool.stats()["per_replica"][0]["errors"] == 1
+    assert pool.call(sleep_and_tag, 0) is not None
+
+
+def test_generator_jobs_stream_their_items():
+    pool = ModelPool("test", Model)
+
+    async def consume():
+        return [item async for item in pool.stream(count_up, 3)]
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+    assert list(pool.iterate(count_up, 4)) == [0, 1, 2, 3]
+
+
+def test_failed_load_fails_every_job():
+    def broken():
+        raise OSError("model file missing")
+
+    pool = ModelPool("test", broken)
+    assert pool.failed
+    with pytest.raises(RuntimeError, match="model not loaded"):
+        pool.call(whoami)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="process replicas fork")
+def test_process_replicas_run_outside_this_process():
+    pool = ModelPool("test", Model, mode="process")
+    _, _, pid = pool.call(whoami)
+    assert pid != os.getpid()
+    assert list(pool.iterate(count_up, 3)) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        pool.call(fail)
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("TEST_REPLICAS", "3")
+    monkeypatch.setenv("TEST_QUEUE_SIZE", "0")
+    pool = pool_from_env("test", "TEST", Model)
+    assert (pool.replicas, pool.queue_size, pool.mode) == (3, 0, "thread")
+    monkeypatch.setenv("TEST_WORKERS_MODE", "gpu")
+    with pytest.raises(ValueError):
+        pool_from_env("test", "TEST", Model)
+
+
+def test_background_replicas_take_jobs_once_loaded():
+    loading = threading.Event()
+
+    def slow_load():
+        loading.wait(5)
+        return Model()
+
+    pool = ModelPool("test", slow_load, background=True)
+    pool.start()
+    # The server can already listen: nothing loaded, nothing failed, jobs wait in the queue
+    assert pool.available == 0 and not pool.failed
+    future = pool.submit(sleep_and_tag, 0)
+    time.sleep(0.05)
+    assert not future.done()
+    loading.set()
+    assert future.result(5) is not None
+    assert pool.available == 1
+
+
+def test_background_load_failure_is_reported():
+    def broken():
+        raise OSError("model file missing")
+
+    pool = ModelPool("test", broken, background=True)
+    pool.start()
+    deadline = time.monotonic() + 5
+    while not pool.failed:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    assert pool.available == 0
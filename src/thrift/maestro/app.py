@@ -1,12 +1,18 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
 from fastapi.responses import StreamingResponse
 import io
 import os
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from typing import Optional, Tuple
+
 import thriftpy2
-from thriftpy2.rpc import make_client
+
+from cache import cache_from_env, make_key
+from pipeline import stream_sentence_audio
+from thrift_pool import AsyncThriftPool
+import thrift_wire
 
 # Logger setup
 logger = logging.getLogger("mpes-maestro")
@@ -31,123 +37,243 @@ def _parse_host_port(addr: str):
 
 # Concurrency config
 CONCURRENCY_LIMIT = int(os.getenv("MAESTRO_MAX_CONCURRENCY", "100"))
+# Read size when hashing uploads for the pipeline cache key
+UPLOAD_CHUNK_SIZE = int(os.getenv("MAESTRO_UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Sentences synthesized in parallel per request in streaming mode
+TTS_PARALLEL = int(os.getenv("MAESTRO_TTS_PARALLEL", "4"))
+# Longest wait of one GenerateNext long poll for LLM text in streaming mode
+LLM_POLL_WAIT_MS = int(os.getenv("MAESTRO_LLM_POLL_WAIT_MS", "5000"))
+
+# Sampling settings sent with every LLM request
+LLM_PARAMS = {
+    "max_tokens": 256,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "top_k": 40,
+    "repeat_penalty": 1.1,
+    "presence_penalty": 0.0,
+    "frequency_penalty": 0.0,
+}
+
+# End-to-end cache: final WAV by audio content hash + everything else that shapes
+# the answer. Limits from MAESTRO_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL (0 entries disables it);
+# bump MAESTRO_CACHE_NAMESPACE after changing settings on the services themselves.
+PIPELINE_CACHE = cache_from_env("maestro", "MAESTRO_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
+PIPELINE_PARAMS = {
+    "namespace": os.getenv("MAESTRO_CACHE_NAMESPACE", ""),
+    "stt_model": os.getenv("WHISPER_MODEL_SIZE", "small"),
+    "llm_model": os.getenv("LLM_MODEL_ID", "Meta-Llama-3-8B-Instruct.Q5_K_S"),
+    "llm_params": LLM_PARAMS,
+    "tts_model": os.getenv("TTS_MODEL_ID", "tts_models/pt/cv/vits"),
+}
+
+# Connection pool per downstream service
+POOL_MIN_SIZE = int(os.getenv("THRIFT_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("THRIFT_POOL_MAX_SIZE", str(CONCURRENCY_LIMIT)))
+POOL_MAX_IDLE = float(os.getenv("THRIFT_POOL_MAX_IDLE", "60"))
+THRIFT_TIMEOUT_MS = int(os.getenv("THRIFT_TIMEOUT_MS", "300000"))  # 5 min to tolerate long audios
+
+def _make_pool(service, addr: str) -> AsyncThriftPool:
+    host, port = _parse_host_port(addr)
+    return AsyncThriftPool(
+        service,
+        host,
+        port,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_idle=POOL_MAX_IDLE,
+        timeout=THRIFT_TIMEOUT_MS,
+        # Must match the services: both read THRIFT_PROTOCOL/THRIFT_TRANSPORT from thrift.env
+        **thrift_wire.aio_factories(),
+    )
 
 @app.on_event("startup")
 async def on_startup():    
-    # Concurrency guard and worker pool (one thread per request up to limit)
+    # Concurrency guard to avoid too many in-flight requests
     app.state.sem = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    app.state.executor = ThreadPoolExecutor(max_workers=CONCURRENCY_LIMIT)
-    # Thrift clients (LLM/TTS persistent). STT will be per-request to avoid idle socket timeouts
-    stt_host, stt_port = _parse_host_port(STT_ADDR)
-    app.state.stt_host = stt_host
-    app.state.stt_port = stt_port
-    llm_host, llm_port = _parse_host_port(LLM_ADDR)
-    app.state.llm_host = llm_host
-    app.state.llm_port = llm_port
-    tts_host, tts_port = _parse_host_port(TTS_ADDR)
-    app.state.tts_host = tts_host
-    app.state.tts_port = tts_port
+    # Persistent asyncio Thrift clients, pooled per downstream
+    app.state.stt_pool = _make_pool(STT_THRIFT.STTService, STT_ADDR)
+    app.state.llm_pool = _make_pool(LLM_THRIFT.LLMService, LLM_ADDR)
+    app.state.tts_pool = _make_pool(TTS_THRIFT.TTSService, TTS_ADDR)
+    logger.info(f"Thrift wire format: {thrift_wire.describe()}")
+    for pool in (app.state.stt_pool, app.state.llm_pool, app.state.tts_pool):
+        await pool.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for pool in (app.state.stt_pool, app.state.llm_pool, app.state.tts_pool):
+        await pool.close()
 
 @app.get("/health")
 def health():
     return {"status": "healthy"}
 
-def _run_pipeline(content: bytes, filename: str, content_type: str, state) -> bytes:
-    # STT client per request
-    stt_client = make_client(
-        STT_THRIFT.STTService,
-        state.stt_host,
-        state.stt_port,
-        timeout=300000,  # 5 min to tolerate long audios
+@app.get("/stats")
+def stats():
+    return {
+        "stt_pool": app.state.stt_pool.stats(),
+        "llm_pool": app.state.llm_pool.stats(),
+        "tts_pool": app.state.tts_pool.stats(),
+        "pipeline_cache": PIPELINE_CACHE.stats(),
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    return PIPELINE_CACHE.stats()
+
+async def _read_upload(file: UploadFile) -> Tuple[str, bytes]:
+    # Hash the spooled upload in chunks; the pipeline gets the bytes, not the file,
+    # since FastAPI closes the file when the request ends and a cached computation can outlive it
+    digest = hashlib.md5()
+    chunks = []
+    while True:
+        data = await file.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        digest.update(data)
+        chunks.append(data)
+    return make_key(digest.hexdigest(), PIPELINE_PARAMS), b"".join(chunks)
+
+def _cache_enabled(bypass: Optional[str]) -> bool:
+    return PIPELINE_CACHE.maxsize > 0 and (bypass or "").lower() not in ("1", "true", "yes")
+
+async def _run_stt(content: bytes, filename: str, content_type: str) -> str:
+    stt_reply = await app.state.stt_pool.call(
+        "Transcribe",
+        content,
+        filename or "audio.wav",
+        content_type or "audio/wav",
     )
-    try:
-        stt_reply = stt_client.Transcribe(
-            content,
-            filename or "audio.wav",
-            content_type or "audio/wav",
-        )
-    finally:
-        try:
-            stt_client.close()
-        except Exception:
-            pass
     if getattr(stt_reply, "error", ""):
         raise RuntimeError(f"STT error: {stt_reply.error}")
-    stt_text = stt_reply.text
-    logger.info(f"STT result: {stt_text}")
-
-    # LLM client per request
-    llm_client = make_client(
-        LLM_THRIFT.LLMService,
-        state.llm_host,
-        state.llm_port,
-        timeout=300000,  # 5 min
-    )
-    try:
-        llm_req = LLM_THRIFT.GenRequest(
-            prompt=stt_text,
-            max_tokens=256,
-            temperature=0.7,
-            top_p=0.9,
-            top_k=40,
-            repeat_penalty=1.1,
-            presence_penalty=0.0,
-            frequency_penalty=0.0,
-        )
-        llm_reply = llm_client.Generate(llm_req)
-    finally:
-        try:
-            llm_client.close()
-        except Exception:
-            pass
+    logger.info(f"STT result: {stt_reply.text}")
+    return stt_reply.text
+
+
+async def _run_stt_llm(content: bytes, filename: str, content_type: str) -> str:
+    stt_text = await _run_stt(content, filename, content_type)
+    llm_req = LLM_THRIFT.GenRequest(prompt=stt_text, **LLM_PARAMS)
+    llm_reply = await app.state.llm_pool.call("Generate", llm_req)
     if getattr(llm_reply, "error", ""):
         raise RuntimeError(f"LLM error: {llm_reply.error}")
     generated = llm_reply.generated
     logger.info(f"LLM result: {generated}")
+    return generated
 
-    # TTS client per request
-    tts_client = make_client(
-        TTS_THRIFT.TTSService,
-        state.tts_host,
-        state.tts_port,
-        timeout=300000,  # 5 min
-    )
-    try:
-        tts_reply = tts_client.Synthesize(generated)
-    finally:
-        try:
-            tts_client.close()
-        except Exception:
-            pass
+
+async def _run_tts(text: str) -> bytes:
+    tts_reply = await app.state.tts_pool.call("Synthesize", text)
     if getattr(tts_reply, "error", ""):
         raise RuntimeError(f"TTS error: {tts_reply.error}")
     return tts_reply.audio
 
 
+async def _run_pipeline(content: bytes, filename: str, content_type: str) -> bytes:
+    generated = await _run_stt_llm(content, filename, content_type)
+    return await _run_tts(generated)
+
+
+async def _llm_deltas(prompt: str):
+    """Yield text deltas as the LLM decodes them, long-polling GenerateNext on one pooled connection."""
+    llm_req = LLM_THRIFT.GenRequest(prompt=prompt, **LLM_PARAMS)
+    async with app.state.llm_pool.session() as client:
+        stream_id = await client.GenerateOpen(llm_req)
+        while True:
+            chunk = await client.GenerateNext(stream_id, LLM_POLL_WAIT_MS)
+            if chunk.error:
+                raise RuntimeError(f"LLM error: {chunk.error}")
+            if chunk.delta:
+                yield chunk.delta
+            if chunk.done:
+                return
+
+
+async def _assist_stream(content: bytes, filename: str, content_type: str):
+    stt_text = await _run_stt(content, filename, content_type)
+    # Sentences go to TTS while the LLM is still decoding the next ones
+    chunks = stream_sentence_audio(_llm_deltas(stt_text), _run_tts, max_parallel=TTS_PARALLEL)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+async def _stream_body(first: bytes, chunks, sem: asyncio.Semaphore):
+    try:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated stream
+        logger.error(f"Streaming error: {e}")
+    finally:
+        await chunks.aclose()
+        sem.release()
+
+
+async def _assist_once(content: bytes, filename: str, content_type: str) -> bytes:
+    sem: asyncio.Semaphore = app.state.sem
+    async with sem:
+        try:
+            logger.info(f"STT request: {filename}")
+            return await _run_pipeline(content, filename, content_type)
+        except Exception as e:
+            logger.error(f"Request error: {e}")
+            raise HTTPException(status_code=502, detail=str(e))
+
+
 @app.post("/assist")
-async def assist(file: UploadFile = File(...)):
+async def assist(
+    file: UploadFile = File(...),
+    stream: bool = False,
+    x_cache_bypass: Optional[str] = Header(None),
+):
     #log
     logger.info(f"Received file: {file.filename}")    
     sem: asyncio.Semaphore = app.state.sem
-    async with sem:
+    filename, content_type = file.filename, file.content_type
+    if _cache_enabled(x_cache_bypass):
+        key, content = await _read_upload(file)
+    else:
+        key, content = None, await file.read()
+    if stream and key is not None:
+        cached_audio = PIPELINE_CACHE.get(key)
+        if cached_audio is not None:
+            # The whole answer is already known: send it at once instead of streaming
+            return StreamingResponse(io.BytesIO(cached_audio), media_type="audio/wav", headers={"X-Cache": "HIT"})
+    if stream:
+        # Sentence-level streaming: audio starts after the first sentence is synthesized
+        await sem.acquire()
+        chunks = _assist_stream(content, filename, content_type)
         try:
-            content = await file.read()
-            logger.info(f"STT request: {file.filename}")
-            loop = asyncio.get_running_loop()
-            audio_bytes = await loop.run_in_executor(
-                app.state.executor,
-                _run_pipeline,
-                content,
-                file.filename or "audio.wav",
-                file.content_type or "audio/wav",
-                app.state,
-            )
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            sem.release()
+            raise HTTPException(status_code=502, detail="Empty response from pipeline")
         except Exception as e:
+            sem.release()
             logger.error(f"Request error: {e}")
             raise HTTPException(status_code=502, detail=str(e))
+        return StreamingResponse(_stream_body(first, chunks, sem), media_type="audio/wav")
+
+    if key is None:
+        audio_bytes = await _assist_once(content, filename, content_type)
+        cache_status = "BYPASS"
+    else:
+        computed = False
+
+        async def compute() -> bytes:
+            nonlocal computed
+            computed = True
+            return await _assist_once(content, filename, content_type)
+
+        # Hits skip all three services; identical concurrent uploads share one pipeline run
+        audio_bytes = await PIPELINE_CACHE.get_or_compute(key, compute)
+        cache_status = "MISS" if computed else "HIT"
 
     # Stream back WAV audio
-    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav")
+    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/wav", headers={"X-Cache": cache_status})
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,29 +1,62 @@
 # File: LLM Thrift server
 import logging
+import asyncio
 import os
 import hashlib
 import json
-from functools import wraps
+import threading
+import time
+import uuid
 
 import thriftpy2
-from thriftpy2.rpc import make_server
-import torch
 from llama_cpp import Llama
 
+from cache import cache_from_env, cached, log_stats
+from gen_control import GenerationController, budget_settings, collect, controlled
+from kv_prefix import prime, restore
+from llm_batch import SLOTS, BatchEngine
+from llm_startup import device, load_params, warm_up
+from semantic_cache import semantic_cache_from_env
+from speculative import DRAFT_STATS, draft_from_env
+from thrift_server import run_coroutine, serve as serve_thrift
+from workers import pool_from_env
+
 logger = logging.getLogger("mpes-llm-thrift")
 logging.basicConfig(level=logging.INFO)
 
 MODEL_PATH = "./models/Meta-Llama-3-8B-Instruct.Q5_K_S.gguf"
 CTX = 512
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+SYSTEM_PROMPT = """
+            Você é um assistente financeiro. 
+            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
+            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
+            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
+            
+            """.strip()
+# From llama.cpp itself, without importing torch
+DEVICE = device()
 logger.info(f"Device: {DEVICE}")
-try:
+
+def _load_model() -> Llama:
     logger.info(f"Loading LLaMA from {MODEL_PATH}")
-    model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1)
+    # LLM_DRAFT: speculative decoding, verified by this model (plain replicas only, see llm_batch)
+    draft = draft_from_env(CTX) if SLOTS == 1 else None
+    model = Llama(model_path=MODEL_PATH, n_ctx=CTX, device=DEVICE, n_gpu_layers=-1, draft_model=draft, **load_params())
     logger.info("Model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    model = None
+    if SLOTS > 1:
+        # LLM_SLOTS requests decoded together in one context, system prompt shared between them
+        model = BatchEngine(model)
+    else:
+        # The system prompt is evaluated once here, not on every request (LLM_PREFIX_SNAPSHOT)
+        prime(model, SYSTEM_PROMPT)
+    # The replica is ready only after a short generation, which the first request would pay for otherwise
+    warm_up(model, SYSTEM_PROMPT)
+    return model
+
+# Llama is not thread-safe: each replica's model is used by its own worker only (a
+# BatchEngine by LLM_SLOTS workers), and handler threads queue jobs for them.
+# LLM_REPLICAS/LLM_WORKERS_MODE/LLM_QUEUE_SIZE
+POOL = pool_from_env("llm", "LLM", _load_model, concurrency=SLOTS)
 
 # Load Thrift IDL
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,47 +72,39 @@ def _generate_cache_key(req) -> str:
         "repeat_penalty": req.repeat_penalty,
         "presence_penalty": req.presence_penalty,
         "frequency_penalty": req.frequency_penalty,
+        # A budget cuts the answer, so changing one must not serve answers cut by the old one
+        "budgets": budget_settings(),
     }
     return hashlib.md5(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
 
-def async_lru_cache(maxsize: int = 1000):
-    cache = {}
-    queue = []
-
-    def decorator(fn):
-        from asyncio import get_event_loop, iscoroutine
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            if key in cache:
-                return cache[key]
-            result = await fn(*args, **kwargs)
-            if len(queue) >= maxsize:
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-            cache[key] = result
-            queue.append(key)
-            return result
-
-        return wrapper
-    return decorator
-
-@async_lru_cache(maxsize=1000)
-async def _cached_generate(cache_key: str, req) -> str:
-    if model is None:
-        raise RuntimeError("Model not loaded")
-    messages = [
-            {"role": "system", "content": """
-            Você é um assistente financeiro. 
-            Responda apenas com informações e conselhos estritamente relacionados ao contexto financeiro solicitado. 
-            Você falará sempre em português brasileiro, usando linguagem clara e simples, com números exatos e sem arredondamentos.
-            Apenas responda. Não faça novas perguntas. Responda em um único parágrafo, com até 50 palavras.
-            
-            """.strip()},
-        {"role": "user", "content": req.prompt},
+# Generations keyed by _generate_cache_key; limits from LLM_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL.
+# Shared by all handler threads, with single-flight across them.
+GENERATIONS = cache_from_env("llm", "LLM_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024)
+# Answers of earlier prompts, matched by embedding after an exact miss: LLM_SEMANTIC_CACHE*
+SEMANTIC = semantic_cache_from_env("LLM_SEMANTIC_CACHE", "./models/multilingual-e5-small-q8_0.gguf")
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
+# Open GenerateOpen/GenerateNext streams; one not polled for STREAM_TTL seconds is stopped, freeing its replica
+STREAM_TTL = float(os.getenv("LLM_STREAM_TTL", "30"))
+
+# Decoding stops as soon as the answer fills its budget (LLM_MAX_WORDS, LLM_DEADLINE, ...) or looks empty
+def _complete(model: Llama, messages: list, params: dict) -> tuple:
+    """(answer, finish reason)"""
+    restore(model, messages)
+    return collect(model.create_chat_completion(messages=messages, stream=True, **params), GenerationController())
+
+def _complete_stream(model: Llama, messages: list, params: dict):
+    """Yield the streamed chunks, cut where the answer fills its budget."""
+    restore(model, messages)
+    yield from controlled(model.create_chat_completion(messages=messages, stream=True, **params), GenerationController())
+
+def _build_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
     ]
-    out = model.create_chat_completion(
-        messages=messages,
+
+def _sampling_params(req) -> dict:
+    return dict(
         max_tokens=req.max_tokens or 256,
         temperature=req.temperature or 0.7,
         top_p=req.top_p or 0.9,
@@ -88,26 +113,166 @@ async def _cached_generate(cache_key: str, req) -> str:
         presence_penalty=req.presence_penalty or 0.0,
         frequency_penalty=req.frequency_penalty or 0.0,
     )
-    text = out["choices"][0]["message"]["content"].strip()
+
+def _semantic_scope(req) -> str:
+    """What a semantic hit must share with the request besides the meaning: the sampling params and budgets."""
+    return json.dumps({**_sampling_params(req), "budgets": budget_settings()}, sort_keys=True)
+
+def _semantic_lookup(cache_key: str, req):
+    """The cached answer to a paraphrase of the prompt, unless the exact cache has one."""
+    if req.bypass_semantic_cache or not SEMANTIC.enabled or cache_key in GENERATIONS:
+        return None
+    hit = SEMANTIC.lookup(req.prompt, _semantic_scope(req))
+    if hit is None:
+        return None
+    answer, provenance = hit
+    logger.info(f"Semantic cache hit ({provenance['similarity']}) for prompt: {req.prompt[:50]}... "
+                f"<- {provenance['source_prompt'][:50]}")
+    return answer
+
+@cached(GENERATIONS, key_fn=lambda cache_key, req: cache_key)
+async def _cached_generate(cache_key: str, req) -> str:
+    if POOL.failed:
+        raise RuntimeError("Model not loaded")
+    messages = _build_messages(req.prompt)
+    max_retries = 3
+    text = ""
+    for attempt in range(max_retries):
+        # With LLM_EMPTY_TOKENS set, an empty answer is given up after that many tokens, so a retry costs little
+        text, finish_reason = await POOL.run(_complete, messages, _sampling_params(req))
+        logger.info(f"Generated response (attempt {attempt+1}, {finish_reason}): {text[:100]}...")
+        if text:
+            break
+        logger.warning(f"Empty response ({finish_reason}), retrying {attempt+1}/{max_retries}")
+
+    if not text:
+        raise RuntimeError("Empty response from model after retries")
+    if SEMANTIC.enabled:
+        # Indexed for paraphrases off the request path (the embedding takes a few ms)
+        asyncio.get_running_loop().run_in_executor(None, SEMANTIC.add, req.prompt, text, _semantic_scope(req), cache_key)
     return text
 
+class _Stream:
+    """Deltas of one background generation, drained by GenerateNext."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._deltas = []
+        self.done = False
+        self.finish_reason = ""
+        self.error = ""
+        self.polled = time.monotonic()
+
+    def put(self, delta: str) -> None:
+        with self._cond:
+            self._deltas.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, finish_reason: str = "", error: str = "") -> None:
+        with self._cond:
+            self.done = True
+            self.finish_reason = finish_reason
+            self.error = error
+            self._cond.notify_all()
+
+    def next(self, wait: float) -> tuple:
+        """(text since the last call, done), waiting up to ``wait`` seconds for some."""
+        with self._cond:
+            self.polled = time.monotonic()
+            self._cond.wait_for(lambda: self._deltas or self.done, timeout=wait)
+            delta = "".join(self._deltas)
+            self._deltas.clear()
+            return delta, self.done
+
+    @property
+    def abandoned(self) -> bool:
+        return time.monotonic() - self.polled > STREAM_TTL
+
+STREAMS = {}
+STREAMS_LOCK = threading.Lock()
+
+def _produce(stream: _Stream, cache_key: str, req) -> None:
+    """Decode ``req`` on a replica, handing each delta to ``stream`` as it is sampled."""
+    parts = []
+    finish_reason = ""
+    chunks = POOL.iterate(_complete_stream, _build_messages(req.prompt), _sampling_params(req))
+    try:
+        for chunk in chunks:
+            if stream.abandoned:
+                logger.warning("Stream not polled anymore, stopping its generation")
+                stream.finish(error="Stream abandoned")
+                return
+            choice = chunk["choices"][0]
+            delta = choice["delta"].get("content")
+            if delta:
+                parts.append(delta)
+                stream.put(delta)
+            finish_reason = choice.get("finish_reason") or finish_reason
+    except Exception as e:
+        logger.exception("Streaming generation error")
+        stream.finish(error=str(e))
+        return
+    finally:
+        # Cancels the replica's job if the loop stopped early
+        chunks.close()
+    text = "".join(parts).strip()
+    if not text:
+        stream.finish(error="Empty response from model")
+        return
+    stream.finish(finish_reason or "stop")
+    logger.info(f"Streamed response ({finish_reason}): {text[:100]}...")
+    _cached_generate.store(text, cache_key, req)
+    if SEMANTIC.enabled:
+        SEMANTIC.add(req.prompt, text, _semantic_scope(req), cache_key)
+
 class LLMServiceHandler:
     def Generate(self, req):
         try:
             cache_key = _generate_cache_key(req)
-            import asyncio
-            generated = asyncio.run(_cached_generate(cache_key, req))
+            generated = _semantic_lookup(cache_key, req) or run_coroutine(_cached_generate(cache_key, req))
             return LLM_THRIFT.GenReply(generated=generated, error="")
         except Exception as e:
             logger.exception("Generation error")
             return LLM_THRIFT.GenReply(generated="", error=str(e))
 
+    def GenerateOpen(self, req):
+        stream = _Stream()
+        cache_key = _generate_cache_key(req)
+        hit = _cached_generate.lookup(cache_key, req) or _semantic_lookup(cache_key, req)
+        if hit is not None:
+            stream.put(hit)
+            stream.finish("stop")
+        elif POOL.failed:
+            stream.finish(error="Model not loaded")
+        else:
+            threading.Thread(target=_produce, args=(stream, cache_key, req), name="llm-stream", daemon=True).start()
+        stream_id = uuid.uuid4().hex
+        with STREAMS_LOCK:
+            # Streams whose client went away without draining them
+            for stale in [sid for sid, s in STREAMS.items() if s.abandoned]:
+                del STREAMS[stale]
+            STREAMS[stream_id] = stream
+        return stream_id
+
+    def GenerateNext(self, stream_id: str, wait_ms: int):
+        with STREAMS_LOCK:
+            stream = STREAMS.get(stream_id)
+        if stream is None:
+            return LLM_THRIFT.GenChunk(done=True, error=f"Unknown stream {stream_id}")
+        delta, done = stream.next(max(wait_ms, 0) / 1000)
+        if not done:
+            return LLM_THRIFT.GenChunk(delta=delta)
+        with STREAMS_LOCK:
+            STREAMS.pop(stream_id, None)
+        return LLM_THRIFT.GenChunk(delta=delta, done=True, finish_reason=stream.finish_reason, error=stream.error)
+
 def serve() -> None:
     host = os.getenv("LLM_THRIFT_HOST", "0.0.0.0")
     port = int(os.getenv("LLM_THRIFT_PORT", "50052"))
     logger.info(f"Starting LLM Thrift server on {host}:{port}")
-    server = make_server(LLM_THRIFT.LLMService, LLMServiceHandler(), host, port, client_timeout=0)
-    server.serve()
+    log_stats(CACHE_STATS_INTERVAL, GENERATIONS, SEMANTIC, POOL, DRAFT_STATS)
+    # THRIFT_SERVER_MODE picks threaded/pool/prefork/async, see thrift_server.py
+    serve_thrift(LLM_THRIFT.LLMService, LLMServiceHandler(), host, port, client_timeout=0)
 
 if __name__ == "__main__":
     serve()
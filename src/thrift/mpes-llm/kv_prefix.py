@@ -0,0 +1,101 @@
+# Synced from src/common/kv_prefix.py by syncCommon.sh. DO NOT EDIT.
+"""KV-cache snapshot of the system prompt for the llama.cpp LLM services.
+
+Every request starts with the same system message, so every prompt starts with
+the same tokens: the chat template's header and the system turn. ``prime``
+evaluates them once, when a replica loads its model. It renders the chat twice
+through the model's own template, with two different user turns, so the shared
+prefix is exact whatever the template. It then keeps a ``save_state``
+snapshot cut at that prefix.
+
+``restore`` runs before each completion. llama-cpp-python already skips the
+part of a prompt that matches the tokens in its KV cache. When the cache still
+starts with the prefix (the usual case: the previous request had the same
+system prompt), nothing needs to be done. Otherwise, for example after a long
+prompt or a different system message, the snapshot is loaded back. Only the
+user turn is then evaluated, never the system prompt.
+
+Snapshots are per model instance, so reloading a model invalidates them. They
+are also tied to the system prompt text: a request with another system message
+primes a new snapshot, which replaces the old one.
+
+Setting: ``LLM_PREFIX_SNAPSHOT`` (default 1).
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger("kv-prefix")
+
+ENABLED = os.getenv("LLM_PREFIX_SNAPSHOT", "1").lower() in ("1", "true", "yes")
+
+
+class SystemPrefix:
+    def __init__(self, system_prompt: str, tokens: np.ndarray, state):
+        self.system_prompt = system_prompt
+        self.tokens = tokens
+        self.state = state
+
+
+# model -> its snapshot; a model that is garbage collected takes its snapshot along
+_PREFIXES: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _evaluated(model) -> np.ndarray:
+    return np.array(model.input_ids[: model.n_tokens], copy=True)
+
+
+def prime(model, system_prompt: str) -> Optional[SystemPrefix]:
+    """Evaluate the system prompt's tokens on ``model`` and snapshot its KV state."""
+    if not ENABLED:
+        return None
+    started = time.perf_counter()
+    rendered = []
+    for user in ("a", "b"):
+        model.create_chat_completion(
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user}],
+            max_tokens=1,
+            temperature=0.0,
+        )
+        rendered.append(_evaluated(model))
+    first, second = rendered
+    n = min(len(first), len(second))
+    differ = np.flatnonzero(first[:n] != second[:n])
+    shared = int(differ[0]) if len(differ) else n
+    if shared == 0:
+        logger.warning("System prompt snapshot skipped: the two renderings share no tokens")
+        return None
+    # The KV cache holds the second rendering; keep only the shared part. Cells past
+    # n_tokens are dropped by llama.cpp on the next evaluation.
+    model.n_tokens = shared
+    prefix = SystemPrefix(system_prompt, second[:shared], model.save_state())
+    with _lock:
+        _PREFIXES[model] = prefix
+    logger.info(f"System prompt snapshot: {shared} tokens primed in {time.perf_counter() - started:.2f}s")
+    return prefix
+
+
+def restore(model, messages: list) -> None:
+    """Make ``model``'s KV cache start with the system prompt of ``messages``."""
+    if not ENABLED or not messages or messages[0].get("role") != "system":
+        return
+    if not hasattr(model, "load_state"):
+        # An llm_batch.BatchEngine shares the system prompt between its slots itself
+        return
+    with _lock:
+        prefix = _PREFIXES.get(model)
+    if prefix is None or prefix.system_prompt != messages[0]["content"]:
+        prefix = prime(model, messages[0]["content"])
+        if prefix is None:
+            return
+    n = len(prefix.tokens)
+    if model.n_tokens >= n and np.array_equal(model.input_ids[:n], prefix.tokens):
+        # Still in the KV cache: llama-cpp-python's prefix matching reuses it as is
+        return
+    model.load_state(prefix.state)
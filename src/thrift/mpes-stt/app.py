@@ -1,44 +1,91 @@
 import logging
 import os
-import tempfile
-import threading
 
-import whisper
 import thriftpy2
-from thriftpy2.rpc import make_server
-import torch
+
+from audio import decode_audio
+from cache import cache_from_env, cached, log_stats
+from disk_cache import store_from_env
+from fingerprint import fingerprints_from_env
+from thrift_server import serve as serve_thrift
+from stt_engine import load_engine, transcript_key, upload_key
+from whisper_batch import VAD, WhisperBatcher
+from workers import pool_from_env
 
 logger = logging.getLogger("mpes-stt-thrift")
 logging.basicConfig(level=logging.INFO)
 
 MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "small")
-MODEL = whisper.load_model(MODEL_SIZE, download_root="./models/")
-TRANSCRIBE_LOCK = threading.Lock()
+LANGUAGE = "pt"
+
+def _load_model():
+    # STT_ENGINE picks the backend (whisper, whisper-int8, ctranslate2), see stt_engine.py
+    return load_engine(MODEL_SIZE, language=LANGUAGE)
+
+# Each replica's model is used by one worker only: handler threads queue their audio
+# and concurrent requests share encoder/decoder passes. STT_REPLICAS/STT_WORKERS_MODE/
+# STT_QUEUE_SIZE size the pool, STT_MAX_BATCH/STT_BATCH_WAIT_MS the batches.
+POOL = pool_from_env("stt", "STT", _load_model)
+BATCHER = WhisperBatcher(POOL)
+
+# Transcripts keyed by decoded audio + model settings, shared by all handler threads with
+# single-flight across them; memory limits from STT_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL, backed
+# by a disk store that survives restarts and is shared by prefork children (STT_CACHE_DIR/_DIR_MAX_BYTES)
+TRANSCRIPTS = cache_from_env(
+    "stt", "STT_CACHE", maxsize=1000, max_bytes=16 * 1024 * 1024,
+    store=store_from_env("stt", "STT_CACHE", "./models/transcripts", max_bytes=256 * 1024 * 1024),
+)
+# Near duplicates (re-encoded, retagged, padded with silence) reuse a transcript after an
+# exact miss: STT_FINGERPRINT=1, STT_FINGERPRINT_THRESHOLD/_MAX_ENTRIES/_MAX_SECONDS
+FINGERPRINTS = fingerprints_from_env("STT_FINGERPRINT")
+# Upload bytes -> transcript key of their PCM, so identical uploads skip decoding:
+# STT_UPLOAD_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL
+UPLOADS = cache_from_env("stt-uploads", "STT_UPLOAD_CACHE", maxsize=10000, max_bytes=2 * 1024 * 1024)
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
 
 # Load Thrift IDL
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STT_THRIFT = thriftpy2.load(os.path.join(BASE_DIR, "thrift", "stt.thrift"), module_name="stt_thrift")
 
+@cached(TRANSCRIPTS, key_fn=lambda key, samples: key)
+def _cached_transcribe(key: str, samples) -> dict:
+    fp, alias = FINGERPRINTS.lookup(samples)
+    result = TRANSCRIPTS.get(alias) if alias else None
+    if result is not None:
+        logger.info(f"Reusing the transcript of a near-duplicate upload (key: {key})")
+        return result
+    # STT_VAD=1: silence is skipped and speech segments are transcribed in parallel
+    text, segments = BATCHER.transcribe_speech(samples)
+    if fp is not None:
+        FINGERPRINTS.add(fp, key)
+    return {"text": text, "segments": segments}
+
+def _known_upload(audio: bytes, content_type: str = ""):
+    """(upload key, cached transcript if these exact bytes were decoded before, or None)."""
+    upload = upload_key(audio, content_type)
+    key = UPLOADS.get(upload)
+    return upload, TRANSCRIPTS.get(key) if key else None
+
+def _transcribe(audio: bytes, content_type: str = "") -> dict:
+    upload, result = _known_upload(audio, content_type)
+    if result is not None:
+        return result
+    # Decoding runs on the handler thread, overlapping with the batch in progress
+    samples = decode_audio(audio, content_type)
+    key = transcript_key(samples, MODEL_SIZE, LANGUAGE, VAD)
+    UPLOADS.set(upload, key)
+    return _cached_transcribe(key, samples)
+
 class STTServiceHandler:
     def Transcribe(self, audio: bytes, filename: str, content_type: str):
         try:
-            suffix = os.path.splitext(filename)[1] if filename else ""
-            # Use a regular file inside a TemporaryDirectory to avoid file locks
-            with tempfile.TemporaryDirectory() as tmpdir:
-                tmp_path = os.path.join(tmpdir, f"audio{suffix or '.wav'}")
-                with open(tmp_path, "wb") as f:
-                    f.write(audio)
-                logger.info(f"Transcribing audio via Thrift, filename={filename}")
-                # Ensure single-threaded access to shared Whisper model and disable fp16 on CPU
-                with TRANSCRIBE_LOCK:
-                    with torch.no_grad():
-                        result = MODEL.transcribe(
-                            tmp_path,
-                            language="pt",
-                            fp16=torch.cuda.is_available(),
-                        )
-                text = result.get("text", "")
-                return STT_THRIFT.TranscribeReply(text=text, error="")
+            logger.info(f"Transcribing audio via Thrift, filename={filename}")
+            result = _transcribe(audio, content_type or "")
+            segments = [
+                STT_THRIFT.Segment(start_time=s["start"], end_time=s["end"], text=s["text"])
+                for s in result["segments"]
+            ]
+            return STT_THRIFT.TranscribeReply(text=result["text"], error="", segments=segments)
         except Exception as e:
             logger.exception("Transcription error")
             return STT_THRIFT.TranscribeReply(text="", error=str(e))
@@ -47,8 +94,9 @@ def serve() -> None:
     host = os.getenv("STT_THRIFT_HOST", "0.0.0.0")
     port = int(os.getenv("STT_THRIFT_PORT", os.getenv("STT_GRPC_PORT", "50051")))
     logger.info(f"Starting STT Thrift server on {host}:{port}")
-    server = make_server(STT_THRIFT.STTService, STTServiceHandler(), host, port, client_timeout=0)
-    server.serve()
+    log_stats(CACHE_STATS_INTERVAL, TRANSCRIPTS, UPLOADS, FINGERPRINTS, BATCHER, POOL)
+    # THRIFT_SERVER_MODE picks threaded/pool/prefork/async, see thrift_server.py
+    serve_thrift(STT_THRIFT.STTService, STTServiceHandler(), host, port, client_timeout=0)
 
 if __name__ == "__main__":
     serve()
@@ -1,14 +1,20 @@
 import logging
 import os
-import tempfile
-from pathlib import Path
+import threading
+import time
+import uuid
 import hashlib
 import json
-from functools import wraps
 
 from TTS.api import TTS as CoquiTTS
 import thriftpy2
-from thriftpy2.rpc import make_server
+
+from cache import cache_from_env, cached, log_stats
+from textseg import split_sentences
+from tts_audio import set_threads, synthesize_text, synthesize_wav
+from thrift_server import run_coroutine, serve as serve_thrift
+from wavstream import WavStreamWriter
+from workers import pool_from_env
 
 logger = logging.getLogger("mpes-tts-thrift")
 logging.basicConfig(level=logging.INFO)
@@ -16,49 +22,42 @@ logging.basicConfig(level=logging.INFO)
 # Load Coqui TTS model (Portuguese)
 MODEL_ID = os.getenv("TTS_MODEL_ID", "tts_models/pt/cv/vits")
 logger.info(f"Loading TTS model: {MODEL_ID}")
-try:
-    tts = CoquiTTS(MODEL_ID)
+
+def _load_model() -> CoquiTTS:
+    set_threads()
+    model = CoquiTTS(MODEL_ID)
     logger.info("TTS model loaded")
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
-    tts = None
+    return model
+# Coqui models are not thread-safe: each replica's model is used by its own worker only,
+# and handler threads queue jobs for them. TTS_REPLICAS/TTS_WORKERS_MODE/TTS_QUEUE_SIZE.
+# With TTS_SENTENCE_PARALLEL the sentences of a text are spread over them (see tts_audio)
+POOL = pool_from_env("tts", "TTS", _load_model)
 
 # Load Thrift IDL
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 T_THrift = thriftpy2.load(os.path.join(BASE_DIR, "thrift", "tts.thrift"), module_name="tts_thrift")
 
+# Open SynthesizeOpen/SynthesizeNext streams; abandoned ones expire after STREAM_TTL seconds
+STREAM_TTL = float(os.getenv("TTS_STREAM_TTL", "300"))
+STREAMS = {}
+STREAMS_LOCK = threading.Lock()
+
 def _generate_cache_key(text: str) -> str:
     payload = {"text": text, "model": MODEL_ID}
     return hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-def async_lru_cache(maxsize: int = 1000):
-    cache = {}
-    queue = []
-
-    def decorator(fn):
-        @wraps(fn)
-        async def wrapper(*args, **kwargs):
-            key = str((args, frozenset(kwargs.items())))
-            if key in cache:
-                return cache[key]
-            result = await fn(*args, **kwargs)
-            if len(queue) >= maxsize:
-                old_key = queue.pop(0)
-                cache.pop(old_key, None)
-            cache[key] = result
-            queue.append(key)
-            return result
-
-        return wrapper
-    return decorator
-
-@async_lru_cache(maxsize=1000)
+# WAVs keyed by _generate_cache_key (text + model); limits from TTS_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL.
+# Shared by all handler threads, with single-flight across them.
+WAVS = cache_from_env("tts", "TTS_CACHE", maxsize=1000, max_bytes=256 * 1024 * 1024)
+CACHE_STATS_INTERVAL = float(os.getenv("CACHE_STATS_INTERVAL", "60"))
+
+@cached(WAVS, key_fn=lambda cache_key, text: cache_key)
 async def _cached_synthesize(cache_key: str, text: str) -> bytes:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        out_path = Path(tmpdir) / "out.wav"
-        tts.tts_to_file(text=text, file_path=out_path)
-        data = out_path.read_bytes()
-    return data
+    # Pool job: synthesized on a replica's worker and encoded to WAV in memory
+    return await POOL.run(synthesize_wav, text)
+
+async def _synthesize(text: str) -> bytes:
+    return await _cached_synthesize(_generate_cache_key(text), text)
 
 class TTSServiceHandler:
     def Synthesize(self, text: str):
@@ -66,23 +65,62 @@ class TTSServiceHandler:
             text = (text or "").strip()
             if not text:
                 return T_THrift.SynthReply(audio=b"", error="Empty text provided")
-            if tts is None:
+            if POOL.failed:
                 return T_THrift.SynthReply(audio=b"", error="TTS model not loaded")
             # Use cache (run async function synchronously)
-            import asyncio
-            cache_key = _generate_cache_key(text)
-            data = asyncio.run(_cached_synthesize(cache_key, text))
+            data = run_coroutine(synthesize_text(_synthesize, text))
             return T_THrift.SynthReply(audio=data, error="")
         except Exception as e:
             logger.exception("Synthesis error")
             return T_THrift.SynthReply(audio=b"", error=str(e))
 
+    def SynthesizeOpen(self, text: str) -> str:
+        stream_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with STREAMS_LOCK:
+            for expired in [k for k, v in STREAMS.items() if now - v["touched"] > STREAM_TTL]:
+                STREAMS.pop(expired, None)
+            STREAMS[stream_id] = {
+                "sentences": split_sentences((text or "").strip()),
+                "writer": WavStreamWriter(),
+                "touched": now,
+            }
+        return stream_id
+
+    def SynthesizeNext(self, stream_id: str):
+        with STREAMS_LOCK:
+            stream = STREAMS.get(stream_id)
+            if stream is not None:
+                stream["touched"] = time.monotonic()
+        if stream is None:
+            return T_THrift.SynthChunk(audio=b"", done=True, error="Unknown or expired stream")
+        try:
+            if POOL.failed:
+                raise RuntimeError("TTS model not loaded")
+            if not stream["sentences"]:
+                if stream["writer"].fmt is None:
+                    raise RuntimeError("Empty text provided")
+                with STREAMS_LOCK:
+                    STREAMS.pop(stream_id, None)
+                return T_THrift.SynthChunk(audio=b"", done=True, error="")
+            sentence = stream["sentences"].pop(0)
+            # Sentences are cached individually, so repeated answers stream from memory
+            data = run_coroutine(_cached_synthesize(_generate_cache_key(sentence), sentence))
+            return T_THrift.SynthChunk(audio=stream["writer"].chunk(data), done=False, error="")
+        except Exception as e:
+            logger.exception("Streaming synthesis error")
+            with STREAMS_LOCK:
+                STREAMS.pop(stream_id, None)
+            return T_THrift.SynthChunk(audio=b"", done=True, error=str(e))
+
 def serve() -> None:
     host = os.getenv("TTS_THRIFT_HOST", "0.0.0.0")
     port = int(os.getenv("TTS_THRIFT_PORT", "50053"))
     logger.info(f"Starting TTS Thrift server on {host}:{port}")
-    server = make_server(T_THrift.TTSService, TTSServiceHandler(), host, port)
-    server.serve()
+    log_stats(CACHE_STATS_INTERVAL, WAVS, POOL)
+    # client_timeout=0 keeps idle pooled maestro connections open (as in STT/LLM)
+    # THRIFT_SERVER_MODE picks threaded/pool/prefork/async, see thrift_server.py
+    serve_thrift(T_THrift.TTSService, TTSServiceHandler(), host, port, client_timeout=0)
 
 if __name__ == "__main__":
     serve()
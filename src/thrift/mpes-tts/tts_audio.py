@@ -0,0 +1,107 @@
+# Synced from src/common/tts_audio.py by syncCommon.sh. DO NOT EDIT.
+"""Coqui TTS synthesis straight to WAV bytes, without a temporary file.
+
+``tts_to_file`` synthesizes, writes a WAV to disk, and the services read it
+back. At high concurrency that meant a temporary directory, a file write and
+a read per request, plus copies of the audio on the way. Here the model's
+waveform is encoded into one buffer sized for the header and the frames, and
+the 16-bit samples are written into it in place.
+
+The output is what ``tts_to_file`` wrote: 16-bit mono PCM at the model's
+output rate, peak-normalized like Coqui's ``save_wav``.
+
+Coqui synthesizes a text one sentence after another, in a single call. With
+``TTS_SENTENCE_PARALLEL`` the services split the text themselves. Every
+sentence becomes its own pool job, so with ``TTS_WORKERS_MODE=process`` and
+``TTS_REPLICAS`` > 1 the sentences run at once on replica processes that each
+hold a model. ``concat_wavs`` then joins the WAVs in order, with
+``TTS_SENTENCE_GAP_MS`` of extra silence between them. Coqui already ends
+every sentence with a pause of its own, so the default is 0. Each sentence
+is normalized to its own peak, as in the streamed responses.
+``TTS_TORCH_THREADS`` caps torch's threads per replica (``set_threads``), so
+that the processes share the cores instead of each taking all of them.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, List
+
+import numpy as np
+
+from textseg import split_sentences
+from wavstream import WavFormat, parse_wav, wav_header
+
+HEADER_SIZE = 44
+SENTENCE_PARALLEL = os.getenv("TTS_SENTENCE_PARALLEL", "0").lower() in ("1", "true", "yes")
+SENTENCE_GAP_MS = float(os.getenv("TTS_SENTENCE_GAP_MS", "0"))
+TORCH_THREADS = int(os.getenv("TTS_TORCH_THREADS", "0"))
+
+
+def set_threads() -> None:
+    """Apply ``TTS_TORCH_THREADS`` in the process loading a replica (0: torch's default)."""
+    if TORCH_THREADS > 0:
+        import torch
+
+        torch.set_num_threads(TORCH_THREADS)
+
+
+def wav_bytes(samples, sample_rate: int) -> bytes:
+    """16-bit mono WAV of the float waveform ``samples``."""
+    samples = np.asarray(samples, dtype=np.float32)
+    data_size = 2 * len(samples)
+    buf = bytearray(HEADER_SIZE + data_size)
+    buf[:HEADER_SIZE] = wav_header(WavFormat(1, sample_rate, 16), data_size)
+    if len(samples):
+        peak = max(0.01, float(np.max(np.abs(samples))))
+        frames = np.frombuffer(buf, dtype="<i2", offset=HEADER_SIZE)
+        # Scaled and truncated to int16 straight into the buffer, as save_wav's astype(np.int16)
+        np.multiply(samples, 32767 / peak, out=frames, casting="unsafe")
+    return bytes(buf)
+
+
+def synthesize_wav(model, text: str) -> bytes:
+    """The WAV of ``text`` spoken by the Coqui ``TTS`` ``model``."""
+    return wav_bytes(model.tts(text=text), model.synthesizer.output_sample_rate)
+
+
+def concat_wavs(wavs: List[bytes], gap_ms: float = SENTENCE_GAP_MS) -> bytes:
+    """One WAV of ``wavs`` (all of one format) in order, ``gap_ms`` of silence between them."""
+    parts = [parse_wav(wav) for wav in wavs]
+    fmt = parts[0][0]
+    for other, _ in parts[1:]:
+        if other != fmt:
+            raise ValueError(f"WAV formats differ: {other} != {fmt}")
+    gap = int(fmt.sample_rate * gap_ms / 1000) * fmt.block_align
+    data_size = sum(len(frames) for _, frames in parts) + gap * (len(parts) - 1)
+    buf = bytearray(HEADER_SIZE + data_size)
+    buf[:HEADER_SIZE] = wav_header(fmt, data_size)
+    offset = HEADER_SIZE
+    for i, (_, frames) in enumerate(parts):
+        # The gaps are left as allocated: zeros, i.e. silence in signed PCM
+        offset += gap if i else 0
+        buf[offset : offset + len(frames)] = frames
+        offset += len(frames)
+    return bytes(buf)
+
+
+async def sentence_wavs(synthesize: Callable[[str], Awaitable[bytes]], sentences: List[str]) -> AsyncIterator[bytes]:
+    """Yield ``await synthesize(sentence)`` in order; with ``TTS_SENTENCE_PARALLEL`` all of them start at once."""
+    if not SENTENCE_PARALLEL:
+        for sentence in sentences:
+            yield await synthesize(sentence)
+        return
+    tasks = [asyncio.ensure_future(synthesize(sentence)) for sentence in sentences]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # The consumer stopped early (client gone, error): drop the jobs still queued
+        for task in tasks:
+            task.cancel()
+
+
+async def synthesize_text(synthesize: Callable[[str], Awaitable[bytes]], text: str) -> bytes:
+    """The WAV of ``text``: one ``synthesize`` call, or one per sentence with ``TTS_SENTENCE_PARALLEL``."""
+    sentences = split_sentences(text) if SENTENCE_PARALLEL else []
+    if len(sentences) < 2:
+        return await synthesize(text)
+    return concat_wavs(await asyncio.gather(*(synthesize(sentence) for sentence in sentences)))
@@ -0,0 +1,100 @@
+# Synced from src/common/wavstream.py by syncCommon.sh. DO NOT EDIT.
+"""WAV helpers for streaming PCM audio in chunks."""
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# Size used in RIFF/data headers when the final length is unknown
+STREAM_SIZE = 0xFFFFFFFF
+
+
+class WavFormat(NamedTuple):
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.bits_per_sample // 8
+
+
+def wav_header(fmt: WavFormat, data_size: Optional[int] = None) -> bytes:
+    """Build a 44-byte PCM WAV header.
+
+    With ``data_size=None`` the RIFF and data sizes are set to 0xFFFFFFFF, the
+    convention players and ffmpeg accept for a stream of unknown length.
+    """
+    if data_size is None:
+        riff_size = data_size = STREAM_SIZE
+    else:
+        riff_size = 36 + data_size
+    byte_rate = fmt.sample_rate * fmt.block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, fmt.channels, fmt.sample_rate, byte_rate, fmt.block_align, fmt.bits_per_sample,
+        b"data", data_size,
+    )
+
+
+# fmt chunk audio formats
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav(data: bytes) -> Tuple[int, WavFormat, memoryview]:
+    """Return the audio format tag, the format and a zero-copy view of the frames of a WAV file.
+
+    WAVE_FORMAT_EXTENSIBLE files report the format of their sub-format GUID.
+    """
+    view = memoryview(data)
+    if len(data) < 12 or data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    audio_format = 0
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        (chunk_size,) = struct.unpack_from("<I", data, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The first two bytes of the sub-format GUID are the actual format tag
+                (audio_format,) = struct.unpack_from("<H", data, body + 24)
+            fmt = WavFormat(channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            end = len(data) if chunk_size == STREAM_SIZE else min(body + chunk_size, len(data))
+            return audio_format, fmt, view[body:end]
+        offset = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def parse_wav(data: bytes) -> Tuple[WavFormat, memoryview]:
+    """Return the format and a zero-copy view of the PCM frames of a WAV file."""
+    audio_format, fmt, frames = read_wav(data)
+    if audio_format != WAVE_FORMAT_PCM:
+        raise ValueError(f"Unsupported WAV encoding: {audio_format}")
+    return fmt, frames
+
+
+class WavStreamWriter:
+    """Turn a sequence of WAV files into the chunks of a single streamed WAV.
+
+    The first chunk carries a streaming header, every chunk after that is raw
+    PCM. All inputs must share the same format.
+    """
+
+    def __init__(self):
+        self.fmt: Optional[WavFormat] = None
+
+    def chunk(self, wav: bytes) -> bytes:
+        fmt, pcm = parse_wav(wav)
+        if self.fmt is None:
+            self.fmt = fmt
+            return wav_header(fmt) + pcm
+        if fmt != self.fmt:
+            raise ValueError(f"WAV format changed mid-stream: {fmt} != {self.fmt}")
+        return bytes(pcm)
@@ -1,5 +1,10 @@
 #!/bin/bash
 
+# Same wire format for every process (see thrift.env)
+set -a
+. "$(dirname "$0")/thrift.env"
+set +a
+
 # Run each model on a separate tmux window
 tmux new-session "python maestro/app.py" \; \
   split-window -h -p 50 "python mpes-llm/app.py" \; \
@@ -8,7 +8,9 @@ struct GenRequest {
   5: i32 top_k,
   6: double repeat_penalty,
   7: double presence_penalty,
-  8: double frequency_penalty
+  8: double frequency_penalty,
+  // Skip the semantic cache (answers reused for paraphrases); the exact cache still applies
+  9: bool bypass_semantic_cache
 }
 
 struct GenReply {
@@ -16,6 +18,19 @@ struct GenReply {
   2: string error
 }
 
+// Text decoded since the previous GenerateNext call; done on the last one
+struct GenChunk {
+  1: string delta,
+  2: bool done,
+  3: string finish_reason,
+  4: string error
+}
+
 service LLMService {
-  GenReply Generate(1: GenRequest req)
+  GenReply Generate(1: GenRequest req),
+  // Thrift has no server streaming: GenerateOpen starts decoding in the background and
+  // GenerateNext long-polls its text, waiting up to wait_ms for some. A stream lives in the
+  // server process that started it, so poll it on the connection that started it.
+  string GenerateOpen(1: GenRequest req),
+  GenChunk GenerateNext(1: string stream_id, 2: i32 wait_ms)
 }
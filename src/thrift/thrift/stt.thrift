@@ -1,8 +1,16 @@
 namespace py mpes.stt
 
+struct Segment {
+  1: double start_time,
+  2: double end_time,
+  3: string text
+}
+
 struct TranscribeReply {
   1: string text,
-  2: string error
+  2: string error,
+  // Speech segments in order, when the service runs with VAD (STT_VAD=1)
+  3: list<Segment> segments
 }
 
 service STTService {
@@ -5,6 +5,16 @@ struct SynthReply {
   2: string error
 }
 
+struct SynthChunk {
+  1: binary audio,
+  2: bool done,
+  3: string error
+}
+
 service TTSService {
-  SynthReply Synthesize(1: string text)
+  SynthReply Synthesize(1: string text),
+  // Chunked synthesis (Thrift has no server streaming): open a stream, then
+  // pull one sentence per call. The first chunk starts with a streaming WAV header.
+  string SynthesizeOpen(1: string text),
+  SynthChunk SynthesizeNext(1: string stream_id)
 }